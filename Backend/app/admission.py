@@ -0,0 +1,207 @@
+"""
+Admission control and rate limiting.
+
+Every request is sorted into a ``RouteClass`` by its route template. A class
+bounds how many of its requests run at once. Requests over that limit wait
+in a bounded queue for up to ``queue_timeout`` seconds; those that find the
+queue full, or time out in it, get an immediate 503 with Retry-After instead
+of piling up until everything times out. A class can also have token-bucket
+rate limits per client IP, checked by ``AdmissionMiddleware``, and per user,
+checked by ``limit_user`` once an endpoint knows who is calling. Requests
+over a rate limit get 429 with Retry-After.
+
+The service keeps its ``Admission`` in ``app.state.admission``; without one
+the middleware lets everything through. State lives in process memory, so
+with several workers each one enforces the limits on its own share.
+
+The Auth Service keeps an identical copy of this module.
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+
+# Clients remembered per token-bucket limit; the least recently seen are forgotten first
+MAX_TRACKED_CLIENTS = 100_000
+
+
+class TokenBuckets:
+    """One token bucket per key: ``rate`` tokens a second, up to ``burst`` saved."""
+
+    def __init__(self, rate, burst, max_keys=MAX_TRACKED_CLIENTS, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = OrderedDict()  # key -> (tokens, last refill)
+
+    def take(self, key):
+        """Spend a token of ``key``; return 0 if there was one, else the seconds until there is."""
+        if not self.rate:
+            return 0.0
+        now = self._clock()
+        tokens, last = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class ConcurrencyLimit:
+    """At most ``limit`` holders at a time and ``queue`` waiting; 0 means no limit."""
+
+    def __init__(self, limit, queue, timeout):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = deque()
+
+    async def acquire(self):
+        """Take a slot, waiting in the queue if needed; return False if the request should be turned away."""
+        if not self.limit or (self.active < self.limit and not self._waiters):
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over as the wait ended; pass it on
+                self.release()
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+            return False
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # the slot moves to the waiter as is
+                return
+        self.active -= 1
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+
+class RouteClass:
+    def __init__(self, name, concurrency=0, queue=0, queue_timeout=1.0, ip_rate=0.0, ip_burst=1, user_rate=0.0, user_burst=1):
+        self.name = name
+        self.slots = ConcurrencyLimit(int(concurrency), int(queue), float(queue_timeout))
+        self.per_ip = TokenBuckets(float(ip_rate), float(ip_burst))
+        self.per_user = TokenBuckets(float(user_rate), float(user_burst))
+        self.retry_after = max(1, math.ceil(float(queue_timeout)))
+        self.stats = {"admitted": 0, "shed": 0, "throttled_ip": 0, "throttled_user": 0}
+
+
+def parse_class(name, spec=""):
+    """Build a ``RouteClass`` from settings like ``"concurrency=4,queue=16,ip_rate=5"``."""
+    settings = {}
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, value = part.partition("=")
+        settings[key.strip()] = float(value)
+    return RouteClass(name, **settings)
+
+
+class Admission:
+    """Route classes and the rules sorting requests into them.
+
+    ``routes`` maps ``"METHOD /route/template"`` to a class name. Routes not
+    listed fall back to an entry for their method alone, then to ``"*"``.
+    """
+
+    def __init__(self, classes, routes):
+        self.classes = {route_class.name: route_class for route_class in classes}
+        self.routes = routes
+
+    def classify(self, scope):
+        route = None
+        for candidate in scope["app"].router.routes:
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                route = candidate
+                break
+        method = scope["method"]
+        path = getattr(route, "path", None)
+        name = self.routes.get(f"{method} {path}") or self.routes.get(method) or self.routes["*"]
+        return self.classes[name], route
+
+    def stats(self):
+        return {
+            name: dict(route_class.stats, active=route_class.slots.active, waiting=route_class.slots.waiting)
+            for name, route_class in self.classes.items()
+        }
+
+
+def _client_ip(scope):
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _reject(status_code, detail, retry_after):
+    return JSONResponse({"detail": detail}, status_code=status_code, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware; streaming responses hold their slot until the last chunk."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        admission = getattr(scope["app"].state, "admission", None) if scope["type"] == "http" else None
+        if admission is None:
+            await self.app(scope, receive, send)
+            return
+
+        route_class, route = admission.classify(scope)
+        # For limit_user, and so /metrics labels rejected requests by route
+        scope.setdefault("state", {})["route_class"] = route_class
+        if route is not None:
+            scope["route"] = route
+
+        wait = route_class.per_ip.take(_client_ip(scope))
+        if wait:
+            route_class.stats["throttled_ip"] += 1
+            await _reject(429, "Too many requests", wait)(scope, receive, send)
+            return
+        if not await route_class.slots.acquire():
+            route_class.stats["shed"] += 1
+            await _reject(503, "Server is busy, try again shortly", route_class.retry_after)(scope, receive, send)
+            return
+        route_class.stats["admitted"] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.slots.release()
+
+
+def limit_user(request, user_id):
+    """Spend a token of ``user_id``'s rate limit for this request's route class; 429 when there is none."""
+    route_class = getattr(request.state, "route_class", None)
+    if route_class is None:
+        return
+    wait = route_class.per_user.take(user_id)
+    if wait:
+        route_class.stats["throttled_user"] += 1
+        raise HTTPException(status_code=429, detail="Too many requests", headers={"Retry-After": str(max(1, math.ceil(wait)))})
@@ -0,0 +1,87 @@
+"""
+Spend time series for ``GET /analytics/spend``.
+
+Series are read from ``spend_buckets``, which the expense write path keeps
+current for every day, ISO week and month (see ``app.rollups``). A query
+touches one row per bucket, budget and category in the range, so its cost
+does not depend on how many expenses fall into it.
+"""
+
+from datetime import timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import func, select
+
+from . import config, models, rollups, schemas
+
+Buckets = models.SpendBucket
+
+
+def _next_start(start, grain):
+    if grain == "day":
+        return start + timedelta(days=1)
+    if grain == "week":
+        return start + timedelta(days=7)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def bucket_range(start, end, grain):
+    """Return the starts of the buckets overlapping ``[start, end)``."""
+    starts = []
+    bucket = rollups.bucket_starts(start)[grain]
+    while bucket < end:
+        if len(starts) == config.ANALYTICS_MAX_BUCKETS:
+            raise HTTPException(
+                status_code=422,
+                detail=f"The range spans more than {config.ANALYTICS_MAX_BUCKETS} {grain} buckets; use a coarser granularity",
+            )
+        starts.append(bucket)
+        bucket = _next_start(bucket, grain)
+    return starts
+
+
+async def spend_series(db, user_id, granularity, start, end, group=schemas.SpendGroup.budget, budget_id=None, category=None):
+    """Return one dense ``SpendSeries`` per budget, category or both.
+
+    Buckets are whole days, weeks or months, so the first and last may cover
+    spend outside ``[start, end)``. Amounts are summed as stored, without
+    currency conversion, so spend in several currencies makes one series per
+    currency.
+    """
+    if end <= start:
+        raise HTTPException(status_code=422, detail="end must be after start")
+    grain = granularity.value
+    starts = bucket_range(start, end, grain)
+
+    b = models.Budget
+    keys = {
+        schemas.SpendGroup.budget: [Buckets.budget_id],
+        schemas.SpendGroup.category: [Buckets.category],
+        schemas.SpendGroup.budget_category: [Buckets.budget_id, Buckets.category],
+    }[group] + [Buckets.currency]
+    query = (
+        select(*keys, Buckets.start, func.sum(Buckets.total), func.sum(Buckets.count))
+        .join(b, b.id == Buckets.budget_id)
+        .where(b.user_id == user_id, Buckets.grain == grain, Buckets.start >= starts[0], Buckets.start < end)
+        .group_by(*keys, Buckets.start)
+        .order_by(*keys, Buckets.start)
+    )
+    if budget_id is not None:
+        query = query.where(Buckets.budget_id == budget_id)
+    if category is not None:
+        query = query.where(Buckets.category == category)
+
+    found = {}  # series key -> {start: (total, count)}
+    for row in await db.execute(query):
+        *key, bucket, total, count = row
+        found.setdefault(tuple(key), {})[bucket] = (total, count)
+
+    series = []
+    for key, buckets in found.items():
+        labels = dict(zip([column.key for column in keys], key))
+        points = []
+        for bucket in starts:
+            total, count = buckets.get(bucket, (0.0, 0))
+            points.append(schemas.SpendPoint(start=bucket, total=total, count=count))
+        series.append(schemas.SpendSeries(**labels, points=points))
+    return schemas.SpendAnalytics(granularity=granularity, group=group, series=series)
@@ -0,0 +1,170 @@
+"""
+All-or-nothing batches of budget and expense writes for ``POST /batch``.
+
+Operations are checked up front against the budgets and expenses they
+reference, which are loaded with one query each, and then applied in a
+single transaction: one commit, one change log insert and one running-total
+update per (budget, category) and per spend bucket, however many operations
+the batch holds.
+"""
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import select
+
+from . import changes, models, purge, rollups, schemas, versions
+
+Op = schemas.BatchOp
+
+
+def _fail(status_code, errors):
+    raise HTTPException(status_code=status_code, detail=errors)
+
+
+def _parse(operations):
+    """Validate the shape of every operation; return the parsed create/update data."""
+    errors, parsed = [], []
+    for index, operation in enumerate(operations):
+        is_expense = operation.entity == schemas.ChangeEntity.expense
+        problems = []
+        if operation.op != Op.create and operation.id is None:
+            problems.append("id is required")
+        if is_expense and operation.budget_id is None:
+            problems.append("budget_id is required")
+        data = None
+        if operation.op == Op.delete:
+            pass
+        elif operation.data is None:
+            problems.append("data is required")
+        else:
+            try:
+                if is_expense:
+                    schema = schemas.ExpenseCreate
+                else:
+                    schema = schemas.BudgetCreate if operation.op == Op.create else schemas.BudgetUpdate
+                data = schema(**operation.data)
+            except ValidationError as exc:
+                problems.extend(f"data.{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors())
+        if problems:
+            errors.append({"index": index, "errors": problems})
+        parsed.append(data)
+    if errors:
+        _fail(422, errors)
+    return parsed
+
+
+async def _load(db, user_id, operations):
+    """Fetch the user's referenced budgets and the referenced expenses, one query each."""
+    budget_ids = {op.budget_id for op in operations if op.entity == schemas.ChangeEntity.expense}
+    budget_ids |= {op.id for op in operations if op.entity == schemas.ChangeEntity.budget and op.op != Op.create}
+    budgets = {}
+    if budget_ids:
+        budgets = {b.id: b for b in (await db.execute(
+            select(models.Budget).where(models.Budget.id.in_(budget_ids), models.Budget.user_id == user_id)
+        )).scalars()}
+
+    expense_ids = {op.id for op in operations if op.entity == schemas.ChangeEntity.expense and op.op != Op.create}
+    expenses = {}
+    if expense_ids and budgets:
+        expenses = {e.id: e for e in (await db.execute(
+            select(models.Expense).where(models.Expense.id.in_(expense_ids), models.Expense.budget_id.in_(budgets))
+        )).scalars()}
+    return budgets, expenses
+
+
+def _check_references(operations, budgets, expenses):
+    # Walk the batch in order, so rows deleted by an earlier operation count as gone
+    budgets, expenses = dict(budgets), dict(expenses)
+    errors = []
+    for index, op in enumerate(operations):
+        if op.entity == schemas.ChangeEntity.budget:
+            if op.op != Op.create and op.id not in budgets:
+                errors.append({"index": index, "errors": ["Budget not found"]})
+            elif op.op == Op.delete:
+                del budgets[op.id]
+            continue
+        if op.budget_id not in budgets:
+            errors.append({"index": index, "errors": ["Budget not found"]})
+        elif op.op != Op.create and (op.id not in expenses or expenses[op.id].budget_id != op.budget_id):
+            errors.append({"index": index, "errors": ["Expense not found"]})
+        elif op.op == Op.delete:
+            del expenses[op.id]
+    if errors:
+        _fail(404, errors)
+
+
+def _budget_row(budget):
+    return schemas.BudgetRow(id=budget.id, name=budget.name, limit=budget.limit, currency=budget.currency, user_id=budget.user_id)
+
+
+def _expense_row(expense):
+    return schemas.Expense(
+        id=expense.id, description=expense.description, amount=expense.amount, currency=expense.currency,
+        category=expense.category, date=expense.date, budget_id=expense.budget_id,
+    )
+
+
+async def apply(db, user_id, operations):
+    """Apply ``operations`` for ``user_id`` and return one ``BatchResult`` per operation.
+
+    Raises a 422 for malformed operations and a 404 for references to rows the
+    user does not own; either way nothing is written. The caller commits.
+    """
+    parsed = _parse(operations)
+    budgets, expenses = await _load(db, user_id, operations)
+    _check_references(operations, budgets, expenses)
+
+    deltas = rollups.Deltas()
+    dropped = set()
+    created = []  # expenses get their date when flushed
+
+    touched = []  # (operation, row) in batch order
+    for op, data in zip(operations, parsed):
+        if op.entity == schemas.ChangeEntity.budget:
+            if op.op == Op.create:
+                row = models.Budget(**data.dict(), user_id=user_id)
+                db.add(row)
+            else:
+                row = budgets[op.id]
+                if op.op == Op.update:
+                    row.name, row.limit, row.currency = data.name, data.limit, data.currency or row.currency
+                else:
+                    await purge.enqueue(db, row)
+                    dropped.add(row.id)
+        else:
+            if op.op == Op.create:
+                # Expenses without a currency are in their budget's currency
+                currency = data.currency or budgets[op.budget_id].currency
+                row = models.Expense(**dict(data.dict(), currency=currency), budget_id=op.budget_id)
+                db.add(row)
+                created.append(row)
+            else:
+                row = expenses[op.id]
+                deltas.add_expense(row, -1)
+                if op.op == Op.update:
+                    row.description, row.amount, row.category = data.description, data.amount, data.category
+                    row.currency = data.currency or row.currency
+                    deltas.add_expense(row)
+                else:
+                    await db.delete(row)
+        touched.append((op, row))
+
+    # One flush assigns the ids of every created row
+    await db.flush()
+    for row in created:
+        deltas.add_expense(row)
+    await deltas.apply(db, skip_budgets=dropped)
+    for budget_id in dropped:
+        await rollups.drop_budget(db, budget_id)
+
+    log_ops = {Op.create: "insert", Op.update: "update", Op.delete: "delete"}
+    await changes.record_all(db, user_id, [(op.entity.value, log_ops[op.op], row.id) for op, row in touched])
+    await versions.bump(db, user_id)
+
+    results = []
+    for index, (op, row) in enumerate(touched):
+        data = None
+        if op.op != Op.delete:
+            data = _budget_row(row) if op.entity == schemas.ChangeEntity.budget else _expense_row(row)
+        results.append(schemas.BatchResult(index=index, op=op.op, entity=op.entity, id=row.id, data=data))
+    return results
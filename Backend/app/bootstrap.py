@@ -0,0 +1,72 @@
+"""
+One-off schema setup for the Budget Service.
+
+Run once per deployment, before the workers start:
+
+    python -m app.bootstrap
+
+With SHARDS set it prepares every shard. It is idempotent: existing tables are left alone and only missing tables,
+columns and indexes are created. Running totals from before they were kept per currency are the exception: those tables
+are recreated and rebuilt from the expenses.
+"""
+
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
+
+from . import database, models, rollups, search, shards
+
+ROLLUP_TABLES = (models.BudgetCategoryTotal.__table__, models.SpendBucket.__table__)
+
+
+def add_missing_columns(bind):
+    """Add columns that have a server default or are nullable to existing tables."""
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and (column.server_default is not None or column.nullable):
+                    table_name = bind.dialect.identifier_preparer.format_table(table)
+                    ddl = CreateColumn(column).compile(dialect=bind.dialect)
+                    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {ddl}"))
+
+
+def drop_rollups_without_currency(bind):
+    """Drop the rollup tables if they predate the currency in their key; return whether they were."""
+    inspector = inspect(bind)
+    if not inspector.has_table("budget_category_totals"):
+        return False
+    if "currency" in {column["name"] for column in inspector.get_columns("budget_category_totals")}:
+        return False
+    models.Base.metadata.drop_all(bind=bind, tables=ROLLUP_TABLES)
+    return True
+
+
+def init_db(bind=None):
+    bind = bind or database.engine
+    add_missing_columns(bind)
+    # The currency is part of the primary key, so it cannot be added in place
+    refill = drop_rollups_without_currency(bind)
+    models.Base.metadata.create_all(bind=bind)
+    # create_all skips indexes of tables that already exist, so add any missing ones
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+    if refill:
+        with Session(bind) as db:
+            rollups.rebuild(db)
+            db.commit()
+    search.init_index(bind)
+
+
+def main():
+    for shard in shards.router.shards:
+        init_db(shard.engine)
+    print("Budget Service database is ready")
+
+
+if __name__ == "__main__":
+    main()
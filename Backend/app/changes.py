@@ -0,0 +1,232 @@
+"""
+Change log and delta sync for budgets and expenses.
+
+Every write endpoint records the rows it touched in ``changes`` inside its
+own transaction. ``GET /changes?since=<seq>`` returns the current state of
+every row changed after ``seq``, and ``GET /changes/stream`` pushes the same
+feed as Server-Sent Events. ``python -m app.changes`` compacts old entries.
+
+Seqs are allocated by the single SQLite writer, so they commit in order: a
+reader that has seen seq N has seen every change before it.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import config, models, schemas, shards
+
+Changes = models.Change
+Horizon = models.ChangeLogHorizon
+
+
+async def record(db, user_id, entity, op, *entity_ids):
+    await record_all(db, user_id, [(entity, op, entity_id) for entity_id in entity_ids])
+
+
+async def record_all(db, user_id, entries):
+    """Log ``(entity, op, entity_id)`` entries, in order."""
+    await db.execute(insert(Changes), [
+        {"user_id": user_id, "entity": entity, "entity_id": entity_id, "op": op} for entity, op, entity_id in entries
+    ])
+
+
+async def latest_seq(db):
+    seq = (await db.execute(select(func.max(Changes.seq)))).scalar()
+    if seq is None:
+        seq = (await db.execute(select(Horizon.seq))).scalar()
+    return seq or 0
+
+
+async def check_horizon(db, since):
+    horizon = (await db.execute(select(Horizon.seq))).scalar() or 0
+    if since < horizon:
+        raise HTTPException(status_code=410, detail="Changes since this seq were compacted; reload all data")
+
+
+async def read_feed(db, user_id, since, limit):
+    await check_horizon(db, since)
+    entries = (await db.execute(
+        select(Changes.seq, Changes.entity, Changes.entity_id, Changes.op)
+        .where(Changes.user_id == user_id, Changes.seq > since)
+        .order_by(Changes.seq)
+        .limit(limit + 1)
+    )).all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    # One change per row, at its last seq; a row created in this window is
+    # still an insert for the client, whatever happened to it afterwards
+    latest = {}
+    for seq, entity, entity_id, op in entries:
+        previous = latest.get((entity, entity_id))
+        inserted = op == "insert" or (previous is not None and previous[2])
+        latest[(entity, entity_id)] = (seq, op, inserted)
+
+    wanted = {"budget": [], "expense": []}
+    for (entity, entity_id), (_, op, _) in latest.items():
+        if op != "delete":
+            wanted[entity].append(entity_id)
+    rows = {"budget": {}, "expense": {}}
+    if wanted["budget"]:
+        b = models.Budget
+        for row in await db.execute(
+            select(b.id, b.name, b.limit, b.currency, b.user_id).where(b.id.in_(wanted["budget"]), b.user_id == user_id)
+        ):
+            rows["budget"][row.id] = schemas.BudgetRow(**row._mapping)
+    if wanted["expense"]:
+        e, b = models.Expense, models.Budget
+        for row in await db.execute(
+            select(e.id, e.description, e.amount, e.currency, e.category, e.date, e.budget_id)
+            .join(b, b.id == e.budget_id)
+            .where(e.id.in_(wanted["expense"]), b.user_id == user_id)
+        ):
+            rows["expense"][row.id] = schemas.Expense(**row._mapping)
+
+    changes = []
+    for (entity, entity_id), (seq, op, inserted) in sorted(latest.items(), key=lambda item: item[1][0]):
+        data = rows[entity].get(entity_id)
+        if data is None:
+            # Deleted, possibly by a change past this page
+            if inserted:
+                continue  # created and deleted since the client last synced
+            op = "delete"
+        else:
+            op = "insert" if inserted else "update"
+        changes.append(schemas.Change(seq=seq, entity=entity, op=op, id=entity_id, data=data))
+    return schemas.ChangeFeed(seq=entries[-1].seq if entries else since, changes=changes, more=more)
+
+
+class ChangeHub:
+    """Wakes a user's SSE streams when that user's data changes.
+
+    Writes made by this process notify directly. Writes made by other workers
+    are picked up by one poller per process, which reads the newest seq every
+    ``poll_interval`` seconds while anyone is subscribed. Idle streams cost no
+    database work at all.
+    """
+
+    def __init__(self, poll_interval=config.CHANGES_POLL_SECONDS):
+        self.poll_interval = poll_interval
+        self.subscribers = 0
+        self._counts = {}  # user_id -> open streams
+        self._events = {}  # user_id -> event set on that user's next change
+        self._poller = None
+
+    def subscribe(self, user_id):
+        self._counts[user_id] = self._counts.get(user_id, 0) + 1
+        self.subscribers += 1
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.ensure_future(self._poll())
+
+    def unsubscribe(self, user_id):
+        self.subscribers -= 1
+        self._counts[user_id] -= 1
+        if not self._counts[user_id]:
+            del self._counts[user_id]
+            self._events.pop(user_id, None)
+
+    def listen(self, user_id):
+        event = self._events.get(user_id)
+        if event is None:
+            event = self._events[user_id] = asyncio.Event()
+        return event
+
+    def notify(self, user_id):
+        event = self._events.pop(user_id, None)
+        if event is not None:
+            event.set()
+
+    async def _poll(self):
+        last = {}  # shard url -> newest seq seen there
+        while self.subscribers:
+            for shard in shards.router.shards:
+                try:
+                    async with shard.AsyncReadSessionLocal() as db:
+                        seq = (await db.execute(select(func.max(Changes.seq)))).scalar() or 0
+                        previous = last.get(shard.url)
+                        if previous is not None and seq > previous:
+                            users = (await db.execute(
+                                select(Changes.user_id).where(Changes.seq > previous, Changes.seq <= seq).distinct()
+                            )).scalars()
+                            for user_id in users:
+                                self.notify(user_id)
+                        last[shard.url] = seq
+                except SQLAlchemyError:
+                    pass  # try again next round
+            await asyncio.sleep(self.poll_interval)
+
+
+hub = ChangeHub()
+
+
+def format_event(feed):
+    data = json.dumps(jsonable_encoder(feed), separators=(",", ":"))
+    return f"id: {feed.seq}\nevent: changes\ndata: {data}\n\n"
+
+
+async def stream(user_id, since):
+    """Yield Server-Sent Events with every change for ``user_id`` after ``since``."""
+    hub.subscribe(user_id)
+    try:
+        while True:
+            # Listen before reading, so a change committed in between still wakes us
+            event = hub.listen(user_id)
+            async with shards.router.for_user(user_id).AsyncReadSessionLocal() as db:
+                try:
+                    feed = await read_feed(db, user_id, since, config.CHANGES_PAGE_SIZE)
+                except HTTPException:
+                    yield "event: reset\ndata: {}\n\n"
+                    return
+            if feed.changes:
+                yield format_event(feed)
+            since = feed.seq
+            if feed.more:
+                continue
+            while not event.is_set():
+                try:
+                    await asyncio.wait_for(event.wait(), config.CHANGES_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing the idle connection
+                    yield ": keepalive\n\n"
+    finally:
+        hub.unsubscribe(user_id)
+
+
+def compact(db, before):
+    """Remove entries created before ``before``; return the number removed."""
+    seq = db.execute(select(func.max(Changes.seq)).where(Changes.created_at < before)).scalar()
+    if seq is None:
+        return 0
+    removed = db.execute(delete(Changes).where(Changes.seq <= seq)).rowcount
+    horizon = db.get(Horizon, 1)
+    if horizon is None:
+        db.add(Horizon(id=1, seq=seq))
+    else:
+        horizon.seq = max(horizon.seq, seq)
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remove old change log entries. Clients that synced before them must reload.")
+    parser.add_argument("--keep-days", type=float, default=config.CHANGES_RETENTION_DAYS, help="keep entries newer than this")
+    args = parser.parse_args(argv)
+
+    before = datetime.utcnow() - timedelta(days=args.keep_days)
+    for shard in shards.router.shards:
+        with shard.SessionLocal() as db:
+            removed = compact(db, before)
+            db.commit()
+        print(f"{shard.name}: removed {removed} change log entries")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
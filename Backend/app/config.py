@@ -0,0 +1,102 @@
+import os
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./budget.db")
+# Defaults to DATABASE_URL with its async driver (aiosqlite / asyncpg)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+# Used by read-only endpoints, e.g. a replica; defaults to DATABASE_URL
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+
+# Sharding: with SHARDS (comma-separated name=url pairs, e.g.
+# "one=sqlite:///./one.db,two=sqlite:///./two.db") every user's data lives in
+# one of these databases, picked by consistent hashing of the user id over the
+# shard names. A shard's URL may change, e.g. a new password, without moving
+# anyone. Unset means a single database, DATABASE_URL. Adding, removing or
+# renaming shards requires `python -m app.shards rebalance`.
+SHARDS = os.getenv("SHARDS", "")
+if os.getenv("SHARD_URLS"):
+    raise RuntimeError("SHARD_URLS has been replaced by SHARDS, which names every shard: name=url,...")
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "64"))  # points per shard on the hash ring
+# Users allowed to call the /admin endpoints; nobody unless set
+ADMIN_USERS = {user.strip() for user in os.getenv("ADMIN_USERS", "").split(",") if user.strip()}
+
+# Storage profile. The SQLITE_* settings are applied to every new SQLite
+# connection and ignored for other databases.
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # negative values are KiB
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # milliseconds
+# SQLite allows a single writer, so writes queue on one connection by default
+DB_WRITE_POOL_SIZE = int(os.getenv("DB_WRITE_POOL_SIZE", "1"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "8"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "0"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# Upstream exchange-rate provider. Override RATES_API_URL to point the service
+# at a mirror or a local stub server, e.g. "http://127.0.0.1:9000/latest/{base}".
+RATES_API_URL = os.getenv("RATES_API_URL", "https://api.exchangerate-api.com/v4/latest/{base}")
+RATES_TTL_SECONDS = float(os.getenv("RATES_TTL_SECONDS", "600"))
+RATES_STALE_SECONDS = float(os.getenv("RATES_STALE_SECONDS", "3600"))
+RATES_CONNECT_TIMEOUT = float(os.getenv("RATES_CONNECT_TIMEOUT", "2"))
+RATES_READ_TIMEOUT = float(os.getenv("RATES_READ_TIMEOUT", "5"))
+RATES_POOL_SIZE = int(os.getenv("RATES_POOL_SIZE", "10"))
+# Base currency of the daily snapshots in the exchange_rates table
+RATES_BASE = os.getenv("RATES_BASE", "USD")
+
+# Group commit: with WRITE_QUEUE_ENABLED, budget and expense writes arriving
+# within WRITE_QUEUE_WINDOW_MS of each other share one transaction and commit
+WRITE_QUEUE_ENABLED = os.getenv("WRITE_QUEUE_ENABLED", "false").lower() in ("1", "true", "yes")
+WRITE_QUEUE_WINDOW_MS = float(os.getenv("WRITE_QUEUE_WINDOW_MS", "2"))
+WRITE_QUEUE_MAX_BATCH = int(os.getenv("WRITE_QUEUE_MAX_BATCH", "100"))
+
+# Admission control (app.admission). Requests are sorted into route classes,
+# each with a concurrency limit, a bounded wait queue and token-bucket rate
+# limits per client IP and per user; unset or 0 means no limit. The settings
+# are concurrency, queue, queue_timeout (seconds), ip_rate, user_rate (per
+# second), ip_burst and user_burst, e.g. "concurrency=4,queue=32,ip_rate=5".
+# The heavy class holds imports, exports, search, analytics and batches.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+ADMISSION_READ = os.getenv("ADMISSION_READ", "")
+ADMISSION_WRITE = os.getenv("ADMISSION_WRITE", "concurrency=64,queue=256,queue_timeout=5")
+ADMISSION_HEAVY = os.getenv("ADMISSION_HEAVY", "concurrency=4,queue=32,queue_timeout=5")
+
+# Bulk expense import
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+# Longest line or CSV record, in characters; longer ones are reported as failed rows
+IMPORT_MAX_RECORD_LENGTH = int(os.getenv("IMPORT_MAX_RECORD_LENGTH", "65536"))
+
+# POST /batch
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "1000"))
+
+# GET /analytics/spend returns at most this many buckets per series
+ANALYTICS_MAX_BUCKETS = int(os.getenv("ANALYTICS_MAX_BUCKETS", "1000"))
+
+# Streaming expense export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Serialized GET /budgets/ pages kept in memory, keyed by user data version
+RESPONSE_CACHE_BYTES = int(os.getenv("RESPONSE_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+# Deleted budgets are hidden at once; their expenses are then removed in
+# transactions of PURGE_BATCH_SIZE rows, PURGE_PAUSE_MS apart, so the purge
+# never holds the SQLite write lock for long
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+PURGE_PAUSE_MS = float(os.getenv("PURGE_PAUSE_MS", "20"))
+
+# Change feed. Idle SSE streams send a keepalive every CHANGES_HEARTBEAT_SECONDS;
+# CHANGES_POLL_SECONDS is how often writes made by other workers are picked up.
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", "500"))
+CHANGES_HEARTBEAT_SECONDS = float(os.getenv("CHANGES_HEARTBEAT_SECONDS", "15"))
+CHANGES_POLL_SECONDS = float(os.getenv("CHANGES_POLL_SECONDS", "1"))
+CHANGES_RETENTION_DAYS = float(os.getenv("CHANGES_RETENTION_DAYS", "7"))
+
+# Shared with the Auth Service, which signs the tokens
+SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey")
+ALGORITHM = "HS256"
+# Verified-token cache; entries never outlive the token's exp
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+
+# Requests slower than this are logged with the SQL they ran; 0 disables the log
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))
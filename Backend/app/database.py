@@ -1,19 +1,84 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./budget.db"
+from . import config, metrics
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+SQLALCHEMY_DATABASE_URL = config.DATABASE_URL
+
+# Async drivers for the request path
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def async_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+def is_sqlite(url):
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def sqlite_profile(query_only=False):
+    """Connect hook applying the configured PRAGMAs to a new SQLite connection."""
+    pragmas = [
+        f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size={config.SQLITE_CACHE_SIZE}",
+        f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT}",
+    ]
+    if query_only:
+        pragmas.append("PRAGMA query_only=ON")
+
+    def on_connect(dbapi_connection, connection_record):
+        # Imported here: search needs the models, which need this module
+        from . import search
+
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+        # Called by the search index triggers
+        search.register(dbapi_connection)
+
+    return on_connect
+
+
+def make_async_engine(url, pool_size, query_only=False):
+    engine = create_async_engine(
+        async_url(url),
+        pool_size=pool_size,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+    )
+    if is_sqlite(url):
+        event.listen(engine.sync_engine, "connect", sqlite_profile(query_only))
+    metrics.instrument_engine(engine.sync_engine)
+    return engine
+
+
+def make_sync_engine(url):
+    engine = create_engine(url, connect_args={"check_same_thread": False} if is_sqlite(url) else {})
+    if is_sqlite(url):
+        event.listen(engine, "connect", sqlite_profile())
+    metrics.instrument_engine(engine)
+    return engine
+
+
+# Sync engine: schema setup and maintenance commands
+engine = make_sync_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
+# Async engines for the request path: writes go through a small writer pool,
+# read-only endpoints through a separate pool of query_only connections that
+# in WAL mode never wait on the writer
+async_engine = make_async_engine(config.ASYNC_DATABASE_URL or SQLALCHEMY_DATABASE_URL, config.DB_WRITE_POOL_SIZE)
+async_read_engine = make_async_engine(config.DATABASE_READ_URL or SQLALCHEMY_DATABASE_URL, config.DB_READ_POOL_SIZE, query_only=True)
+# Objects stay usable after commit, since lazy loads are not possible in async code
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+Base = declarative_base()
@@ -1,8 +1,125 @@
-import requests
-
-def get_exchange_rates(base_currency="USD"):
-    url = f"https://api.exchangerate-api.com/v4/latest/{base_currency}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json().get("rates", {})
-    return {}
+import asyncio
+import time
+
+from . import config, metrics
+
+
+class RateCache:
+    """In-process cache in front of the exchange-rate provider.
+
+    Entries are fresh for ``ttl`` seconds and are then served for up to
+    ``stale`` more seconds while one background refresh runs. Concurrent misses
+    for the same currency share a single upstream request, and when the
+    provider fails the last known good rates are returned instead.
+    """
+
+    def __init__(
+        self,
+        url=config.RATES_API_URL,
+        ttl=config.RATES_TTL_SECONDS,
+        stale=config.RATES_STALE_SECONDS,
+        timeout=(config.RATES_CONNECT_TIMEOUT, config.RATES_READ_TIMEOUT),
+        pool_size=config.RATES_POOL_SIZE,
+        clock=time.monotonic,
+    ):
+        self.url = url
+        self.ttl = ttl
+        self.stale = stale
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._clock = clock
+        self._client = None
+
+        self._entries = {}  # base currency -> (fetched_at, rates)
+        self._inflight = {}  # base currency -> task fetching it
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "fetches": 0, "errors": 0, "fallbacks": 0}
+
+    async def get(self, base_currency):
+        base = base_currency.upper()
+        entry = self._entries.get(base)
+        if entry is not None:
+            age = self._clock() - entry[0]
+            if age < self.ttl:
+                self._stats["hits"] += 1
+                return entry[1]
+            if age < self.ttl + self.stale:
+                self._stats["stale_hits"] += 1
+                if base not in self._inflight:
+                    self._inflight[base] = asyncio.ensure_future(self._refresh(base))
+                return entry[1]
+
+        self._stats["misses"] += 1
+        task = self._inflight.get(base)
+        if task is None:
+            task = self._inflight[base] = asyncio.ensure_future(self._refresh(base))
+        # A caller that goes away must not cancel the fetch the others wait on
+        rates = await asyncio.shield(task)
+        if rates is not None:
+            return rates
+
+        # Upstream failed: fall back to the last known good rates, however old
+        entry = self._entries.get(base)
+        if entry is None:
+            return {}
+        self._stats["fallbacks"] += 1
+        return entry[1]
+
+    @property
+    def client(self):
+        """One keep-alive connection pool shared by all requests, created on first use."""
+        if self._client is None:
+            import httpx
+
+            connect_timeout, read_timeout = self.timeout
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+        return self._client
+
+    def stats(self):
+        return dict(self._stats, entries=len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        for key in self._stats:
+            self._stats[key] = 0
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _refresh(self, base):
+        import httpx
+
+        rates = None
+        try:
+            rates = await self._fetch(base)
+        except (httpx.HTTPError, ValueError):
+            pass
+        finally:
+            self._stats["fetches"] += 1
+            if rates is None:
+                self._stats["errors"] += 1
+            else:
+                self._entries[base] = (self._clock(), rates)
+            self._inflight.pop(base, None)
+        return rates
+
+    async def _fetch(self, base):
+        with metrics.time_upstream("rates"):
+            response = await self.client.get(self.url.format(base=base))
+            if response.status_code != 200:
+                raise ValueError(f"Rates provider returned {response.status_code}")
+            rates = response.json().get("rates")
+            if not rates:
+                raise ValueError("Rates provider returned no rates")
+            return rates
+
+
+rate_cache = RateCache()
+
+
+async def get_exchange_rates(base_currency="USD"):
+    return await rate_cache.get(base_currency)
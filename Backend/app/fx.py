@@ -0,0 +1,181 @@
+"""
+Exchange-rate snapshots and vectorized currency conversion.
+
+``python -m app.fx snapshot`` stores the provider's current rates in
+``exchange_rates``: one row per (date, currency), in units of currency per
+one ``RATES_BASE``. An amount is converted with the latest snapshot on or
+before its date. ``RateTable.convert`` does this for whole columns of
+amounts at once with NumPy, so the cost of converting a user's history is
+a few array operations rather than a Python loop over expenses.
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import date, datetime
+
+from fastapi import HTTPException
+from sqlalchemy import delete, func, insert, select
+
+from . import config, database, external_api, models, shards
+
+Rates = models.ExchangeRate
+
+
+def _days(values):
+    import numpy as np
+
+    # Accepts dates, datetimes and ISO strings; time of day is dropped
+    return np.asarray(values, dtype="datetime64[us]").astype("datetime64[D]")
+
+
+class RateTable:
+    """Dense (day x currency) matrix of rates against the base currency.
+
+    Days a currency is missing from take its previous known rate, or its
+    first known rate before that, so every cell holds the latest rate on or
+    before that day.
+    """
+
+    def __init__(self, days, currencies, matrix):
+        self.days = days
+        self.currencies = currencies
+        self.columns = {code: i for i, code in enumerate(currencies)}
+        self.matrix = matrix
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build the table from ``(day, currency, rate)`` rows."""
+        import numpy as np
+
+        row_days, row_codes, row_rates = zip(*rows)
+        row_days = _days(row_days)
+        days = np.unique(row_days)
+        currencies = sorted(set(row_codes))
+        columns = {code: i for i, code in enumerate(currencies)}
+        matrix = np.full((len(days), len(currencies)), np.nan)
+        matrix[np.searchsorted(days, row_days), [columns[code] for code in row_codes]] = row_rates
+
+        # Fill gaps forward, then fill the leading gaps backward
+        for rates in (matrix, matrix[::-1]):
+            missing = np.isnan(rates)
+            source = np.where(missing, 0, np.arange(len(days))[:, None])
+            np.maximum.accumulate(source, axis=0, out=source)
+            rates[...] = rates[source, np.arange(len(currencies))]
+        return cls(days, currencies, matrix)
+
+    def require(self, code):
+        """Column of ``code``; 422 when there are no rates for it."""
+        if code not in self.columns:
+            raise HTTPException(status_code=422, detail=f"No exchange rates for {code}")
+        return self.columns[code]
+
+    def convert(self, amounts, currencies, days, target):
+        """Convert ``amounts`` in ``currencies`` on ``days`` to ``target``; all columns are equal-length sequences."""
+        import numpy as np
+
+        amounts = np.asarray(amounts, dtype=float)
+        if not len(amounts):
+            return amounts
+        codes, inverse = np.unique(np.asarray(currencies, dtype="U3"), return_inverse=True)
+        source = np.array([self.require(code) for code in codes])[inverse]
+        target = self.require(target)
+        # Dates before the first snapshot use the first snapshot
+        rows = np.searchsorted(self.days, _days(days), side="right") - 1
+        np.clip(rows, 0, None, out=rows)
+        return amounts * self.matrix[rows, target] / self.matrix[rows, source]
+
+
+_table_cache = {"key": None, "table": None}
+
+
+async def load_rate_table(db):
+    key = (await db.execute(select(func.count(), func.max(Rates.date), func.sum(Rates.rate)))).one()
+    if not key[0]:
+        raise HTTPException(status_code=503, detail="No exchange rate snapshots yet")
+    if _table_cache["key"] != tuple(key):
+        rows = (await db.execute(select(Rates.date, Rates.currency, Rates.rate))).all()
+        _table_cache["table"] = RateTable.from_rows(rows)
+        _table_cache["key"] = tuple(key)
+    return _table_cache["table"]
+
+
+async def converted_totals(db, user_id, target):
+    """Return ``{(budget_id, category): total}`` of the user's spend in ``target``.
+
+    Read from the running totals, not the expenses: every daily spend bucket
+    is converted at its day's rate, and spend without a date, which is in the
+    totals but in no bucket, at the latest rate.
+    """
+    import numpy as np
+
+    b = models.Budget
+    buckets, totals = models.SpendBucket, models.BudgetCategoryTotal
+    groups = [tuple(row) for row in (await db.execute(
+        select(buckets.budget_id, buckets.category, buckets.currency, buckets.start, buckets.total)
+        .join(b, b.id == buckets.budget_id)
+        .where(b.user_id == user_id, buckets.grain == "day")
+    )).all()]
+    dated = {}
+    for budget_id, category, currency, _, total in groups:
+        dated[budget_id, category, currency] = dated.get((budget_id, category, currency), 0.0) + total
+    overall = (await db.execute(
+        select(totals.budget_id, totals.category, totals.currency, totals.total)
+        .join(b, b.id == totals.budget_id)
+        .where(b.user_id == user_id)
+    )).all()
+    if not overall:
+        return {}
+    table = await load_rate_table(db)
+    for budget_id, category, currency, total in overall:
+        undated = total - dated.get((budget_id, category, currency), 0.0)
+        if abs(undated) > 1e-9:
+            groups.append((budget_id, category, currency, table.days[-1], undated))
+    budget_ids, categories, currencies, days, amounts = zip(*groups)
+    converted = table.convert(amounts, currencies, days, target)
+    keys = {}
+    index = np.array([keys.setdefault(key, len(keys)) for key in zip(budget_ids, categories)])
+    totals = np.bincount(index, weights=converted, minlength=len(keys))
+    return dict(zip(keys, totals.tolist()))
+
+
+async def snapshot(db, day=None, base=None):
+    """Store the provider's current rates for ``day``; return the number of currencies."""
+    base = (base or config.RATES_BASE).upper()
+    rates = await external_api.get_exchange_rates(base)
+    if not rates:
+        raise RuntimeError(f"The rates provider returned no rates for {base}")
+    day = day or datetime.utcnow().date()
+    rows = {code.upper(): float(rate) for code, rate in rates.items()}
+    rows[base] = 1.0
+    await db.execute(delete(Rates).where(Rates.date == day))
+    await db.execute(insert(Rates), [{"date": day, "currency": code, "rate": rate} for code, rate in rows.items()])
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Store today's exchange rates for currency conversion.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    take = subcommands.add_parser("snapshot", help="fetch the current rates from the provider and store them")
+    take.add_argument("--date", type=date.fromisoformat, help="store them under this day (default: today, UTC)")
+    args = parser.parse_args(argv)
+
+    async def run():
+        try:
+            # Rates are reference data; every shard keeps its own copy
+            for shard in shards.router.shards:
+                async with shard.AsyncSessionLocal() as db:
+                    count = await snapshot(db, args.date)
+                    await db.commit()
+                print(f"{shard.name}: stored {count} exchange rates against {config.RATES_BASE}")
+        finally:
+            await external_api.rate_cache.aclose()
+            await shards.router.dispose()
+            await database.async_engine.dispose()
+
+    asyncio.run(run())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Incremental CSV / NDJSON parsing for bulk expense imports.
+
+The request body is consumed chunk by chunk and yielded one record at a time,
+so memory use depends on the chunk size and IMPORT_MAX_RECORD_LENGTH, never
+on the size of the upload.
+"""
+
+import codecs
+import csv
+import json
+from collections import deque
+
+from . import config
+
+
+async def iter_lines(chunks, max_length=None):
+    """Yield the lines of the body; a line longer than ``max_length`` is yielded as None, without its text."""
+    max_length = max_length or config.IMPORT_MAX_RECORD_LENGTH
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    # Dropping the start of a line too long to keep, until its end arrives
+    skipping = False
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            if skipping or len(line) > max_length:
+                skipping = False
+                yield None
+            else:
+                yield line.rstrip("\r")
+        if len(pending) > max_length:
+            pending = ""
+            skipping = True
+    pending += decoder.decode(b"", final=True)
+    if skipping or len(pending) > max_length:
+        yield None
+    elif pending:
+        yield pending.rstrip("\r")
+
+
+def _in_quotes(line, quoted):
+    """Whether a CSV record is inside a quoted field after ``line``, given whether it was before it.
+
+    Follows the csv module: a quote opens a quoted field only at the start of
+    a field, so quotes inside unquoted fields, like inch marks, are plain text.
+    """
+    if '"' not in line:
+        return quoted
+    state = "quoted" if quoted else "start"
+    for char in line:
+        if state == "quoted":
+            if char == '"':
+                state = "quote"
+        elif state == "quote":
+            # A doubled quote is an escaped one; anything else closes the field
+            state = "quoted" if char == '"' else "start" if char == "," else "field"
+        elif char == ",":
+            state = "start"
+        elif state == "start" and char == '"':
+            state = "quoted"
+        else:
+            state = "field"
+    return state == "quoted"
+
+
+class _Lines:
+    """The lines of the current record, for one ``csv.reader`` to consume as they arrive."""
+
+    def __init__(self):
+        self.lines = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+async def iter_csv(chunks, max_length=None):
+    """Yield ``(row_number, dict)`` for every data row, or an error for a malformed one; the first record is the header."""
+    max_length = max_length or config.IMPORT_MAX_RECORD_LENGTH
+    record = _Lines()
+    reader = csv.reader(record)
+    header = None
+    row_number = 0
+    length, quoted, too_long = 0, False, False
+
+    async for line in iter_lines(chunks, max_length):
+        if line is None:
+            # Its quotes are unknown, so the record ends with it
+            too_long, quoted = True, False
+        else:
+            length += len(line) + 1
+            too_long = too_long or length > max_length
+            quoted = _in_quotes(line, quoted)
+            if not too_long:
+                # The reader keeps newlines inside quoted fields only if the line has one
+                record.lines.append(line + "\n")
+        if quoted:
+            continue
+
+        error = None
+        if too_long:
+            error = ValueError(f"Record longer than {max_length} characters")
+        else:
+            try:
+                fields = next(reader)
+            except csv.Error as exc:
+                error = ValueError(f"Invalid CSV: {exc}")
+        record.lines.clear()
+        length, too_long = 0, False
+
+        if error is None and len(fields) <= 1 and not "".join(fields).strip():
+            continue
+        if header is None:
+            if error is not None:
+                yield 0, ValueError(f"Invalid header: {error}")
+                return
+            header = [name.strip().lower() for name in fields]
+            continue
+        row_number += 1
+        yield row_number, error or dict(zip(header, fields))
+
+    if quoted:
+        row_number += 1
+        yield row_number, ValueError("Unterminated quoted field")
+
+
+async def iter_ndjson(chunks):
+    """Yield ``(row_number, dict)`` for every non-blank line, or an error for invalid JSON."""
+    row_number = 0
+    async for line in iter_lines(chunks):
+        if line is None:
+            row_number += 1
+            yield row_number, ValueError(f"Line longer than {config.IMPORT_MAX_RECORD_LENGTH} characters")
+            continue
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield row_number, ValueError(f"Invalid JSON: {exc}")
+            continue
+        if not isinstance(row, dict):
+            yield row_number, ValueError("Expected a JSON object")
+            continue
+        yield row_number, row
@@ -1,123 +1,488 @@
-from fastapi import FastAPI, Depends, HTTPException, Header
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List
-from jose import jwt, JWTError
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import date, datetime
 
-from . import models, schemas, database, external_api
+from . import admission, models, schemas, external_api, rollups, importer, exporter, config, metrics, versions, changes, batch, fx, analytics, writes, shards, search, serialize, purge
+from .auth import get_current_user, require_admin, token_cache
+from .pagination import encode_cursor, decode_cursor
 
-models.Base.metadata.create_all(bind=database.engine)
+# The schema is created by `python -m app.bootstrap`, once per deployment
 
 app = FastAPI(title="Budget Service")
 
+# Route classes for admission control; routes not listed are read or write by method
+ROUTE_CLASSES = {
+    "POST /budgets/{budget_id}/expenses/import": "heavy",
+    "GET /export": "heavy",
+    "GET /expenses/search": "heavy",
+    "GET /analytics/spend": "heavy",
+    "POST /batch": "heavy",
+    "GET /admin/shards": "heavy",
+    "GET /changes/stream": "stream",  # held open for as long as the client listens
+    "GET": "read",
+    "HEAD": "read",
+    "*": "write",
+}
+
+def build_admission():
+    classes = [
+        admission.parse_class("read", config.ADMISSION_READ),
+        admission.parse_class("write", config.ADMISSION_WRITE),
+        admission.parse_class("heavy", config.ADMISSION_HEAVY),
+        admission.parse_class("stream"),
+    ]
+    return admission.Admission(classes, ROUTE_CLASSES)
+
+if config.ADMISSION_ENABLED:
+    app.state.admission = build_admission()
+
+# Inside CORS, so rejected requests still carry its headers
+app.add_middleware(admission.AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.on_event("startup")
+async def resume_purges():
+    # Budgets deleted before a restart may still have expenses to remove
+    purge.worker.wake()
 
-# Helper to validate token (simple validation, in real world verify signature with public key or shared secret)
-# Here we assume shared secret for simplicity or just decoding if we trust the internal network
-SECRET_KEY = "supersecretkey"
-ALGORITHM = "HS256"
-
-def get_current_user(authorization: str = Header(None)):
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Missing Authorization Header")
-    try:
-        token = authorization.split(" ")[1]
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid Token")
-        return username
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid Token")
+@app.on_event("shutdown")
+async def close_rates_client():
+    await external_api.rate_cache.aclose()
+
+@app.on_event("shutdown")
+async def stop_purges():
+    await purge.worker.stop()
 
 @app.post("/budgets/", response_model=schemas.Budget)
-def create_budget(budget: schemas.BudgetCreate, db: Session = Depends(database.get_db), user_id: str = Depends(get_current_user)):
-    db_budget = models.Budget(**budget.dict(), user_id=user_id)
-    db.add(db_budget)
-    db.commit()
-    db.refresh(db_budget)
-    return db_budget
+async def create_budget(budget: schemas.BudgetCreate, user_id: str = Depends(get_current_user)):
+    async def write(db):
+        db_budget = models.Budget(**budget.dict(), user_id=user_id)
+        db.add(db_budget)
+        await db.flush()
+        await changes.record(db, user_id, "budget", "insert", db_budget.id)
+        await versions.bump(db, user_id)
+        # A new budget has no expenses
+        return serialize.budget(db_budget, [])
+
+    return serialize.FastJSONResponse(await writes.run(user_id, write))
+
+@app.get("/budgets/summary", response_model=List[schemas.BudgetSummary])
+async def read_budget_summaries(currency: Optional[schemas.CurrencyCode] = None, db: AsyncSession = Depends(shards.get_read_db), user_id: str = Depends(get_current_user)):
+    # Served from the running totals, so the cost does not depend on the number of expenses
+    budgets = (await db.execute(
+        select(models.Budget.id, models.Budget.name, models.Budget.limit, models.Budget.currency)
+        .where(models.Budget.user_id == user_id)
+        .order_by(models.Budget.id)
+    )).all()
+    totals = (await db.execute(
+        select(models.BudgetCategoryTotal)
+        .join(models.Budget, models.Budget.id == models.BudgetCategoryTotal.budget_id)
+        .where(models.Budget.user_id == user_id)
+    )).scalars().all()
+    budget_currencies = {budget.id: budget.currency for budget in budgets}
+    categories = {}
+    counts = {}
+    # Spend in currencies other than the budget's is never added to it unconverted
+    others = {}
+    for row in totals:
+        counts[row.budget_id] = counts.get(row.budget_id, 0) + row.count
+        if row.currency == budget_currencies[row.budget_id]:
+            categories.setdefault(row.budget_id, {})[row.category] = row.total
+        else:
+            other = others.setdefault(row.budget_id, {})
+            other[row.currency] = other.get(row.currency, 0.0) + row.total
+
+    limits = [budget.limit for budget in budgets]
+    if currency and budgets:
+        # Daily spend is converted at the rate of its day, limits at the latest rate
+        categories, others = {}, {}
+        for (budget_id, category), total in (await fx.converted_totals(db, user_id, currency)).items():
+            categories.setdefault(budget_id, {})[category] = total
+        rates = await fx.load_rate_table(db)
+        limits = rates.convert(limits, [budget.currency for budget in budgets], [rates.days[-1]] * len(budgets), currency).tolist()
+
+    summaries = []
+    for budget, limit in zip(budgets, limits):
+        spent = sum(categories.get(budget.id, {}).values())
+        summaries.append(schemas.BudgetSummary(
+            id=budget.id,
+            name=budget.name,
+            currency=currency or budget.currency,
+            limit=limit,
+            spent=spent,
+            remaining=limit - spent,
+            expense_count=counts.get(budget.id, 0),
+            categories=categories.get(budget.id, {}),
+            other_currencies=others.get(budget.id, {}),
+        ))
+    return summaries
 
 @app.get("/budgets/", response_model=List[schemas.Budget])
-def read_budgets(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db), user_id: str = Depends(get_current_user)):
-    budgets = db.query(models.Budget).filter(models.Budget.user_id == user_id).offset(skip).limit(limit).all()
-    return budgets
+async def read_budgets(cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=500), include: schemas.BudgetInclude = schemas.BudgetInclude.expenses, if_none_match: Optional[str] = Header(None), db: AsyncSession = Depends(shards.get_read_db), user_id: str = Depends(get_current_user)):
+    # Unchanged data is answered from the user's version alone: a 304 for
+    # clients that already have it, otherwise the page serialized last time
+    version = await versions.current(db, user_id)
+    params = (cursor, limit, include.value)
+    etag = versions.make_etag(user_id, version, params)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if versions.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    key = (user_id, version, params)
+    cached = versions.response_cache.get(key)
+    if cached is not None:
+        body, page_headers = cached
+        return Response(body, media_type="application/json", headers={**headers, **page_headers})
+
+    # Keyset pagination over (user_id, id): every page is an index range scan,
+    # and the token for the next page comes back in the X-Next-Cursor header
+    query = select(*serialize.BUDGET_COLUMNS).where(models.Budget.user_id == user_id)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, 1)
+        if not isinstance(last_id, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(models.Budget.id > last_id)
+    query = query.order_by(models.Budget.id).limit(limit + 1)
+
+    rows = (await db.execute(query)).all()
+    page_headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        page_headers["X-Next-Cursor"] = encode_cursor(rows[-1].id)
+    if include == schemas.BudgetInclude.none:
+        # List views: never touch the expenses
+        budgets = [serialize.budget(row, []) for row in rows]
+    else:
+        # The expenses of every budget on the page in one extra query instead of one per budget
+        expenses = await serialize.expenses_by_budget(db, [row.id for row in rows])
+        budgets = [serialize.budget(row, expenses[row.id]) for row in rows]
+    # The version was read in the same transaction as the budgets, so the
+    # page is exactly the one this version describes
+    body = serialize.dumps(budgets)
+    versions.response_cache.put(key, body, page_headers)
+    return Response(body, media_type="application/json", headers={**headers, **page_headers})
+
+@app.get("/budgets/{budget_id}/expenses/", response_model=List[schemas.Expense])
+async def read_expenses(budget_id: int, cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=500), db: AsyncSession = Depends(shards.get_read_db), user_id: str = Depends(get_current_user)):
+    # Verify budget belongs to user
+    budget = (await db.execute(select(models.Budget).where(models.Budget.id == budget_id, models.Budget.user_id == user_id))).scalars().first()
+    if not budget:
+        raise HTTPException(status_code=404, detail="Budget not found")
+
+    query = select(*serialize.EXPENSE_COLUMNS).where(models.Expense.budget_id == budget_id)
+    if cursor:
+        last_date, last_id = decode_cursor(cursor, 2)
+        try:
+            last_date = datetime.fromisoformat(last_date)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if not isinstance(last_id, int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(tuple_(models.Expense.date, models.Expense.id) > tuple_(last_date, last_id))
+    expenses = (await db.execute(query.order_by(models.Expense.date, models.Expense.id).limit(limit + 1))).all()
+
+    headers = {}
+    if len(expenses) > limit:
+        expenses = expenses[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(expenses[-1].date.isoformat(), expenses[-1].id)
+    return serialize.FastJSONResponse([serialize.expense(row) for row in expenses], headers=headers)
 
 @app.post("/budgets/{budget_id}/expenses/", response_model=schemas.Expense)
-def create_expense(budget_id: int, expense: schemas.ExpenseCreate, db: Session = Depends(database.get_db), user_id: str = Depends(get_current_user)):
+async def create_expense(budget_id: int, expense: schemas.ExpenseCreate, user_id: str = Depends(get_current_user)):
+    async def write(db):
+        # Verify budget belongs to user
+        budget = (await db.execute(select(models.Budget).where(models.Budget.id == budget_id, models.Budget.user_id == user_id))).scalars().first()
+        if not budget:
+            raise HTTPException(status_code=404, detail="Budget not found")
+
+        db_expense = models.Expense(**dict(expense.dict(), currency=expense.currency or budget.currency), budget_id=budget_id)
+        db.add(db_expense)
+        await db.flush()
+        await rollups.add_expense(db, db_expense)
+        await changes.record(db, user_id, "expense", "insert", db_expense.id)
+        await versions.bump(db, user_id)
+        return serialize.expense(db_expense)
+
+    return serialize.FastJSONResponse(await writes.run(user_id, write))
+
+async def _insert_expenses(db: AsyncSession, user_id: str, budget_id: int, rows: List[dict]):
+    """Store one chunk of an import and commit it; return False, storing nothing, if the budget is no longer the user's."""
+    # Bumping the version first takes the write lock, so the budget cannot be
+    # deleted between the ownership check and the insert
+    await versions.bump(db, user_id)
+    owned = (await db.execute(select(models.Budget.id).where(models.Budget.id == budget_id, models.Budget.user_id == user_id))).scalar()
+    if owned is None:
+        await db.rollback()
+        return False
+    ids = (await db.execute(insert(models.Expense).returning(models.Expense.id), rows)).scalars().all()
+    deltas = rollups.Deltas()
+    for row in rows:
+        deltas.add(budget_id, row["category"], row["currency"], row["date"], row["amount"])
+    await deltas.apply(db)
+    await changes.record(db, user_id, "expense", "insert", *ids)
+    await db.commit()
+    changes.hub.notify(user_id)
+    return True
+
+@app.post(
+    "/budgets/{budget_id}/expenses/import",
+    response_model=schemas.ImportReport,
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "text/csv": {"schema": {"type": "string"}},
+        "application/x-ndjson": {"schema": {"type": "string"}},
+    }}},
+)
+async def import_expenses(budget_id: int, request: Request, format: Optional[schemas.FileFormat] = None, chunk_size: int = Query(config.IMPORT_CHUNK_SIZE, ge=1, le=10000), db: AsyncSession = Depends(shards.get_db), user_id: str = Depends(get_current_user)):
     # Verify budget belongs to user
-    budget = db.query(models.Budget).filter(models.Budget.id == budget_id, models.Budget.user_id == user_id).first()
+    budget = (await db.execute(select(models.Budget).where(models.Budget.id == budget_id, models.Budget.user_id == user_id))).scalars().first()
     if not budget:
         raise HTTPException(status_code=404, detail="Budget not found")
-    
-    db_expense = models.Expense(**expense.dict(), budget_id=budget_id)
-    db.add(db_expense)
-    db.commit()
-    db.refresh(db_expense)
-    return db_expense
+    budget_currency = budget.currency
+    # Hand the writer connection back while the body streams in
+    await db.rollback()
+
+    if format is None:
+        is_json = "json" in request.headers.get("content-type", "")
+        format = schemas.FileFormat.ndjson if is_json else schemas.FileFormat.csv
+    parse = importer.iter_ndjson if format == schemas.FileFormat.ndjson else importer.iter_csv
+
+    # The body is parsed as it arrives and valid rows are written in chunks of
+    # chunk_size, one multi-row INSERT and one commit per chunk
+    report = schemas.ImportReport(imported=0, failed=0, errors=[])
+    batch, batch_rows = [], []
+
+    def fail(row_number, messages):
+        report.failed += 1
+        if len(report.errors) < config.IMPORT_MAX_ERRORS:
+            report.errors.append(schemas.ImportRowError(row=row_number, errors=messages))
+
+    async def flush():
+        if not batch:
+            return
+        try:
+            if await _insert_expenses(db, user_id, budget_id, batch):
+                report.imported += len(batch)
+            else:
+                # Deleted while the body was streaming in
+                for row_number in batch_rows:
+                    fail(row_number, ["Budget not found"])
+        except SQLAlchemyError:
+            await db.rollback()
+            for row_number in batch_rows:
+                fail(row_number, ["Could not be stored"])
+        batch.clear()
+        batch_rows.clear()
+
+    async for row_number, row in parse(request.stream()):
+        if isinstance(row, Exception):
+            fail(row_number, [str(row)])
+            continue
+        if format == schemas.FileFormat.csv:
+            # Empty CSV cells mean "not given"
+            row = {key: value for key, value in row.items() if value != ""}
+        try:
+            expense = schemas.ExpenseImport(**row)
+        except ValidationError as exc:
+            fail(row_number, [f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in exc.errors()])
+            continue
+
+        values = expense.dict()
+        values["date"] = values["date"] or datetime.utcnow()
+        values["currency"] = values["currency"] or budget_currency
+        values["budget_id"] = budget_id
+        batch.append(values)
+        batch_rows.append(row_number)
+        if len(batch) >= chunk_size:
+            await flush()
+    await flush()
+    return report
 
 @app.put("/budgets/{budget_id}", response_model=schemas.Budget)
-def update_budget(budget_id: int, budget: schemas.BudgetCreate, db: Session = Depends(database.get_db), user_id: str = Depends(get_current_user)):
-    db_budget = db.query(models.Budget).filter(models.Budget.id == budget_id, models.Budget.user_id == user_id).first()
-    if not db_budget:
-        raise HTTPException(status_code=404, detail="Budget not found")
-    
-    db_budget.name = budget.name
-    db_budget.limit = budget.limit
-    db.commit()
-    db.refresh(db_budget)
-    return db_budget
+async def update_budget(budget_id: int, budget: schemas.BudgetUpdate, user_id: str = Depends(get_current_user)):
+    async def write(db):
+        db_budget = (await db.execute(select(models.Budget).where(models.Budget.id == budget_id, models.Budget.user_id == user_id))).scalars().first()
+        if not db_budget:
+            raise HTTPException(status_code=404, detail="Budget not found")
+
+        db_budget.name = budget.name
+        db_budget.limit = budget.limit
+        # Without a currency the budget keeps the one it has
+        db_budget.currency = budget.currency or db_budget.currency
+        await changes.record(db, user_id, "budget", "update", budget_id)
+        await versions.bump(db, user_id)
+        expenses = await serialize.expenses_by_budget(db, [budget_id])
+        return serialize.budget(db_budget, expenses[budget_id])
+
+    return serialize.FastJSONResponse(await writes.run(user_id, write))
 
 @app.delete("/budgets/{budget_id}")
-def delete_budget(budget_id: int, db: Session = Depends(database.get_db), user_id: str = Depends(get_current_user)):
-    db_budget = db.query(models.Budget).filter(models.Budget.id == budget_id, models.Budget.user_id == user_id).first()
-    if not db_budget:
-        raise HTTPException(status_code=404, detail="Budget not found")
-    
-    db.delete(db_budget)
-    db.commit()
+async def delete_budget(budget_id: int, user_id: str = Depends(get_current_user)):
+    async def write(db):
+        db_budget = (await db.execute(select(models.Budget).where(models.Budget.id == budget_id, models.Budget.user_id == user_id))).scalars().first()
+        if not db_budget:
+            raise HTTPException(status_code=404, detail="Budget not found")
+
+        # Hidden now; its expenses are removed in the background
+        await purge.enqueue(db, db_budget)
+        await rollups.drop_budget(db, budget_id)
+        await changes.record(db, user_id, "budget", "delete", budget_id)
+        await versions.bump(db, user_id)
+
+    await writes.run(user_id, write)
+    purge.worker.wake()
     return {"message": "Budget deleted successfully"}
 
 @app.put("/budgets/{budget_id}/expenses/{expense_id}", response_model=schemas.Expense)
-def update_expense(budget_id: int, expense_id: int, expense: schemas.ExpenseCreate, db: Session = Depends(database.get_db), user_id: str = Depends(get_current_user)):
-    # Verify budget belongs to user
-    budget = db.query(models.Budget).filter(models.Budget.id == budget_id, models.Budget.user_id == user_id).first()
-    if not budget:
-        raise HTTPException(status_code=404, detail="Budget not found")
-    
-    db_expense = db.query(models.Expense).filter(models.Expense.id == expense_id, models.Expense.budget_id == budget_id).first()
-    if not db_expense:
-        raise HTTPException(status_code=404, detail="Expense not found")
-    
-    db_expense.description = expense.description
-    db_expense.amount = expense.amount
-    db_expense.category = expense.category
-    db.commit()
-    db.refresh(db_expense)
-    return db_expense
+async def update_expense(budget_id: int, expense_id: int, expense: schemas.ExpenseCreate, user_id: str = Depends(get_current_user)):
+    async def write(db):
+        # Verify budget belongs to user
+        budget = (await db.execute(select(models.Budget).where(models.Budget.id == budget_id, models.Budget.user_id == user_id))).scalars().first()
+        if not budget:
+            raise HTTPException(status_code=404, detail="Budget not found")
+
+        db_expense = (await db.execute(select(models.Expense).where(models.Expense.id == expense_id, models.Expense.budget_id == budget_id))).scalars().first()
+        if not db_expense:
+            raise HTTPException(status_code=404, detail="Expense not found")
+
+        await rollups.remove_expense(db, db_expense)
+        db_expense.description = expense.description
+        db_expense.amount = expense.amount
+        db_expense.category = expense.category
+        # Without a currency the expense keeps the one it has
+        db_expense.currency = expense.currency or db_expense.currency
+        await rollups.add_expense(db, db_expense)
+        await changes.record(db, user_id, "expense", "update", expense_id)
+        await versions.bump(db, user_id)
+        return serialize.expense(db_expense)
+
+    return serialize.FastJSONResponse(await writes.run(user_id, write))
 
 @app.delete("/budgets/{budget_id}/expenses/{expense_id}")
-def delete_expense(budget_id: int, expense_id: int, db: Session = Depends(database.get_db), user_id: str = Depends(get_current_user)):
-    # Verify budget belongs to user
-    budget = db.query(models.Budget).filter(models.Budget.id == budget_id, models.Budget.user_id == user_id).first()
-    if not budget:
-        raise HTTPException(status_code=404, detail="Budget not found")
-    
-    db_expense = db.query(models.Expense).filter(models.Expense.id == expense_id, models.Expense.budget_id == budget_id).first()
-    if not db_expense:
-        raise HTTPException(status_code=404, detail="Expense not found")
-    
-    db.delete(db_expense)
-    db.commit()
+async def delete_expense(budget_id: int, expense_id: int, user_id: str = Depends(get_current_user)):
+    async def write(db):
+        # Verify budget belongs to user
+        budget = (await db.execute(select(models.Budget).where(models.Budget.id == budget_id, models.Budget.user_id == user_id))).scalars().first()
+        if not budget:
+            raise HTTPException(status_code=404, detail="Budget not found")
+
+        db_expense = (await db.execute(select(models.Expense).where(models.Expense.id == expense_id, models.Expense.budget_id == budget_id))).scalars().first()
+        if not db_expense:
+            raise HTTPException(status_code=404, detail="Expense not found")
+
+        await db.delete(db_expense)
+        await rollups.remove_expense(db, db_expense)
+        await changes.record(db, user_id, "expense", "delete", expense_id)
+        await versions.bump(db, user_id)
+
+    await writes.run(user_id, write)
     return {"message": "Expense deleted successfully"}
 
+@app.post("/batch", response_model=schemas.BatchResponse)
+async def apply_batch(request: schemas.BatchRequest, user_id: str = Depends(get_current_user)):
+    # All operations are applied in one transaction, or none of them are
+    if len(request.operations) > config.BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"At most {config.BATCH_MAX_OPERATIONS} operations per batch")
+    results = await writes.run(user_id, lambda db: batch.apply(db, user_id, request.operations))
+    if any(op.entity == schemas.ChangeEntity.budget and op.op == schemas.BatchOp.delete for op in request.operations):
+        purge.worker.wake()
+    return schemas.BatchResponse(results=results)
+
+@app.get("/changes", response_model=schemas.ChangeFeed)
+async def read_changes(since: Optional[int] = Query(None, ge=0), limit: int = Query(config.CHANGES_PAGE_SIZE, ge=1, le=5000), db: AsyncSession = Depends(shards.get_read_db), user_id: str = Depends(get_current_user)):
+    # Without since only the current seq comes back: load the data, then sync from there
+    if since is None:
+        return schemas.ChangeFeed(seq=await changes.latest_seq(db), changes=[], more=False)
+    return await changes.read_feed(db, user_id, since, limit)
+
+@app.get("/changes/stream")
+async def stream_changes(since: Optional[int] = Query(None, ge=0), last_event_id: Optional[int] = Header(None), db: AsyncSession = Depends(shards.get_read_db), user_id: str = Depends(get_current_user)):
+    # EventSource sends Last-Event-ID when it reconnects
+    if last_event_id is not None:
+        since = last_event_id
+    if since is None:
+        since = await changes.latest_seq(db)
+    else:
+        await changes.check_horizon(db, since)
+    # Hand the reader connection back for the life of the stream
+    await db.rollback()
+    return StreamingResponse(
+        changes.stream(user_id, since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/analytics/spend", response_model=schemas.SpendAnalytics)
+async def read_spend_analytics(start: date, end: date, granularity: schemas.Granularity = schemas.Granularity.day, group: schemas.SpendGroup = schemas.SpendGroup.budget, budget_id: Optional[int] = None, category: Optional[str] = None, db: AsyncSession = Depends(shards.get_read_db), user_id: str = Depends(get_current_user)):
+    return await analytics.spend_series(db, user_id, granularity, start, end, group=group, budget_id=budget_id, category=category)
+
+@app.get("/expenses/search", response_model=List[schemas.Expense])
+async def search_expenses(response: Response, q: str = Query(..., min_length=1, max_length=200), category: Optional[str] = None, start: Optional[datetime] = None, end: Optional[datetime] = None, budget_id: Optional[int] = None, cursor: Optional[str] = None, limit: int = Query(50, ge=1, le=500), db: AsyncSession = Depends(shards.get_read_db), user_id: str = Depends(get_current_user)):
+    # Best matches first; every word of q matches as a prefix
+    expenses, next_cursor = await search.search(db, user_id, q, category=category, start=start, end=end, budget_id=budget_id, cursor=cursor, limit=limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return expenses
+
+@app.get("/export")
+async def export_expenses(format: schemas.FileFormat = schemas.FileFormat.csv, start: Optional[datetime] = None, end: Optional[datetime] = None, category: Optional[str] = None, currency: Optional[schemas.CurrencyCode] = None, gzip: bool = False, db: AsyncSession = Depends(shards.get_read_db), user_id: str = Depends(get_current_user)):
+    rates = None
+    if currency:
+        # Fail before the response starts rather than halfway through the file
+        rates = await fx.load_rate_table(db)
+        rates.require(currency)
+    await db.rollback()
+    body = exporter.stream_expenses(user_id, format.value, start=start, end=end, category=category, currency=currency, rates=rates, gzip=gzip)
+    filename = f"expenses.{format.value}"
+    media_type = "application/x-ndjson" if format == schemas.FileFormat.ndjson else "text/csv"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/auth/stats")
+async def get_auth_stats():
+    return token_cache.stats()
+
+@app.get("/admission/stats")
+async def get_admission_stats():
+    limits = getattr(app.state, "admission", None)
+    return limits.stats() if limits is not None else {}
+
+@app.get("/writes/stats")
+async def get_write_queue_stats():
+    return dict(writes.stats(), enabled=config.WRITE_QUEUE_ENABLED)
+
+@app.get("/admin/shards", response_model=schemas.ShardOverview)
+async def read_shard_overview(user_id: str = Depends(require_admin)):
+    # Each shard answers from its running totals, all of them at once
+    return await shards.overview()
+
+@app.get("/cache/stats")
+async def get_response_cache_stats():
+    return versions.response_cache.stats()
+
+@app.get("/rates/stats")
+async def get_rates_stats():
+    return external_api.rate_cache.stats()
+
 @app.get("/rates/{currency}")
-def get_rates(currency: str):
-    return external_api.get_exchange_rates(currency)
+async def get_rates(currency: str):
+    return await external_api.get_exchange_rates(currency)
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, DateTime, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -9,18 +9,93 @@ class Budget(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     limit = Column(Float)
-    user_id = Column(String, index=True) # Storing username or user_id from Auth Service
+    currency = Column(String(3), nullable=False, default="USD", server_default="USD")
+    user_id = Column(String) # Storing username or user_id from Auth Service
     
     expenses = relationship("Expense", back_populates="budget")
 
+    # Serves both the ownership lookups and keyset pagination of a user's budgets
+    __table_args__ = (Index("ix_budgets_user_id_id", "user_id", "id"),)
+
 class Expense(Base):
     __tablename__ = "expenses"
 
     id = Column(Integer, primary_key=True, index=True)
     description = Column(String)
     amount = Column(Float)
+    currency = Column(String(3), nullable=False, default="USD", server_default="USD")
     category = Column(String)
     date = Column(DateTime, default=datetime.utcnow)
     budget_id = Column(Integer, ForeignKey("budgets.id"))
 
     budget = relationship("Budget", back_populates="expenses")
+
+    # Serves expense loading per budget and keyset pagination by (date, id)
+    __table_args__ = (Index("ix_expenses_budget_id_date_id", "budget_id", "date", "id"),)
+
+class BudgetCategoryTotal(Base):
+    """Running spend per budget, category and expense currency, maintained by the expense write path."""
+    __tablename__ = "budget_category_totals"
+
+    budget_id = Column(Integer, ForeignKey("budgets.id"), primary_key=True)
+    category = Column(String, primary_key=True)
+    currency = Column(String(3), primary_key=True)  # of the expenses; amounts are summed unconverted
+    total = Column(Float, nullable=False, default=0.0)
+    count = Column(Integer, nullable=False, default=0)
+
+class SpendBucket(Base):
+    """Spend per budget, category and expense currency in one day, week or month, maintained by the expense write path."""
+    __tablename__ = "spend_buckets"
+
+    budget_id = Column(Integer, ForeignKey("budgets.id"), primary_key=True)
+    grain = Column(String, primary_key=True)  # "day", "week" or "month"
+    start = Column(Date, primary_key=True)  # first day of the bucket; weeks start on Monday
+    category = Column(String, primary_key=True)
+    currency = Column(String(3), primary_key=True)
+    total = Column(Float, nullable=False, default=0.0)
+    count = Column(Integer, nullable=False, default=0)
+
+class UserVersion(Base):
+    """Per-user data version, bumped by every write; see app.versions."""
+    __tablename__ = "user_versions"
+
+    user_id = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class Change(Base):
+    """Change log entry written with every budget or expense write; see app.changes."""
+    __tablename__ = "changes"
+
+    seq = Column(Integer, primary_key=True)
+    user_id = Column(String, nullable=False)
+    entity = Column(String, nullable=False)  # "budget" or "expense"
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # "insert", "update" or "delete"
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    # Feeds are read per user in seq order; AUTOINCREMENT never reuses a seq
+    __table_args__ = (Index("ix_changes_user_id_seq", "user_id", "seq"), {"sqlite_autoincrement": True})
+
+class ChangeLogHorizon(Base):
+    """Single row holding the highest seq removed by compaction."""
+    __tablename__ = "change_log_horizon"
+
+    id = Column(Integer, primary_key=True)
+    seq = Column(Integer, nullable=False, default=0)
+
+class BudgetPurge(Base):
+    """A deleted budget whose expenses app.purge has yet to remove."""
+    __tablename__ = "budget_purges"
+
+    budget_id = Column(Integer, primary_key=True)
+    user_id = Column(String, nullable=False, index=True)  # the owner, cleared on the budget itself
+    expenses = Column(Integer, nullable=False, default=0)  # left to remove
+    queued_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class ExchangeRate(Base):
+    """Daily snapshot of exchange rates, in units of currency per one RATES_BASE; see app.fx."""
+    __tablename__ = "exchange_rates"
+
+    date = Column(Date, primary_key=True)
+    currency = Column(String(3), primary_key=True)
+    rate = Column(Float, nullable=False)
@@ -0,0 +1,166 @@
+"""
+Deferred removal of deleted budgets.
+
+Deleting a budget, through ``DELETE /budgets/{id}`` or ``POST /batch``, only
+detaches it: ``enqueue`` clears its ``user_id``, which hides the budget and
+its expenses from every query scoped to the user, and queues it in
+``budget_purges``. The request commits one short transaction however many
+expenses the budget has.
+
+``worker`` then removes the queued budgets' expenses in the background, at
+most PURGE_BATCH_SIZE per transaction and PURGE_PAUSE_MS apart, so other
+writers get the SQLite write lock in between, and finally the budget row.
+Each process runs a pass at startup and after every delete. Passes in
+several processes may overlap; every step is safe to repeat. The
+``budget_purge_backlog_*`` gauges report what is left.
+
+Expenses orphaned before deletes were queued, whose ``budget_id`` is NULL or
+names a budget that no longer exists, are removed by a one-off run of
+
+    python -m app.purge [--dry-run]
+"""
+
+import argparse
+import asyncio
+import contextvars
+import logging
+import sys
+import time
+
+from sqlalchemy import delete, exists, func, or_, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import config, metrics, models, shards
+
+logger = logging.getLogger(__name__)
+
+Purges = models.BudgetPurge
+
+backlog_budgets = metrics.Gauge("budget_purge_backlog_budgets", "Deleted budgets not yet purged.")
+backlog_expenses = metrics.Gauge("budget_purge_backlog_expenses", "Expenses of deleted budgets not yet purged.")
+
+
+async def enqueue(db, budget):
+    """Hide ``budget`` from its owner and queue it for purging. The caller commits, then wakes ``worker``."""
+    totals = models.BudgetCategoryTotal
+    count = (await db.execute(select(func.sum(totals.count)).where(totals.budget_id == budget.id))).scalar() or 0
+    db.add(Purges(budget_id=budget.id, user_id=budget.user_id, expenses=count))
+    budget.user_id = None
+
+
+async def purge_batch(db, batch_size):
+    """Remove up to ``batch_size`` expenses of the oldest queued budget, or the budget itself once it has none left.
+
+    Return False if nothing is queued. The caller commits.
+    """
+    job = (await db.execute(select(Purges).order_by(Purges.queued_at, Purges.budget_id).limit(1))).scalars().first()
+    if job is None:
+        return False
+    e = models.Expense
+    batch = select(e.id).where(e.budget_id == job.budget_id).limit(batch_size).scalar_subquery()
+    removed = (await db.execute(delete(e).where(e.id.in_(batch)).execution_options(synchronize_session=False))).rowcount
+    if removed:
+        job.expenses = max(job.expenses - removed, 0)
+    else:
+        await db.execute(delete(models.Budget).where(models.Budget.id == job.budget_id).execution_options(synchronize_session=False))
+        await db.delete(job)
+    return True
+
+
+async def refresh_backlog():
+    async def backlog(db):
+        return (await db.execute(select(func.count(Purges.budget_id), func.coalesce(func.sum(Purges.expenses), 0)))).one()
+
+    per_shard = await shards.fan_out(backlog)
+    backlog_budgets.set(sum(budgets for budgets, _ in per_shard))
+    backlog_expenses.set(sum(expenses for _, expenses in per_shard))
+
+
+class PurgeWorker:
+    """Purges every shard's queue in the background, one pass at a time per process."""
+
+    def __init__(self):
+        self._again = False
+        self._task = None
+
+    def wake(self):
+        """Make sure a pass runs after everything queued so far."""
+        self._again = True
+        if self._task is None or self._task.done():
+            # Started in an empty context, so its SQL is not counted against the request that woke it
+            self._task = contextvars.Context().run(asyncio.ensure_future, self._run())
+
+    async def join(self):
+        """Wait until no pass is running or due."""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while self._again:
+            self._again = False
+            try:
+                await refresh_backlog()
+                for shard in shards.router.shards:
+                    while True:
+                        async with shard.AsyncSessionLocal() as db:
+                            if not await purge_batch(db, config.PURGE_BATCH_SIZE):
+                                break
+                            await db.commit()
+                        await refresh_backlog()
+                        await asyncio.sleep(config.PURGE_PAUSE_MS / 1000)
+            except SQLAlchemyError:
+                # Picked up again by the next delete or restart
+                logger.exception("Purging deleted budgets failed")
+
+
+worker = PurgeWorker()
+
+
+def orphaned(expense=models.Expense):
+    return or_(expense.budget_id.is_(None), ~exists().where(models.Budget.id == expense.budget_id))
+
+
+def purge_orphans(db, batch_size, pause, dry_run=False):
+    """Remove orphaned expenses in batches, in id order, and running totals of missing budgets; return the number of expenses."""
+    e = models.Expense
+    found, after = 0, 0
+    while True:
+        ids = db.execute(select(e.id).where(e.id > after, orphaned(e)).order_by(e.id).limit(batch_size)).scalars().all()
+        if not ids:
+            break
+        found += len(ids)
+        after = ids[-1]
+        if not dry_run:
+            db.execute(delete(e).where(e.id.in_(ids)))
+            db.commit()
+            time.sleep(pause)
+    if not dry_run:
+        for table in (models.BudgetCategoryTotal, models.SpendBucket):
+            db.execute(delete(table).where(~exists().where(models.Budget.id == table.budget_id)))
+        db.commit()
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remove expenses whose budget no longer exists, left by deletes from before they were queued for purging.")
+    parser.add_argument("--dry-run", action="store_true", help="only count them")
+    parser.add_argument("--batch-size", type=int, default=config.PURGE_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    for shard in shards.router.shards:
+        with shard.SessionLocal() as db:
+            found = purge_orphans(db, args.batch_size, config.PURGE_PAUSE_MS / 1000, args.dry_run)
+        print(f"{shard.name}: {'found' if args.dry_run else 'removed'} {found} orphaned expenses")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+Running spend totals per budget and category, and per day, week and month.
+
+Totals are kept per expense currency and never converted here: a budget
+with expenses in several currencies has one row per currency, and readers
+convert them (see ``app.fx``).
+
+The expense endpoints keep ``budget_category_totals`` and ``spend_buckets`` up
+to date inside their own transaction through the async helpers below.
+``python -m app.rollups`` compares both with the expenses table and rebuilds
+them from scratch, which also backfills buckets for existing expenses.
+"""
+
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, literal, select, update
+
+from . import models, shards
+
+Totals = models.BudgetCategoryTotal
+Buckets = models.SpendBucket
+GRAINS = ("day", "week", "month")
+TOLERANCE = 1e-6
+
+
+def bucket_starts(moment):
+    """Return the first day of the day, week (ISO, Monday) and month holding ``moment``."""
+    day = moment.date() if isinstance(moment, datetime) else moment
+    return {"day": day, "week": day - timedelta(days=day.weekday()), "month": day.replace(day=1)}
+
+
+async def _upsert(db, table, key, amount, count, values):
+    result = await db.execute(update(table).where(*key).values(total=table.total + amount, count=table.count + count))
+    if result.rowcount == 0:
+        await db.execute(insert(table).values(**values, total=amount, count=count))
+    elif count < 0:
+        await db.execute(delete(table).where(*key, table.count <= 0))
+
+
+async def apply_delta(db, budget_id, category, currency, amount, count):
+    key = (Totals.budget_id == budget_id, Totals.category == category, Totals.currency == currency)
+    await _upsert(db, Totals, key, amount, count, {"budget_id": budget_id, "category": category, "currency": currency})
+
+
+async def apply_bucket_delta(db, budget_id, grain, start, category, currency, amount, count):
+    key = (
+        Buckets.budget_id == budget_id, Buckets.grain == grain, Buckets.start == start,
+        Buckets.category == category, Buckets.currency == currency,
+    )
+    values = {"budget_id": budget_id, "grain": grain, "start": start, "category": category, "currency": currency}
+    await _upsert(db, Buckets, key, amount, count, values)
+
+
+class Deltas:
+    """Collects expense changes so every total and bucket they touch is written once."""
+
+    def __init__(self):
+        self.totals = {}  # (budget_id, category, currency) -> [amount, count]
+        self.buckets = {}  # (budget_id, grain, start, category, currency) -> [amount, count]
+
+    def add(self, budget_id, category, currency, date, amount, sign=1):
+        keys = [(self.totals, (budget_id, category, currency))]
+        if date is not None:
+            keys += [(self.buckets, (budget_id, grain, start, category, currency)) for grain, start in bucket_starts(date).items()]
+        for deltas, key in keys:
+            delta = deltas.setdefault(key, [0.0, 0])
+            delta[0] += sign * amount
+            delta[1] += sign
+
+    def add_expense(self, expense, sign=1):
+        self.add(expense.budget_id, expense.category, expense.currency, expense.date, expense.amount, sign)
+
+    async def apply(self, db, skip_budgets=()):
+        """Write the collected changes, leaving out budgets that are being dropped."""
+        for (budget_id, *key), (amount, count) in self.totals.items():
+            if budget_id not in skip_budgets and (amount or count):
+                await apply_delta(db, budget_id, *key, amount, count)
+        for (budget_id, *key), (amount, count) in self.buckets.items():
+            if budget_id not in skip_budgets and (amount or count):
+                await apply_bucket_delta(db, budget_id, *key, amount, count)
+
+
+async def add_expense(db, expense):
+    deltas = Deltas()
+    deltas.add_expense(expense)
+    await deltas.apply(db)
+
+
+async def remove_expense(db, expense):
+    deltas = Deltas()
+    deltas.add_expense(expense, -1)
+    await deltas.apply(db)
+
+
+async def drop_budget(db, budget_id):
+    await db.execute(delete(Totals).where(Totals.budget_id == budget_id))
+    await db.execute(delete(Buckets).where(Buckets.budget_id == budget_id))
+
+
+def _live_query():
+    e = models.Expense
+    return (
+        select(e.budget_id, e.category, e.currency, func.sum(e.amount), func.count())
+        .join(models.Budget, models.Budget.id == e.budget_id)
+        .where(models.Budget.user_id.is_not(None))  # deleted budgets waiting for app.purge have no user
+        .group_by(e.budget_id, e.category, e.currency)
+    )
+
+
+def _bucket_start(grain):
+    # SQLite date modifiers; "weekday 0" moves to the next Sunday unless it is one
+    day = models.Expense.date
+    if grain == "week":
+        return func.date(day, "weekday 0", "-6 days")
+    if grain == "month":
+        return func.date(day, "start of month")
+    return func.date(day)
+
+
+def _live_bucket_query(grain):
+    e = models.Expense
+    start = _bucket_start(grain)
+    return (
+        select(e.budget_id, literal(grain), start, e.category, e.currency, func.sum(e.amount), func.count())
+        .join(models.Budget, models.Budget.id == e.budget_id)
+        .where(e.date.is_not(None), models.Budget.user_id.is_not(None))
+        .group_by(e.budget_id, start, e.category, e.currency)
+    )
+
+
+def _drift(live, stored):
+    drift = []
+    for key in sorted(live.keys() | stored.keys(), key=repr):
+        s, l = stored.get(key, (0.0, 0)), live.get(key, (0.0, 0))
+        if s[1] != l[1] or abs(s[0] - l[0]) > TOLERANCE:
+            drift.append((key, s, l))
+    return drift
+
+
+def check(db):
+    """Return ``(budget_id, category, currency, stored, live)`` for every total that is out of sync."""
+    live = {(b, c, cur): (t, n) for b, c, cur, t, n in db.execute(_live_query())}
+    columns = (Totals.budget_id, Totals.category, Totals.currency, Totals.total, Totals.count)
+    stored = {(b, c, cur): (t, n) for b, c, cur, t, n in db.execute(select(*columns))}
+    return [(*key, s, l) for key, s, l in _drift(live, stored)]
+
+
+def check_buckets(db):
+    """Return ``((budget_id, grain, start, category, currency), stored, live)`` for every bucket that is out of sync."""
+    live, stored = {}, {}
+    for grain in GRAINS:
+        live.update(((b, g, str(s), c, cur), (t, n)) for b, g, s, c, cur, t, n in db.execute(_live_bucket_query(grain)))
+    columns = (Buckets.budget_id, Buckets.grain, Buckets.start, Buckets.category, Buckets.currency, Buckets.total, Buckets.count)
+    stored.update(((b, g, str(s), c, cur), (t, n)) for b, g, s, c, cur, t, n in db.execute(select(*columns)))
+    return _drift(live, stored)
+
+
+def rebuild(db):
+    db.execute(delete(Totals))
+    db.execute(insert(Totals).from_select(["budget_id", "category", "currency", "total", "count"], _live_query()))
+    db.execute(delete(Buckets))
+    for grain in GRAINS:
+        db.execute(insert(Buckets).from_select(
+            ["budget_id", "grain", "start", "category", "currency", "total", "count"], _live_bucket_query(grain)
+        ))
+
+
+def check_and_rebuild(db, check_only=False):
+    """Print drift, then rebuild unless ``check_only``; return whether anything is out of sync at the end."""
+    drift = check(db)
+    for budget_id, category, currency, stored, live in drift:
+        print(f"budget {budget_id} / {category} / {currency}: stored {stored[0]:.2f} ({stored[1]}), live {live[0]:.2f} ({live[1]})")
+    bucket_drift = check_buckets(db)
+    for (budget_id, grain, start, category, currency), stored, live in bucket_drift:
+        print(f"budget {budget_id} / {category} / {currency} / {grain} {start}: stored {stored[0]:.2f} ({stored[1]}), live {live[0]:.2f} ({live[1]})")
+    print(f"{len(drift)} totals and {len(bucket_drift)} buckets out of sync")
+    if check_only:
+        return bool(drift or bucket_drift)
+
+    rebuild(db)
+    db.commit()
+    drift, bucket_drift = check(db), check_buckets(db)
+    print(f"Rebuilt totals and buckets, {len(drift) + len(bucket_drift)} out of sync after rebuild")
+    return bool(drift or bucket_drift)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check budget category totals and spend buckets against the expenses table and rebuild them.")
+    parser.add_argument("--check-only", action="store_true", help="report drift without rebuilding")
+    args = parser.parse_args(argv)
+
+    out_of_sync = False
+    for shard in shards.router.shards:
+        if len(shards.router.shards) > 1:
+            print(f"{shard.name}:")
+        with shard.SessionLocal() as db:
+            out_of_sync = check_and_rebuild(db, args.check_only) or out_of_sync
+    return 1 if out_of_sync else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
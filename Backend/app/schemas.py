@@ -1,6 +1,10 @@
-from pydantic import BaseModel
-from datetime import datetime
-from typing import List, Optional
+from pydantic import BaseModel, constr
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Dict, List, Optional, Union
+
+# ISO 4217 code, e.g. "EUR"; the pattern is checked before upper-casing
+CurrencyCode = constr(to_upper=True, pattern=r"^[A-Za-z]{3}$")
 
 class ExpenseBase(BaseModel):
     description: str
@@ -8,9 +12,14 @@ class ExpenseBase(BaseModel):
     category: str
 
 class ExpenseCreate(ExpenseBase):
-    pass
+    # Defaults to the budget's currency
+    currency: Optional[CurrencyCode] = None
+
+class ExpenseImport(ExpenseCreate):
+    date: Optional[datetime] = None
 
 class Expense(ExpenseBase):
+    currency: str
     id: int
     date: datetime
     budget_id: int
@@ -21,10 +30,15 @@ class Expense(ExpenseBase):
 class BudgetBase(BaseModel):
     name: str
     limit: float
+    currency: CurrencyCode = "USD"
 
 class BudgetCreate(BudgetBase):
     pass
 
+class BudgetUpdate(BudgetBase):
+    # Keeps the budget's currency
+    currency: Optional[CurrencyCode] = None
+
 class Budget(BudgetBase):
     id: int
     user_id: str
@@ -32,3 +46,134 @@ class Budget(BudgetBase):
 
     class Config:
         orm_mode = True
+
+class BudgetInclude(str, Enum):
+    expenses = "expenses"
+    none = "none"
+
+class BudgetSummary(BaseModel):
+    id: int
+    name: str
+    # Currency of limit, spent, remaining and categories
+    currency: str
+    limit: float
+    spent: float
+    remaining: float
+    expense_count: int
+    categories: Dict[str, float]
+    # Unconverted spend in other currencies, left out of spent and categories;
+    # empty when a currency is requested, since then everything is converted
+    other_currencies: Dict[str, float] = {}
+
+class FileFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+class ImportRowError(BaseModel):
+    row: int
+    errors: List[str]
+
+class ImportReport(BaseModel):
+    imported: int
+    failed: int
+    errors: List[ImportRowError]
+
+class BudgetRow(BudgetBase):
+    """A budget without its expenses, as sent in the change feed."""
+    id: int
+    user_id: str
+
+class ChangeEntity(str, Enum):
+    budget = "budget"
+    expense = "expense"
+
+class ChangeOp(str, Enum):
+    insert = "insert"
+    update = "update"
+    delete = "delete"
+
+class Change(BaseModel):
+    seq: int
+    entity: ChangeEntity
+    op: ChangeOp
+    id: int
+    # Current state of the row; None for deletes
+    data: Optional[Union[BudgetRow, Expense]] = None
+
+class ChangeFeed(BaseModel):
+    seq: int
+    changes: List[Change]
+    more: bool
+
+class BatchOp(str, Enum):
+    create = "create"
+    update = "update"
+    delete = "delete"
+
+class BatchOperation(BaseModel):
+    op: BatchOp
+    entity: ChangeEntity
+    # The row to update or delete
+    id: Optional[int] = None
+    # Budget of an expense operation
+    budget_id: Optional[int] = None
+    # BudgetCreate, BudgetUpdate or ExpenseCreate fields for creates and updates
+    data: Optional[Dict[str, Any]] = None
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+
+class BatchResult(BaseModel):
+    index: int
+    op: BatchOp
+    entity: ChangeEntity
+    id: int
+    # Row as stored; None for deletes
+    data: Optional[Union[BudgetRow, Expense]] = None
+
+class BatchResponse(BaseModel):
+    results: List[BatchResult]
+
+class Granularity(str, Enum):
+    day = "day"
+    week = "week"
+    month = "month"
+
+class SpendGroup(str, Enum):
+    budget = "budget"
+    category = "category"
+    budget_category = "budget_category"
+
+class SpendPoint(BaseModel):
+    # First day of the bucket; weeks start on Monday
+    start: date
+    total: float
+    count: int
+
+class SpendSeries(BaseModel):
+    # Set according to the grouping
+    budget_id: Optional[int] = None
+    category: Optional[str] = None
+    # Of the expenses; spend in several currencies makes several series
+    currency: str
+    points: List[SpendPoint]
+
+class SpendAnalytics(BaseModel):
+    granularity: Granularity
+    group: SpendGroup
+    series: List[SpendSeries]
+
+class ShardStats(BaseModel):
+    shard: str  # database URL without the password
+    users: int
+    budgets: int
+    expenses: int
+    spent: float
+
+class ShardOverview(BaseModel):
+    shards: List[ShardStats]
+    users: int
+    budgets: int
+    expenses: int
+    spent: float
+    categories: Dict[str, float]
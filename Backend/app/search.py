@@ -0,0 +1,197 @@
+"""
+Full-text search over expense descriptions and categories.
+
+On SQLite, ``expense_search`` is an FTS5 table over the description and
+category of every expense. Triggers on ``expenses`` keep it in sync, so every
+write path (the endpoints, imports, batches, rebalancing) updates it without
+knowing about it. ``python -m app.bootstrap`` creates it and fills it from the
+expenses already stored.
+
+Every word is indexed with its owner in front, ``<hex of user id>x<word>``,
+so a user's terms sit together in the index and a prefix query expands only
+over that user's words and postings, not everyone's. Hex digits never include
+``x``, so one user's terms can never match another's.
+
+The triggers build that text with ``index_words``, which splits words as
+the unicode61 tokenizer does, as the query side does, so no word can reach
+the index without its owner. Python's Unicode tables are newer than
+SQLite's, so the characters they disagree on are found by asking SQLite
+once. ``database`` registers the function on every SQLite connection it
+opens; writes to ``expenses`` from other clients fail until they register it
+too. Searches also check the budget's owner, so a word that did get in
+without its owner still cannot show another user's expense.
+"""
+
+import re
+import sqlite3
+import sys
+from functools import lru_cache
+
+from fastapi import HTTPException
+from sqlalchemy import func, literal_column, select, text, tuple_
+
+from . import models, schemas
+from .pagination import decode_cursor, encode_cursor
+
+# Words of indexed text and of queries: everything else separates them
+WORD = re.compile(r"[^\W_]+")
+
+TOKENIZE = "unicode61 remove_diacritics 2"
+
+# bm25 weights of the description and category columns
+WEIGHTS = (4.0, 1.0)
+
+
+@lru_cache(maxsize=None)
+def _separators():
+    """Translation table turning the letters and digits that the tokenizer splits on into spaces."""
+    chars = [chr(c) for c in range(sys.maxunicode + 1) if c != ord("a") and WORD.fullmatch(chr(c))]
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute(f"CREATE VIRTUAL TABLE probe USING fts5(text, tokenize = '{TOKENIZE}')")
+        conn.execute("CREATE VIRTUAL TABLE probe_terms USING fts5vocab(probe, instance)")
+        # "a<c>a" is one token when c is a token character and the two tokens "a" and "a" when it separates
+        conn.execute("INSERT INTO probe (text) VALUES (?)", (" ".join(f"a{c}a" for c in chars),))
+        terms = iter([term for term, in conn.execute("SELECT term FROM probe_terms ORDER BY offset")])
+    finally:
+        conn.close()
+    separators = {}
+    for c in chars:
+        if next(terms) == "a":
+            separators[ord(c)] = " "
+            next(terms)
+    return separators
+
+
+def words(value):
+    """The words of ``value`` as the FTS5 tokenizer splits them."""
+    return WORD.findall(value.translate(_separators()))
+
+
+def index_words(value, owner):
+    """``value`` as it is indexed: its words, each with ``owner`` and ``x`` in front."""
+    if not value:
+        return ""
+    return " ".join(f"{owner}x{word}" for word in words(value))
+
+
+def register(dbapi_connection):
+    """Make ``index_words`` callable from SQL on a new SQLite connection."""
+    dbapi_connection.create_function("index_words", 2, index_words, deterministic=True)
+
+
+def _index_row(expense, source):
+    """INSERT indexing the ``expense`` rows of ``source``, which also joins their budgets."""
+    return (
+        "INSERT INTO expense_search (rowid, description, category) "
+        f"SELECT {expense}.id, index_words({expense}.description, hex(budgets.user_id)), "
+        f"index_words({expense}.category, hex(budgets.user_id)) {source}"
+    )
+
+
+INDEX_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS expense_search USING fts5("
+    f"description, category, tokenize = '{TOKENIZE}')",
+    f"CREATE TRIGGER IF NOT EXISTS expense_search_insert AFTER INSERT ON expenses BEGIN {_index_row('new', 'FROM budgets WHERE budgets.id = new.budget_id')}; END",
+    "CREATE TRIGGER IF NOT EXISTS expense_search_delete AFTER DELETE ON expenses BEGIN "
+    "DELETE FROM expense_search WHERE rowid = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS expense_search_update AFTER UPDATE OF description, category, budget_id ON expenses BEGIN "
+    f"DELETE FROM expense_search WHERE rowid = old.id; {_index_row('new', 'FROM budgets WHERE budgets.id = new.budget_id')}; END",
+]
+
+BACKFILL = _index_row("e", "FROM expenses e JOIN budgets ON budgets.id = e.budget_id")
+
+DROP_INDEX = [
+    "DROP TRIGGER IF EXISTS expense_search_insert",
+    "DROP TRIGGER IF EXISTS expense_search_delete",
+    "DROP TRIGGER IF EXISTS expense_search_update",
+    "DROP TABLE IF EXISTS expense_search",
+]
+
+
+def init_index(bind):
+    """Create the search index and its triggers; fill it if it is new or was built by older triggers. SQLite only."""
+    if bind.dialect.name != "sqlite":
+        return
+    with bind.begin() as conn:
+        # ``bind`` may come from outside ``database``, e.g. a plain create_engine()
+        register(conn.connection.dbapi_connection)
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'expense_search'")).first()
+        trigger = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'expense_search_insert'")).scalar()
+        if exists and "index_words" not in (trigger or ""):
+            # Indexed by older triggers: the replace() ones left words after some punctuation without
+            # their owner, and search_words() split some letters the tokenizer separates on into one word
+            for statement in DROP_INDEX:
+                conn.execute(text(statement))
+            exists = None
+        for statement in INDEX_DDL:
+            conn.execute(text(statement))
+        if not exists:
+            conn.execute(text(BACKFILL))
+
+
+def match_expression(user_id, q):
+    """FTS5 query matching every word of ``q`` as a prefix of one of ``user_id``'s words."""
+    terms = words(q)
+    if not terms:
+        raise HTTPException(status_code=422, detail="Search query needs at least one word")
+    # hex() in the triggers gives upper case hex of the UTF-8 bytes
+    owner = user_id.encode().hex().upper()
+    return " AND ".join(f'"{owner}x{word}"*' for word in terms)
+
+
+async def search(db, user_id, q, category=None, start=None, end=None, budget_id=None, cursor=None, limit=50):
+    """Return the best ranked page of ``user_id``'s expenses matching ``q`` and the cursor of the next page, if any."""
+    if db.bind.dialect.name != "sqlite":
+        raise HTTPException(status_code=501, detail="Search is only available with SQLite")
+    after = None
+    if cursor:
+        after = decode_cursor(cursor, 2)
+        if not isinstance(after[0], (int, float)) or not isinstance(after[1], int):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    def page(query, score, id):
+        # bm25 scores are negative; the best match has the lowest
+        if after is not None:
+            query = query.where(tuple_(score, id) > tuple_(*after))
+        return query.order_by(score, id).limit(limit + 1)
+
+    e = models.Expense
+    matches = (
+        select(literal_column("expense_search.rowid").label("id"), func.bm25(literal_column("expense_search"), *WEIGHTS).label("score"))
+        .select_from(text("expense_search"))
+        .where(text("expense_search MATCH :match").bindparams(match=match_expression(user_id, q)))
+    )
+    filters = []
+    if category is not None:
+        filters.append(e.category == category)
+    if start is not None:
+        filters.append(e.date >= start)
+    if end is not None:
+        filters.append(e.date < end)
+    if budget_id is not None:
+        filters.append(e.budget_id == budget_id)
+    # Deleted budgets keep their expenses in the index until app.purge removes them
+    purging = (await db.execute(select(models.BudgetPurge.budget_id).where(models.BudgetPurge.user_id == user_id))).scalars().all()
+    if purging:
+        filters.append(e.budget_id.not_in(purging))
+    if not filters:
+        # Cut the page from the index before looking up any expense; the owner check
+        # below only drops words indexed without their owner, which bootstrap rebuilds away
+        matches = page(matches, literal_column("score"), literal_column("id"))
+    matches = matches.subquery()
+    query = (
+        select(e.id, e.description, e.amount, e.currency, e.category, e.date, e.budget_id, matches.c.score)
+        .join(matches, matches.c.id == e.id)
+        .join(models.Budget, models.Budget.id == e.budget_id)
+        .where(models.Budget.user_id == user_id, *filters)
+    )
+    rows = (await db.execute(page(query, matches.c.score, e.id))).all()
+
+    next_cursor = encode_cursor(rows[limit - 1].score, rows[limit - 1].id) if len(rows) > limit else None
+    expenses = [
+        schemas.Expense(id=row.id, description=row.description, amount=row.amount, currency=row.currency,
+                        category=row.category, date=row.date, budget_id=row.budget_id)
+        for row in rows[:limit]
+    ]
+    return expenses, next_cursor
@@ -0,0 +1,338 @@
+"""
+Per-user sharding of the Budget Service storage.
+
+With ``SHARDS`` set, a user's budgets, expenses and the tables derived from
+them live in exactly one of those databases. ``ShardRouter`` picks it by
+consistent hashing of the user id over a ring with ``SHARD_VNODES`` points per
+shard, so going from N to N + 1 shards moves about 1/(N + 1) of the users.
+The ring holds shard names, not URLs, so a shard keeps its users when only
+its URL changes.
+Endpoints get a session on the caller's shard from ``get_db`` and
+``get_read_db``. ``fan_out`` runs a query on every shard concurrently for the
+admin endpoints.
+
+Changing the list of shards is an offline step. Stop the workers, back up the
+databases, then run
+
+    python -m app.shards rebalance --to NAME=URL [NAME=URL ...]
+
+It moves every user whose shard changes and prints the new ``SHARDS``.
+Moved rows get new ids on their new shard. The move is written to the new
+shard's change log as deletes of the old ids and inserts of the new ones, so
+synced clients catch up through ``GET /changes`` as usual.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import re
+import sys
+from bisect import bisect
+
+from fastapi import Depends
+from sqlalchemy import delete, distinct, func, insert, select, text, union
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from . import config, database, models, schemas
+from .auth import get_current_user
+
+
+def _hash(key):
+    # Stable across processes, unlike hash()
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hashing of keys onto nodes."""
+
+    def __init__(self, nodes, vnodes=config.SHARD_VNODES):
+        points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def lookup(self, key):
+        return self._nodes[bisect(self._hashes, _hash(key)) % len(self._nodes)]
+
+
+def _display(url):
+    return make_url(url).render_as_string(hide_password=True)
+
+
+NAME = re.compile(r"\w[\w.-]*")
+
+
+def parse_shards(value):
+    """``{name: url}`` from comma-separated ``name=url`` pairs; ValueError when one is malformed or a name repeats."""
+    shards = {}
+    for entry in filter(None, (entry.strip() for entry in value.split(","))):
+        name, _, url = entry.partition("=")
+        if not NAME.fullmatch(name) or not url:
+            raise ValueError(f"Expected a shard as name=url, got {entry!r}")
+        if name in shards:
+            raise ValueError(f"Shard {name} is listed twice")
+        shards[name] = url
+    return shards
+
+
+class Shard:
+    """Engines and session factories of one shard database."""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.is_default = url == database.SQLALCHEMY_DATABASE_URL
+        if self.is_default:
+            # The default database keeps the engines set up in app.database
+            self.engine = database.engine
+            self.async_engine = database.async_engine
+            self.SessionLocal = database.SessionLocal
+            self.AsyncSessionLocal = database.AsyncSessionLocal
+            self.AsyncReadSessionLocal = database.AsyncReadSessionLocal
+            self._async_engines = []
+            return
+        self.engine = database.make_sync_engine(url)
+        self.async_engine = database.make_async_engine(url, config.DB_WRITE_POOL_SIZE)
+        read_engine = database.make_async_engine(url, config.DB_READ_POOL_SIZE, query_only=True)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.AsyncSessionLocal = async_sessionmaker(self.async_engine, autoflush=False, expire_on_commit=False)
+        self.AsyncReadSessionLocal = async_sessionmaker(read_engine, autoflush=False, expire_on_commit=False)
+        self._async_engines = [self.async_engine, read_engine]
+
+    async def dispose(self):
+        for engine in self._async_engines:
+            await engine.dispose()
+        if not self.is_default:
+            self.engine.dispose()
+
+
+class ShardRouter:
+    def __init__(self, shards, vnodes=config.SHARD_VNODES):
+        """``shards`` maps names, which place the users, to database URLs."""
+        self.shards = [Shard(name, url) for name, url in shards.items()]
+        self._by_name = {shard.name: shard for shard in self.shards}
+        self._ring = HashRing(shards, vnodes)
+
+    def for_user(self, user_id):
+        return self._by_name[self._ring.lookup(user_id)]
+
+    async def dispose(self):
+        for shard in self.shards:
+            await shard.dispose()
+
+
+router = ShardRouter(parse_shards(config.SHARDS) or {"default": database.SQLALCHEMY_DATABASE_URL})
+
+
+async def get_db(user_id: str = Depends(get_current_user)):
+    async with router.for_user(user_id).AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_db(user_id: str = Depends(get_current_user)):
+    async with router.for_user(user_id).AsyncReadSessionLocal() as db:
+        yield db
+
+
+async def fan_out(query):
+    """Run ``query(db)`` on a read session of every shard concurrently; return the results in shard order."""
+    async def run(shard):
+        async with shard.AsyncReadSessionLocal() as db:
+            return await query(db)
+
+    return await asyncio.gather(*(run(shard) for shard in router.shards))
+
+
+async def _shard_stats(db):
+    # Spend and expense counts come from the running totals, not the expenses table
+    totals = models.BudgetCategoryTotal
+    # Deleted budgets waiting to be purged have no user
+    users, budgets = (await db.execute(select(func.count(distinct(models.Budget.user_id)), func.count(models.Budget.user_id)))).one()
+    categories = dict((await db.execute(select(totals.category, func.sum(totals.total)).group_by(totals.category))).all())
+    expenses = (await db.execute(select(func.sum(totals.count)))).scalar() or 0
+    return users, budgets, expenses, categories
+
+
+async def overview():
+    """Users, budgets, expenses and spend per shard and across all shards."""
+    per_shard = await fan_out(_shard_stats)
+    result = schemas.ShardOverview(shards=[], users=0, budgets=0, expenses=0, spent=0.0, categories={})
+    for shard, (users, budgets, expenses, categories) in zip(router.shards, per_shard):
+        spent = sum(categories.values())
+        result.shards.append(schemas.ShardStats(shard=shard.name, users=users, budgets=budgets, expenses=expenses, spent=spent))
+        result.users += users
+        result.budgets += budgets
+        result.expenses += expenses
+        result.spent += spent
+        for category, total in categories.items():
+            result.categories[category] = result.categories.get(category, 0.0) + total
+    return result
+
+
+# Offline rebalancing
+
+def users_on(shard):
+    with shard.SessionLocal() as db:
+        return set(db.execute(union(
+            select(models.Budget.user_id), select(models.UserVersion.user_id), select(models.Change.user_id),
+        )).scalars()) - {None}
+
+
+def _raise_change_seq(db, seq):
+    """Make the next change log seq larger than ``seq``, so clients' cursors from another shard stay behind it.
+
+    Only SQLite keeps the counter in ``sqlite_sequence``; ``rebalance`` rejects other databases up front.
+    """
+    current = db.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'changes'")).scalar()
+    if current is None:
+        db.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('changes', :seq)"), {"seq": seq})
+    elif current < seq:
+        db.execute(text("UPDATE sqlite_sequence SET seq = :seq WHERE name = 'changes'"), {"seq": seq})
+
+
+def _copy_rates(source_db, target_db):
+    # Exchange rates are reference data kept on every shard
+    if target_db.execute(select(func.count()).select_from(models.ExchangeRate)).scalar():
+        return
+    rows = [dict(row._mapping) for row in source_db.execute(select(models.ExchangeRate.__table__))]
+    if rows:
+        target_db.execute(insert(models.ExchangeRate), rows)
+
+
+def move_user(source_db, target_db, user_id):
+    """Copy ``user_id``'s rows from ``source_db`` to ``target_db`` under new ids, then delete them from the source.
+
+    The caller commits the target before the source.
+    """
+    b, e, versions, log = models.Budget, models.Expense, models.UserVersion, models.Change
+    if target_db.execute(select(b.id).where(b.user_id == user_id).limit(1)).first() is not None:
+        raise RuntimeError(f"{user_id} already has budgets on the target shard; was an earlier run interrupted?")
+
+    budget_ids = {}
+    for budget in source_db.execute(select(b.id, b.name, b.limit, b.currency).where(b.user_id == user_id).order_by(b.id)):
+        budget_ids[budget.id] = target_db.execute(
+            insert(b).values(name=budget.name, limit=budget.limit, currency=budget.currency, user_id=user_id).returning(b.id)
+        ).scalar_one()
+
+    expense_ids = []
+    if budget_ids:
+        expenses = source_db.execute(
+            select(e.id, e.description, e.amount, e.currency, e.category, e.date, e.budget_id)
+            .where(e.budget_id.in_(budget_ids)).order_by(e.id)
+        ).all()
+        if expenses:
+            new_ids = target_db.execute(insert(e).returning(e.id, sort_by_parameter_order=True), [
+                {"description": row.description, "amount": row.amount, "currency": row.currency,
+                 "category": row.category, "date": row.date, "budget_id": budget_ids[row.budget_id]}
+                for row in expenses
+            ]).scalars().all()
+            expense_ids = list(zip([row.id for row in expenses], new_ids))
+        for table in (models.BudgetCategoryTotal, models.SpendBucket):
+            rows = [
+                dict(row._mapping, budget_id=budget_ids[row.budget_id])
+                for row in source_db.execute(select(table.__table__).where(table.budget_id.in_(budget_ids)))
+            ]
+            if rows:
+                target_db.execute(insert(table), rows)
+
+    version = source_db.execute(select(versions.version).where(versions.user_id == user_id)).scalar() or 0
+    target_db.execute(delete(versions).where(versions.user_id == user_id))
+    target_db.execute(insert(versions).values(user_id=user_id, version=version + 1))
+
+    entries = [("budget", "delete", old) for old in budget_ids] + [("expense", "delete", old) for old, _ in expense_ids]
+    entries += [("budget", "insert", new) for new in budget_ids.values()] + [("expense", "insert", new) for _, new in expense_ids]
+    if entries:
+        target_db.execute(insert(log), [{"user_id": user_id, "entity": entity, "entity_id": entity_id, "op": op} for entity, op, entity_id in entries])
+
+    if budget_ids:
+        source_db.execute(delete(e).where(e.budget_id.in_(budget_ids)))
+        for table in (models.BudgetCategoryTotal, models.SpendBucket):
+            source_db.execute(delete(table).where(table.budget_id.in_(budget_ids)))
+        source_db.execute(delete(b).where(b.id.in_(budget_ids)))
+    source_db.execute(delete(versions).where(versions.user_id == user_id))
+    source_db.execute(delete(log).where(log.user_id == user_id))
+    return len(budget_ids), len(expense_ids)
+
+
+def plan(current, new_shards, vnodes=config.SHARD_VNODES):
+    """Return ``{(source name, target name): [user ids]}`` for every user whose shard changes."""
+    ring = HashRing(new_shards, vnodes)
+    moves = {}
+    for shard in current.shards:
+        for user_id in sorted(users_on(shard)):
+            target = ring.lookup(user_id)
+            if target != shard.name:
+                moves.setdefault((shard.name, target), []).append(user_id)
+    return moves
+
+
+def rebalance(current, new_shards, vnodes=config.SHARD_VNODES, log=print):
+    """Move users from the shards of ``current`` to their shards under ``new_shards`` (``{name: url}``); return the number moved."""
+    from . import bootstrap
+
+    # A shard that keeps its name keeps its data, so it is read through its current URL
+    shards = {shard.name: shard for shard in current.shards}
+    unsupported = [_display(url) for url in [*(shard.url for shard in current.shards), *new_shards.values()] if not database.is_sqlite(url)]
+    if unsupported:
+        # Checked before anything is written, so a failed run leaves every shard as it was
+        raise ValueError(f"Rebalancing only supports SQLite shards, not {', '.join(unsupported)}")
+    for name, url in new_shards.items():
+        renamed = [shard.name for shard in current.shards if shard.name != name and make_url(shard.url) == make_url(url)]
+        if renamed:
+            raise ValueError(f"{_display(url)} is already shard {renamed[0]}; keep its name")
+    for name, url in new_shards.items():
+        if name not in shards:
+            shards[name] = Shard(name, url)
+    for name in new_shards:
+        bootstrap.init_db(shards[name].engine)
+
+    moved = 0
+    for (source_name, target_name), users in plan(current, new_shards, vnodes).items():
+        source, target = shards[source_name], shards[target_name]
+        with source.SessionLocal() as source_db, target.SessionLocal() as target_db:
+            _copy_rates(source_db, target_db)
+            seq = source_db.execute(select(func.max(models.Change.seq))).scalar() or 0
+            seq = max(seq, source_db.execute(select(models.ChangeLogHorizon.seq)).scalar() or 0)
+            _raise_change_seq(target_db, seq)
+            target_db.commit()
+            for user_id in users:
+                budgets, expenses = move_user(source_db, target_db, user_id)
+                target_db.commit()
+                source_db.commit()
+                moved += 1
+                log(f"{user_id}: {source.name} -> {target.name} ({budgets} budgets, {expenses} expenses)")
+    for name, shard in shards.items():
+        if name not in current._by_name:
+            shard.engine.dispose()
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and rebalance the Budget Service shards.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    locate = commands.add_parser("locate", help="print the shard holding a user")
+    locate.add_argument("user_id")
+    move = commands.add_parser("rebalance", help="move users onto a new list of shards; stop the workers first")
+    move.add_argument("--to", nargs="+", required=True, metavar="NAME=URL", help="the new list of shards and their database URLs")
+    move.add_argument("--dry-run", action="store_true", help="only print how many users would move")
+    args = parser.parse_args(argv)
+
+    if args.command == "locate":
+        print(router.for_user(args.user_id).name)
+        return 0
+    try:
+        new_shards = parse_shards(",".join(args.to))
+        if args.dry_run:
+            for (source, target), users in plan(router, new_shards).items():
+                print(f"{len(users)} users: {source} -> {target}")
+            return 0
+        moved = rebalance(router, new_shards)
+    except ValueError as exc:
+        parser.error(str(exc))
+    print(f"Moved {moved} users. Start the workers with SHARDS={','.join(f'{name}={url}' for name, url in new_shards.items())}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
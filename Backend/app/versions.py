@@ -0,0 +1,107 @@
+"""
+Per-user data versions for conditional GETs.
+
+Every write endpoint bumps the user's version in the same transaction as the
+change itself, so a version names exactly one state of that user's budgets
+and expenses. ``GET /budgets/`` derives its ETag from the version, answers
+``If-None-Match`` without reading the budget tables, and keeps serialized
+pages in a ``ResponseCache`` keyed by (user, version, query).
+"""
+
+import hashlib
+from collections import OrderedDict
+
+from sqlalchemy import insert, select, update
+
+from . import config, models
+
+Versions = models.UserVersion
+
+
+async def bump(db, user_id):
+    result = await db.execute(update(Versions).where(Versions.user_id == user_id).values(version=Versions.version + 1))
+    if result.rowcount == 0:
+        await db.execute(insert(Versions).values(user_id=user_id, version=1))
+
+
+async def current(db, user_id):
+    version = (await db.execute(select(Versions.version).where(Versions.user_id == user_id))).scalar()
+    return version or 0
+
+
+def make_etag(user_id, version, params):
+    # The user is part of the tag so a browser shared by two accounts never
+    # revalidates one user's cached page with the other's version
+    digest = hashlib.sha256(repr((user_id, params)).encode()).hexdigest()[:16]
+    return f'"{version}-{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class ResponseCache:
+    """LRU cache of serialized responses, bounded by their total size in bytes.
+
+    An entry's size counts its key and headers and a fixed overhead for the
+    objects holding them, not only the body, so many tiny pages, e.g. empty
+    ones past the end of a user's budgets, cannot grow it without bound.
+
+    Keys include the user's data version, so entries never go stale: a write
+    moves the user to a new version and the old entries age out.
+    """
+
+    # Roughly what CPython spends on an entry's tuples, dicts and bytes objects
+    ENTRY_OVERHEAD = 512
+
+    def __init__(self, max_bytes=config.RESPONSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # (user, version, params) -> (body, headers)
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return entry
+
+    def _cost(self, key, body, headers):
+        return (
+            self.ENTRY_OVERHEAD + len(body) + len(repr(key))
+            + sum(len(name) + len(value) for name, value in headers.items())
+        )
+
+    def put(self, key, body, headers):
+        cost = self._cost(key, body, headers)
+        if cost > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= self._cost(key, *old)
+        self._entries[key] = (body, headers)
+        self.size += cost
+        while self.size > self.max_bytes:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self.size -= self._cost(evicted_key, *evicted)
+            self._stats["evictions"] += 1
+
+    def stats(self):
+        return dict(self._stats, entries=len(self._entries), bytes=self.size)
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+        for key in self._stats:
+            self._stats[key] = 0
+
+
+response_cache = ResponseCache()
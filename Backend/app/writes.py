@@ -0,0 +1,128 @@
+"""
+Write pipeline for the budget and expense endpoints, with optional group commit.
+
+Endpoints pass their database work to ``run`` as a ``write(db)`` coroutine.
+By default each write gets its own session and commit. With
+``WRITE_QUEUE_ENABLED`` set, writes go through a ``GroupCommitQueue`` writer
+instead, one per shard. It collects the writes that arrive within
+``WRITE_QUEUE_WINDOW_MS``, up to ``WRITE_QUEUE_MAX_BATCH`` of them, and runs
+them in one transaction with one commit. Each write runs in its own SAVEPOINT,
+so a write that fails is rolled back alone and only its caller gets the
+error.
+"""
+
+import asyncio
+import contextvars
+
+from sqlalchemy import text
+
+from . import changes, config, shards
+
+
+class GroupCommitQueue:
+    def __init__(self, sessionmaker, window=config.WRITE_QUEUE_WINDOW_MS / 1000, max_batch=config.WRITE_QUEUE_MAX_BATCH):
+        self.sessionmaker = sessionmaker
+        self.window = window
+        self.max_batch = max_batch
+        self._stats = {"writes": 0, "commits": 0, "failed": 0}
+        self._loop = None
+        self._queue = None
+        self._writer = None
+
+    async def submit(self, user_id, write):
+        """Queue ``write`` and return its result once the group holding it is committed."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._queue = loop, asyncio.Queue()
+            self._writer = None
+        if self._writer is None or self._writer.done():
+            # Started in an empty context, so its SQL is not counted against the request that woke it
+            self._writer = contextvars.Context().run(asyncio.ensure_future, self._run())
+        future = loop.create_future()
+        self._queue.put_nowait((user_id, write, future))
+        return await future
+
+    async def _collect(self):
+        group = [await self._queue.get()]
+        if self.window and self._queue.qsize() < self.max_batch - 1:
+            # Give concurrent requests a moment to join the group
+            await asyncio.sleep(self.window)
+        while len(group) < self.max_batch and not self._queue.empty():
+            group.append(self._queue.get_nowait())
+        # Callers that went away before their write started are dropped
+        return [entry for entry in group if not entry[2].done()]
+
+    async def _run(self):
+        while True:
+            group = await self._collect()
+            if group:
+                await self._commit(group)
+
+    async def _commit(self, group):
+        outcomes = []
+        try:
+            async with self.sessionmaker() as db:
+                if db.bind.dialect.name == "sqlite":
+                    # pysqlite only opens a transaction before DML, and a
+                    # SAVEPOINT outside one commits on release
+                    await db.execute(text("BEGIN IMMEDIATE"))
+                for user_id, write, future in group:
+                    try:
+                        async with db.begin_nested():
+                            outcomes.append((True, await write(db)))
+                    except Exception as exc:
+                        outcomes.append((False, exc))
+                await db.commit()
+        except Exception as exc:
+            # The group was lost; every write that had not failed on its own fails with it
+            outcomes = [outcome if not outcome[0] else (False, exc) for outcome in outcomes]
+            outcomes += [(False, exc)] * (len(group) - len(outcomes))
+        else:
+            self._stats["commits"] += 1
+
+        for (user_id, _, future), (ok, value) in zip(group, outcomes):
+            self._stats["writes" if ok else "failed"] += 1
+            if ok:
+                changes.hub.notify(user_id)
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def stats(self):
+        return dict(self._stats, pending=self._queue.qsize() if self._queue is not None else 0)
+
+
+queues = {}  # shard url -> GroupCommitQueue
+
+
+def queue_for(shard):
+    queue = queues.get(shard.url)
+    if queue is None:
+        queue = queues[shard.url] = GroupCommitQueue(
+            shard.AsyncSessionLocal, config.WRITE_QUEUE_WINDOW_MS / 1000, config.WRITE_QUEUE_MAX_BATCH
+        )
+    return queue
+
+
+def stats():
+    """Counters summed over the queues of all shards."""
+    total = {"writes": 0, "commits": 0, "failed": 0, "pending": 0}
+    for queue in queues.values():
+        for key, value in queue.stats().items():
+            total[key] += value
+    return total
+
+
+async def run(user_id, write):
+    """Run ``write(db)`` for ``user_id`` in a committed transaction on the user's shard and return its result."""
+    shard = shards.router.for_user(user_id)
+    if config.WRITE_QUEUE_ENABLED:
+        return await queue_for(shard).submit(user_id, write)
+    async with shard.AsyncSessionLocal() as db:
+        result = await write(db)
+        await db.commit()
+    changes.hub.notify(user_id)
+    return result
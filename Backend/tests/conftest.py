@@ -0,0 +1,61 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/budget.db")
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app import bootstrap
+    from app.main import app
+
+    bootstrap.init_db()
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def auth_headers():
+    """Factory returning headers that carry a valid token for a fresh user"""
+    from jose import jwt
+    from app.auth import SECRET_KEY, ALGORITHM
+
+    def make_headers():
+        token = jwt.encode({"sub": f"user_{uuid.uuid4().hex[:12]}"}, SECRET_KEY, algorithm=ALGORITHM)
+        return {"Authorization": f"Bearer {token}"}
+
+    return make_headers
+
+
+@pytest.fixture
+def count_queries():
+    """Context manager factory that counts SQL statements run by the request path"""
+    from contextlib import contextmanager
+    from sqlalchemy import event
+    from app.database import async_engine, async_read_engine
+
+    engines = [async_engine.sync_engine, async_read_engine.sync_engine]
+
+    @contextmanager
+    def counter():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            for engine in engines:
+                event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    return counter
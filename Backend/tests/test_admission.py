@@ -0,0 +1,118 @@
+"""
+Admission control and rate limiting tests.
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from app import admission, search
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Installs route classes built from the given settings; returns the ``Admission``"""
+    from app.main import ROUTE_CLASSES, app
+
+    def install(**specs):
+        classes = [admission.parse_class(name, specs.get(name, "")) for name in ("read", "write", "heavy", "stream")]
+        installed = admission.Admission(classes, ROUTE_CLASSES)
+        monkeypatch.setattr(app.state, "admission", installed, raising=False)
+        return installed
+
+    return install
+
+
+@pytest.fixture
+def slow_search(monkeypatch):
+    """Makes every search take 200 ms without touching the database"""
+    async def fake_search(db, user_id, q, **filters):
+        await asyncio.sleep(0.2)
+        return [], None
+
+    monkeypatch.setattr(search, "search", fake_search)
+
+
+def flood(client, requests):
+    """Send ``(path, headers)`` GETs at once from the app's loop; return responses in order"""
+    from app.main import app
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            return await asyncio.gather(*(http.get(path, headers=headers) for path, headers in requests))
+
+    return client.portal.call(scenario)
+
+
+class TestTokenBuckets:
+    """Token buckets"""
+
+    def test_burst_then_refill(self):
+        """A key spends its burst, then waits one token's time; other keys are unaffected"""
+        now = [0.0]
+        buckets = admission.TokenBuckets(rate=2, burst=3, clock=lambda: now[0])
+
+        assert [buckets.take("a") for _ in range(3)] == [0, 0, 0]
+        assert buckets.take("a") == pytest.approx(0.5)
+        assert buckets.take("b") == 0
+        now[0] += 0.5
+        assert buckets.take("a") == 0
+
+    def test_forgets_least_recently_seen(self):
+        """Past ``max_keys`` the oldest key starts over with a full bucket"""
+        buckets = admission.TokenBuckets(rate=1, burst=1, max_keys=2, clock=lambda: 0.0)
+        buckets.take("a")
+        buckets.take("b")
+        buckets.take("c")
+
+        assert buckets.take("a") == 0
+        assert buckets.take("c") > 0
+
+
+class TestAdmission:
+    """Route classes, load shedding and rate limits"""
+
+    def test_flood_of_heavy_requests_is_shed_fast(self, client, auth_headers, limits, slow_search):
+        """Past the heavy class's slots and queue, requests get 503 at once while reads still succeed"""
+        installed = limits(heavy="concurrency=2,queue=2,queue_timeout=5")
+        headers = auth_headers()
+
+        responses = flood(client, [("/expenses/search?q=coffee", headers)] * 20 + [("/budgets/", headers)] * 10)
+        searches, reads = responses[:20], responses[20:]
+
+        assert sorted(response.status_code for response in searches) == [200] * 4 + [503] * 16
+        assert all(response.headers["Retry-After"] == "5" for response in searches if response.status_code == 503)
+        assert [response.status_code for response in reads] == [200] * 10
+        stats = client.get("/admission/stats").json()["heavy"]
+        assert stats["admitted"] == 4 and stats["shed"] == 16 and stats["active"] == 0
+        assert installed.classes["read"].stats["shed"] == 0
+
+    def test_queued_request_times_out(self, client, auth_headers, limits, slow_search):
+        """A request still waiting after ``queue_timeout`` is turned away"""
+        limits(heavy="concurrency=1,queue=4,queue_timeout=0.05")
+        headers = auth_headers()
+
+        responses = flood(client, [("/expenses/search?q=coffee", headers)] * 2)
+
+        assert sorted(response.status_code for response in responses) == [200, 503]
+
+    def test_per_ip_rate_limit(self, client, auth_headers, limits):
+        """A client over its rate gets 429 with the seconds until its next token"""
+        limits(read="ip_rate=0.1,ip_burst=3")
+        headers = auth_headers()
+
+        statuses = [client.get("/budgets/", headers=headers) for _ in range(4)]
+
+        assert [response.status_code for response in statuses] == [200, 200, 200, 429]
+        assert statuses[-1].headers["Retry-After"] == "10"
+        assert client.post("/budgets/", json={"name": "Write", "limit": 10.0}, headers=headers).status_code == 200
+
+    def test_per_user_rate_limit(self, client, auth_headers, limits):
+        """One user over their rate is throttled; another user from the same address is not"""
+        limits(read="user_rate=0.1,user_burst=2")
+        busy, other = auth_headers(), auth_headers()
+
+        assert [client.get("/budgets/", headers=busy).status_code for _ in range(3)] == [200, 200, 429]
+        assert client.get("/budgets/", headers=other).status_code == 200
+        assert client.get("/admission/stats").json()["read"]["throttled_user"] == 1
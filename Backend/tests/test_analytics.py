@@ -0,0 +1,174 @@
+"""
+Spend analytics and spend bucket tests.
+"""
+
+from sqlalchemy import delete
+
+from app import database, models, rollups
+
+
+def seed(client, headers):
+    budget = client.post("/budgets/", json={"name": "Analytics", "limit": 1000.0}, headers=headers).json()
+    body = (
+        '{"description": "Coffee", "amount": 3.0, "category": "Food", "date": "2024-01-01T08:00:00"}\n'
+        '{"description": "Lunch", "amount": 12.0, "category": "Food", "date": "2024-01-01T12:00:00"}\n'
+        '{"description": "Train", "amount": 20.0, "category": "Transport", "date": "2024-01-03T09:00:00"}\n'
+        '{"description": "Dinner", "amount": 30.0, "category": "Food", "date": "2024-01-08T20:00:00"}\n'
+        '{"description": "Rent", "amount": 500.0, "category": "Housing", "date": "2024-02-01T00:00:00"}\n'
+    )
+    client.post(
+        f"/budgets/{budget['id']}/expenses/import",
+        content=body.encode(),
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+    return budget
+
+
+def spend(client, headers, **params):
+    response = client.get("/analytics/spend", params=params, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+def points(series):
+    return [(p["start"], p["total"], p["count"]) for p in series["points"]]
+
+
+class TestSpendAnalytics:
+    """GET /analytics/spend"""
+
+    def test_daily_series_is_dense(self, client, auth_headers):
+        """Every day in the range has a point, empty days included"""
+        headers = auth_headers()
+        budget = seed(client, headers)
+
+        result = spend(client, headers, start="2024-01-01", end="2024-01-04")
+
+        (series,) = result["series"]
+        assert series["budget_id"] == budget["id"] and series["category"] is None
+        assert points(series) == [("2024-01-01", 15.0, 2), ("2024-01-02", 0.0, 0), ("2024-01-03", 20.0, 1)]
+
+    def test_weekly_and_monthly_series(self, client, auth_headers):
+        """Weeks start on Monday and months on the 1st"""
+        headers = auth_headers()
+        seed(client, headers)
+
+        weekly = spend(client, headers, start="2024-01-01", end="2024-01-15", granularity="week")
+        assert points(weekly["series"][0]) == [("2024-01-01", 35.0, 3), ("2024-01-08", 30.0, 1)]
+
+        monthly = spend(client, headers, start="2024-01-15", end="2024-03-01", granularity="month")
+        assert points(monthly["series"][0]) == [("2024-01-01", 65.0, 4), ("2024-02-01", 500.0, 1)]
+
+    def test_series_per_category(self, client, auth_headers):
+        """Grouping by category splits the spend, and filters narrow it"""
+        headers = auth_headers()
+        budget = seed(client, headers)
+        seed(client, headers)
+
+        result = spend(client, headers, start="2024-01-01", end="2024-02-01", granularity="month", group="category")
+        assert {s["category"]: points(s) for s in result["series"]} == {
+            "Food": [("2024-01-01", 90.0, 6)],
+            "Transport": [("2024-01-01", 40.0, 2)],
+        }
+
+        result = spend(
+            client, headers, start="2024-01-01", end="2024-02-01", granularity="month",
+            group="budget_category", budget_id=budget["id"], category="Food",
+        )
+        assert [(s["budget_id"], s["category"], points(s)) for s in result["series"]] == [
+            (budget["id"], "Food", [("2024-01-01", 45.0, 3)]),
+        ]
+
+    def test_other_users_spend_is_hidden(self, client, auth_headers):
+        """Series only cover the caller's budgets"""
+        seed(client, auth_headers())
+        assert spend(client, auth_headers(), start="2024-01-01", end="2024-02-01")["series"] == []
+
+    def test_served_without_scanning_expenses(self, client, auth_headers, count_queries):
+        """The query reads spend buckets, never the expenses table"""
+        headers = auth_headers()
+        seed(client, headers)
+        with count_queries() as statements:
+            spend(client, headers, start="2024-01-01", end="2024-12-31")
+        assert not any("expenses" in statement for statement in statements)
+
+    def test_range_is_validated(self, client, auth_headers):
+        """Empty ranges and ranges with too many buckets are rejected"""
+        headers = auth_headers()
+        for params in ({"start": "2024-01-02", "end": "2024-01-01"}, {"start": "2000-01-01", "end": "2024-01-01"}):
+            assert client.get("/analytics/spend", params=params, headers=headers).status_code == 422
+        assert client.get(
+            "/analytics/spend", params={"start": "2000-01-01", "end": "2024-01-01", "granularity": "month"}, headers=headers,
+        ).status_code == 200
+
+
+    def test_series_per_currency(self, client, auth_headers):
+        """Spend in another currency gets its own series instead of being added up"""
+        headers = auth_headers()
+        budget = seed(client, headers)
+        client.post(
+            f"/budgets/{budget['id']}/expenses/import",
+            content=b'{"description": "Ramen", "amount": 1200.0, "category": "Food", "currency": "JPY", "date": "2024-01-02T12:00:00"}\n',
+            headers={**headers, "Content-Type": "application/x-ndjson"},
+        )
+
+        result = spend(client, headers, start="2024-01-01", end="2024-01-04")
+
+        assert {s["currency"]: points(s) for s in result["series"]} == {
+            "JPY": [("2024-01-01", 0.0, 0), ("2024-01-02", 1200.0, 1), ("2024-01-03", 0.0, 0)],
+            "USD": [("2024-01-01", 15.0, 2), ("2024-01-02", 0.0, 0), ("2024-01-03", 20.0, 1)],
+        }
+
+
+class TestSpendBuckets:
+    """Maintenance of spend_buckets"""
+
+    def test_writes_keep_buckets_in_sync(self, client, auth_headers):
+        """Creates, updates, deletes and batches all match a rebuild from the expenses table"""
+        headers = auth_headers()
+        budget = seed(client, headers)
+        expense = client.post(
+            f"/budgets/{budget['id']}/expenses/",
+            json={"description": "Snack", "amount": 2.0, "category": "Food"},
+            headers=headers,
+        ).json()
+        client.put(
+            f"/budgets/{budget['id']}/expenses/{expense['id']}",
+            json={"description": "Snack", "amount": 4.0, "category": "Treats"},
+            headers=headers,
+        )
+        listed = client.get(f"/budgets/{budget['id']}/expenses/", headers=headers).json()
+        client.delete(f"/budgets/{budget['id']}/expenses/{listed[0]['id']}", headers=headers)
+        client.post("/batch", json={"operations": [
+            {"op": "create", "entity": "expense", "budget_id": budget["id"], "data": {"description": "A", "amount": 1.0, "category": "Food"}},
+            {"op": "update", "entity": "expense", "budget_id": budget["id"], "id": listed[1]["id"],
+             "data": {"description": "B", "amount": 5.0, "category": "Food"}},
+        ]}, headers=headers)
+        doomed = seed(client, headers)
+        client.delete(f"/budgets/{doomed['id']}", headers=headers)
+
+        db = database.SessionLocal()
+        try:
+            assert rollups.check_buckets(db) == []
+        finally:
+            db.close()
+
+    def test_rebuild_backfills_buckets(self, client, auth_headers):
+        """A rebuild fills the buckets of expenses written before they existed"""
+        headers = auth_headers()
+        seed(client, headers)
+
+        db = database.SessionLocal()
+        try:
+            db.execute(delete(models.SpendBucket))
+            db.commit()
+            assert rollups.check_buckets(db)
+
+            rollups.rebuild(db)
+            db.commit()
+            assert rollups.check_buckets(db) == []
+        finally:
+            db.close()
+
+        weekly = spend(client, headers, start="2024-01-01", end="2024-01-15", granularity="week")
+        assert points(weekly["series"][0]) == [("2024-01-01", 35.0, 3), ("2024-01-08", 30.0, 1)]
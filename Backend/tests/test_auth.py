@@ -0,0 +1,61 @@
+"""
+Token verification and verified-token cache tests.
+"""
+
+import time
+
+import pytest
+from jose import jwt
+
+from app.auth import ALGORITHM, SECRET_KEY, TokenCache, token_cache
+
+
+class TestGetCurrentUser:
+    """Authorization header handling"""
+
+    @pytest.mark.parametrize("header", ["Bearer", "Bearer ", "Basic abc", "token-without-scheme", "Bearer not.a.jwt"])
+    def test_malformed_headers_are_401(self, client, header):
+        """Malformed or invalid headers are rejected with 401 instead of a server error"""
+        response = client.get("/budgets/", headers={"Authorization": header})
+        assert response.status_code == 401
+
+    def test_expired_tokens_are_rejected(self, client):
+        """Tokens past their exp are never accepted"""
+        token = jwt.encode({"sub": "late", "exp": int(time.time()) - 10}, SECRET_KEY, algorithm=ALGORITHM)
+        response = client.get("/budgets/", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 401
+
+    def test_repeated_requests_hit_the_cache(self, client, auth_headers):
+        """The second request with the same token skips verification"""
+        headers = auth_headers()
+        client.get("/budgets/", headers=headers)
+        hits = token_cache.stats()["hits"]
+        client.get("/budgets/", headers=headers)
+        assert token_cache.stats()["hits"] == hits + 1
+        assert client.get("/auth/stats").json()["size"] >= 1
+
+
+class TestTokenCache:
+    """TokenCache expiry and eviction"""
+
+    def test_entries_expire_at_token_exp(self):
+        """An entry is dropped once the token's exp passes, even within the TTL"""
+        now = [1000.0]
+        cache = TokenCache(max_size=10, ttl=300, clock=lambda: now[0])
+        cache.put("token", "alice", exp=1060)
+        assert cache.get("token") == "alice"
+        now[0] = 1060
+        assert cache.get("token") is None
+        assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "size": 0}
+
+    def test_least_recently_used_entry_is_evicted(self):
+        """The size cap evicts the least recently used token"""
+        cache = TokenCache(max_size=2, ttl=300)
+        cache.put("a", "alice")
+        cache.put("b", "bob")
+        cache.get("a")
+        cache.put("c", "carol")
+        assert cache.get("b") is None
+        assert cache.get("a") == "alice"
+        assert cache.get("c") == "carol"
+        assert cache.stats()["evictions"] == 1
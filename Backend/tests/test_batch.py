@@ -0,0 +1,117 @@
+"""
+POST /batch tests.
+"""
+
+from sqlalchemy import event
+
+from app.database import async_engine
+
+
+def create_budget(client, headers, name="Budget"):
+    return client.post("/budgets/", json={"name": name, "limit": 100.0}, headers=headers).json()
+
+
+def expense(amount, category="Food", description="Expense"):
+    return {"description": description, "amount": amount, "category": category}
+
+
+def summary(client, headers, budget_id):
+    return next(s for s in client.get("/budgets/summary", headers=headers).json() if s["id"] == budget_id)
+
+
+class TestBatch:
+    """POST /batch"""
+
+    def test_mixed_operations_apply_in_one_transaction(self, client, auth_headers, count_queries):
+        """Creates, updates and deletes across budgets commit once and return per-operation results"""
+        headers = auth_headers()
+        food, travel = create_budget(client, headers, "Food"), create_budget(client, headers, "Travel")
+        lunch = client.post(f"/budgets/{food['id']}/expenses/", json=expense(12.0), headers=headers).json()
+        taxi = client.post(f"/budgets/{travel['id']}/expenses/", json=expense(30.0, "Taxi"), headers=headers).json()
+
+        operations = [
+            {"op": "create", "entity": "expense", "budget_id": food["id"], "data": expense(8.0)},
+            {"op": "update", "entity": "expense", "budget_id": food["id"], "id": lunch["id"], "data": expense(15.0, "Dining")},
+            {"op": "delete", "entity": "expense", "budget_id": travel["id"], "id": taxi["id"]},
+            {"op": "update", "entity": "budget", "id": travel["id"], "data": {"name": "Trips", "limit": 500.0}},
+            {"op": "create", "entity": "budget", "data": {"name": "Gifts", "limit": 50.0}},
+        ]
+        commits = []
+        record_commit = lambda conn: commits.append(1)
+        event.listen(async_engine.sync_engine, "commit", record_commit)
+        try:
+            with count_queries() as statements:
+                response = client.post("/batch", json={"operations": operations}, headers=headers)
+        finally:
+            event.remove(async_engine.sync_engine, "commit", record_commit)
+
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [(r["index"], r["op"], r["entity"]) for r in results] == [
+            (0, "create", "expense"), (1, "update", "expense"), (2, "delete", "expense"), (3, "update", "budget"), (4, "create", "budget"),
+        ]
+        assert results[0]["data"]["amount"] == 8.0
+        assert results[2]["data"] is None
+        assert results[4]["data"]["name"] == "Gifts"
+        assert len(commits) == 1
+        ownership = [s for s in statements if s.lstrip().startswith("SELECT") and "FROM budgets" in s]
+        assert len(ownership) == 1
+
+        assert summary(client, headers, food["id"])["categories"] == {"Food": 8.0, "Dining": 15.0}
+        assert summary(client, headers, travel["id"])["spent"] == 0
+        names = {b["name"] for b in client.get("/budgets/", params={"include": "none"}, headers=headers).json()}
+        assert names == {"Food", "Trips", "Gifts"}
+
+    def test_any_failure_rolls_back_everything(self, client, auth_headers):
+        """A reference to another user's budget rejects the whole batch"""
+        headers, other = auth_headers(), auth_headers()
+        mine, theirs = create_budget(client, headers), create_budget(client, other)
+
+        response = client.post("/batch", json={"operations": [
+            {"op": "create", "entity": "expense", "budget_id": mine["id"], "data": expense(5.0)},
+            {"op": "create", "entity": "expense", "budget_id": theirs["id"], "data": expense(5.0)},
+        ]}, headers=headers)
+
+        assert response.status_code == 404
+        assert response.json()["detail"] == [{"index": 1, "errors": ["Budget not found"]}]
+        assert summary(client, headers, mine["id"])["expense_count"] == 0
+
+    def test_malformed_operations_are_reported_by_index(self, client, auth_headers):
+        """Missing ids and invalid data are a 422 listing every bad operation"""
+        headers = auth_headers()
+        budget = create_budget(client, headers)
+        response = client.post("/batch", json={"operations": [
+            {"op": "update", "entity": "budget", "data": {"name": "No id", "limit": 1.0}},
+            {"op": "create", "entity": "expense", "budget_id": budget["id"], "data": {"description": "x", "amount": "lots"}},
+            {"op": "delete", "entity": "expense", "id": 1},
+        ]}, headers=headers)
+
+        assert response.status_code == 422
+        detail = response.json()["detail"]
+        assert [error["index"] for error in detail] == [0, 1, 2]
+        assert detail[0]["errors"] == ["id is required"]
+        assert any("amount" in message for message in detail[1]["errors"])
+        assert detail[2]["errors"] == ["budget_id is required"]
+
+    def test_rows_deleted_earlier_in_the_batch_are_gone(self, client, auth_headers):
+        """Operating on an expense after deleting it in the same batch is rejected"""
+        headers = auth_headers()
+        budget = create_budget(client, headers)
+        item = client.post(f"/budgets/{budget['id']}/expenses/", json=expense(5.0), headers=headers).json()
+
+        response = client.post("/batch", json={"operations": [
+            {"op": "delete", "entity": "expense", "budget_id": budget["id"], "id": item["id"]},
+            {"op": "update", "entity": "expense", "budget_id": budget["id"], "id": item["id"], "data": expense(6.0)},
+        ]}, headers=headers)
+
+        assert response.status_code == 404
+        assert response.json()["detail"] == [{"index": 1, "errors": ["Expense not found"]}]
+
+    def test_batch_size_is_limited(self, client, auth_headers, monkeypatch):
+        """Batches over BATCH_MAX_OPERATIONS are refused"""
+        from app import config
+
+        monkeypatch.setattr(config, "BATCH_MAX_OPERATIONS", 2)
+        operations = [{"op": "create", "entity": "budget", "data": {"name": "B", "limit": 1.0}}] * 3
+        response = client.post("/batch", json={"operations": operations}, headers=auth_headers())
+        assert response.status_code == 413
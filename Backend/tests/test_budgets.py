@@ -0,0 +1,211 @@
+"""
+Budget listing tests.
+"""
+
+from app import versions
+
+
+def create_budget(client, headers, expenses=0, name="Budget"):
+    budget = client.post("/budgets/", json={"name": name, "limit": 1000.0}, headers=headers).json()
+    for i in range(expenses):
+        client.post(
+            f"/budgets/{budget['id']}/expenses/",
+            json={"description": f"Expense {i}", "amount": 10.0, "category": "Food"},
+            headers=headers,
+        )
+    return budget
+
+
+class TestBudgetListing:
+    """GET /budgets/ loading strategy"""
+
+    def test_query_count_is_constant(self, client, auth_headers, count_queries):
+        """Listing budgets runs the same number of statements for 1 or 50 budgets"""
+        small, large = auth_headers(), auth_headers()
+        create_budget(client, small, expenses=2)
+        for _ in range(50):
+            create_budget(client, large, expenses=2)
+
+        with count_queries() as small_statements:
+            assert len(client.get("/budgets/", headers=small).json()) == 1
+        with count_queries() as large_statements:
+            budgets = client.get("/budgets/", headers=large).json()
+
+        assert len(budgets) == 50
+        assert all(len(budget["expenses"]) == 2 for budget in budgets)
+        assert len(large_statements) == len(small_statements)
+
+    def test_include_none_skips_expenses(self, client, auth_headers, count_queries):
+        """include=none returns budgets without loading their expenses"""
+        headers = auth_headers()
+        create_budget(client, headers, expenses=3)
+
+        with count_queries() as statements:
+            budgets = client.get("/budgets/", params={"include": "none"}, headers=headers).json()
+
+        assert budgets[0]["expenses"] == []
+        assert not any("FROM expenses" in statement for statement in statements)
+
+    def test_include_rejects_unknown_values(self, client, auth_headers):
+        """Unknown include values are a validation error"""
+        response = client.get("/budgets/", params={"include": "everything"}, headers=auth_headers())
+        assert response.status_code == 422
+
+
+def collect_pages(client, url, headers, limit):
+    items, pages, params = [], 0, {"limit": limit}
+    while True:
+        response = client.get(url, params=params, headers=headers)
+        assert response.status_code == 200
+        items.extend(response.json())
+        pages += 1
+        if "X-Next-Cursor" not in response.headers:
+            return items, pages
+        params = {"limit": limit, "cursor": response.headers["X-Next-Cursor"]}
+
+
+class TestKeysetPagination:
+    """Cursor pagination of budgets and expenses"""
+
+    def test_budget_pages_cover_every_budget_once(self, client, auth_headers):
+        """Following X-Next-Cursor visits each budget exactly once"""
+        headers = auth_headers()
+        created = [create_budget(client, headers, name=f"Budget {i}")["id"] for i in range(7)]
+
+        budgets, pages = collect_pages(client, "/budgets/", headers, limit=3)
+
+        assert [budget["id"] for budget in budgets] == created
+        assert pages == 3
+
+    def test_expense_pages_are_ordered_by_date(self, client, auth_headers):
+        """Expenses of a budget are paged in (date, id) order"""
+        headers = auth_headers()
+        budget = create_budget(client, headers, expenses=5)
+
+        expenses, pages = collect_pages(client, f"/budgets/{budget['id']}/expenses/", headers, limit=2)
+
+        assert len(expenses) == 5
+        assert len({expense["id"] for expense in expenses}) == 5
+        assert [(e["date"], e["id"]) for e in expenses] == sorted((e["date"], e["id"]) for e in expenses)
+        assert pages == 3
+
+    def test_expenses_of_other_users_are_hidden(self, client, auth_headers):
+        """Listing another user's budget expenses is a 404"""
+        budget = create_budget(client, auth_headers(), expenses=1)
+        response = client.get(f"/budgets/{budget['id']}/expenses/", headers=auth_headers())
+        assert response.status_code == 404
+
+    def test_invalid_cursor_is_rejected(self, client, auth_headers):
+        """Garbage cursors are a 400, not a server error"""
+        response = client.get("/budgets/", params={"cursor": "not-a-cursor"}, headers=auth_headers())
+        assert response.status_code == 400
+
+    def test_expense_page_query_uses_composite_index(self, client):
+        """Deep expense pages are an index range scan, not a sort or table scan"""
+        from sqlalchemy import text
+        from app.database import engine
+
+        with engine.connect() as conn:
+            plan = conn.execute(text(
+                "EXPLAIN QUERY PLAN SELECT * FROM expenses WHERE budget_id = 1 "
+                "AND (date, id) > ('2024-01-01', 10) ORDER BY date, id LIMIT 101"
+            )).all()
+        details = " ".join(row[-1] for row in plan)
+        assert "ix_expenses_budget_id_date_id" in details
+        assert "TEMP B-TREE" not in details
+
+
+class TestConditionalGet:
+    """GET /budgets/ ETags and the per-user data version"""
+
+    def test_unchanged_data_is_a_304_without_reading_budgets(self, client, auth_headers, count_queries):
+        """If-None-Match with the current ETag only reads the user's version"""
+        headers = auth_headers()
+        create_budget(client, headers, expenses=2)
+        response = client.get("/budgets/", headers=headers)
+        etag = response.headers["ETag"]
+
+        with count_queries() as statements:
+            revalidated = client.get("/budgets/", headers={**headers, "If-None-Match": etag})
+
+        assert revalidated.status_code == 304
+        assert revalidated.content == b""
+        assert revalidated.headers["ETag"] == etag
+        assert len(statements) == 1
+        assert "user_versions" in statements[0]
+
+    def test_every_write_changes_the_etag(self, client, auth_headers):
+        """Budget and expense writes each move the user to a new version"""
+        headers = auth_headers()
+        etags = []
+
+        def etag():
+            etags.append(client.get("/budgets/", headers=headers).headers["ETag"])
+
+        budget = create_budget(client, headers)
+        etag()
+        expense = client.post(
+            f"/budgets/{budget['id']}/expenses/",
+            json={"description": "Lunch", "amount": 12.0, "category": "Food"},
+            headers=headers,
+        ).json()
+        etag()
+        client.put(
+            f"/budgets/{budget['id']}/expenses/{expense['id']}",
+            json={"description": "Lunch", "amount": 14.0, "category": "Food"},
+            headers=headers,
+        )
+        etag()
+        client.post(
+            f"/budgets/{budget['id']}/expenses/import",
+            content="description,amount,category\nBus,2.5,Transport\n",
+            headers={**headers, "Content-Type": "text/csv"},
+        )
+        etag()
+        client.delete(f"/budgets/{budget['id']}/expenses/{expense['id']}", headers=headers)
+        etag()
+        client.put(f"/budgets/{budget['id']}", json={"name": "Renamed", "limit": 5.0}, headers=headers)
+        etag()
+        client.delete(f"/budgets/{budget['id']}", headers=headers)
+        etag()
+
+        assert len(set(etags)) == len(etags)
+        stale = client.get("/budgets/", headers={**headers, "If-None-Match": etags[0]})
+        assert stale.status_code == 200
+        assert stale.json() == []
+
+    def test_repeated_reads_are_served_from_the_cache(self, client, auth_headers, count_queries):
+        """A second read of an unchanged page skips the budget queries"""
+        headers = auth_headers()
+        for _ in range(3):
+            create_budget(client, headers, expenses=1)
+        first = client.get("/budgets/", params={"limit": 2}, headers=headers)
+
+        with count_queries() as statements:
+            second = client.get("/budgets/", params={"limit": 2}, headers=headers)
+
+        assert second.content == first.content
+        assert second.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+        assert len(statements) == 1
+        assert client.get("/budgets/", params={"limit": 3}, headers=headers).headers["ETag"] != first.headers["ETag"]
+
+    def test_cache_counts_more_than_the_body(self):
+        """Empty pages under many cursors still fill the cache and get evicted"""
+        cache = versions.ResponseCache(max_bytes=10 * versions.ResponseCache.ENTRY_OVERHEAD)
+        for n in range(1000):
+            cache.put(("user", 1, (f"cursor{n}", 100, "expenses")), b"[]", {})
+
+        assert cache.size <= cache.max_bytes
+        assert 0 < len(cache._entries) < 10
+        assert cache.stats()["evictions"] == 1000 - len(cache._entries)
+
+    def test_etags_are_not_shared_between_users(self, client, auth_headers):
+        """Another user's ETag never produces a 304"""
+        alice, bob = auth_headers(), auth_headers()
+        create_budget(client, alice)
+        create_budget(client, bob)
+        etag = client.get("/budgets/", headers=alice).headers["ETag"]
+
+        response = client.get("/budgets/", headers={**bob, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert len(response.json()) == 1
@@ -0,0 +1,221 @@
+"""
+Change feed, SSE stream and compaction tests.
+"""
+
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from app import changes, database
+
+
+def current_seq(client, headers):
+    return client.get("/changes", headers=headers).json()["seq"]
+
+
+def feed(client, headers, since, **params):
+    response = client.get("/changes", params={"since": since, **params}, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+def add_expense(client, headers, budget_id, amount=10.0):
+    return client.post(
+        f"/budgets/{budget_id}/expenses/",
+        json={"description": "Expense", "amount": amount, "category": "Food"},
+        headers=headers,
+    ).json()
+
+
+class TestChangeFeed:
+    """GET /changes"""
+
+    def test_feed_returns_rows_changed_since_seq(self, client, auth_headers):
+        """Inserts, updates and deletes come back once per row with the current data"""
+        headers = auth_headers()
+        budget = client.post("/budgets/", json={"name": "Trip", "limit": 100.0}, headers=headers).json()
+        kept = add_expense(client, headers, budget["id"])
+        removed = add_expense(client, headers, budget["id"])
+        add_expense(client, headers, budget["id"])  # so the deleted id is not reused
+        since = current_seq(client, headers)
+
+        client.put(f"/budgets/{budget['id']}", json={"name": "Holiday", "limit": 200.0}, headers=headers)
+        client.put(
+            f"/budgets/{budget['id']}/expenses/{kept['id']}",
+            json={"description": "Hotel", "amount": 80.0, "category": "Travel"},
+            headers=headers,
+        )
+        client.delete(f"/budgets/{budget['id']}/expenses/{removed['id']}", headers=headers)
+        added = add_expense(client, headers, budget["id"], amount=5.0)
+        client.put(
+            f"/budgets/{budget['id']}/expenses/{added['id']}",
+            json={"description": "Taxi", "amount": 6.0, "category": "Travel"},
+            headers=headers,
+        )
+        transient = add_expense(client, headers, budget["id"])
+        add_expense(client, headers, budget["id"])
+        client.delete(f"/budgets/{budget['id']}/expenses/{transient['id']}", headers=headers)
+
+        result = feed(client, headers, since)
+        by_row = {(c["entity"], c["id"]): c for c in result["changes"]}
+        assert len(result["changes"]) == len(by_row) == 5
+        assert by_row[("budget", budget["id"])]["op"] == "update"
+        assert by_row[("budget", budget["id"])]["data"]["name"] == "Holiday"
+        assert by_row[("expense", kept["id"])]["data"]["description"] == "Hotel"
+        assert by_row[("expense", removed["id"])] == {
+            "seq": by_row[("expense", removed["id"])]["seq"], "entity": "expense", "op": "delete", "id": removed["id"], "data": None,
+        }
+        assert by_row[("expense", added["id"])]["op"] == "insert"
+        assert by_row[("expense", added["id"])]["data"]["amount"] == 6.0
+        assert [c["seq"] for c in result["changes"]] == sorted(c["seq"] for c in result["changes"])
+        assert result["seq"] > since
+        assert feed(client, headers, result["seq"])["changes"] == []
+
+    def test_other_users_changes_are_hidden(self, client, auth_headers):
+        """Seqs are global, but every user only sees their own rows"""
+        alice, bob = auth_headers(), auth_headers()
+        since = current_seq(client, alice)
+        client.post("/budgets/", json={"name": "Alice", "limit": 1.0}, headers=alice)
+        assert feed(client, bob, since)["changes"] == []
+        assert len(feed(client, alice, since)["changes"]) == 1
+
+    def test_feed_is_paged(self, client, auth_headers):
+        """limit bounds the log entries per response and more asks for the next page"""
+        headers = auth_headers()
+        since = current_seq(client, headers)
+        client.post(
+            "/budgets/",
+            json={"name": "Import", "limit": 1.0},
+            headers=headers,
+        )
+        budget_id = feed(client, headers, since)["changes"][0]["id"]
+        client.post(
+            f"/budgets/{budget_id}/expenses/import",
+            content="description,amount,category\n" + "Row,1,Food\n" * 5,
+            headers={**headers, "Content-Type": "text/csv"},
+        )
+
+        seen, pages = [], 0
+        while True:
+            page = feed(client, headers, since, limit=2)
+            seen.extend(page["changes"])
+            since, pages = page["seq"], pages + 1
+            if not page["more"]:
+                break
+        assert pages == 3
+        assert [c["entity"] for c in seen] == ["budget"] + ["expense"] * 5
+
+    def test_compacted_seqs_must_reload(self, client, auth_headers):
+        """A client behind the compaction horizon gets a 410"""
+        headers = auth_headers()
+        since = current_seq(client, headers)
+        client.post("/budgets/", json={"name": "Old", "limit": 1.0}, headers=headers)
+
+        db = database.SessionLocal()
+        try:
+            assert changes.compact(db, datetime.utcnow() + timedelta(seconds=1)) >= 1
+            db.commit()
+        finally:
+            db.close()
+
+        assert client.get("/changes", params={"since": since}, headers=headers).status_code == 410
+        assert client.get("/changes/stream", params={"since": since}, headers=headers).status_code == 410
+        latest = current_seq(client, headers)
+        assert latest > since
+        assert feed(client, headers, latest)["changes"] == []
+
+
+async def next_event(stream, timeout=5):
+    while True:
+        message = await asyncio.wait_for(stream.__anext__(), timeout)
+        if not message.startswith(":"):
+            return message
+
+
+class TestChangeStream:
+    """GET /changes/stream"""
+
+    def test_stream_pushes_new_changes(self, client, auth_headers):
+        """A write reaches an open stream as one SSE event"""
+        from app.main import app
+
+        headers = auth_headers()
+        since = current_seq(client, headers)
+
+        async def scenario():
+            from app.auth import verify_authorization
+
+            user = verify_authorization(headers["Authorization"])
+            stream = changes.stream(user, since)
+            pending = asyncio.ensure_future(next_event(stream))
+            await asyncio.sleep(0.05)
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+                await http.post("/budgets/", json={"name": "Pushed", "limit": 1.0}, headers=headers)
+            try:
+                return await pending
+            finally:
+                await stream.aclose()
+
+        message = client.portal.call(scenario)
+        event_id, event, data = message.strip().split("\n")
+        assert event == "event: changes"
+        payload = json.loads(data[len("data: "):])
+        assert event_id == f"id: {payload['seq']}"
+        assert [(c["entity"], c["op"], c["data"]["name"]) for c in payload["changes"]] == [("budget", "insert", "Pushed")]
+        assert changes.hub.subscribers == 0
+
+    def test_idle_subscribers_do_not_slow_writes(self, client, auth_headers, monkeypatch):
+        """10k idle streams leave the write latency of other users unchanged"""
+        from app.main import app
+
+        headers = auth_headers()
+        reads = []
+        read_feed = changes.read_feed
+
+        async def counting_read_feed(*args):
+            result = await read_feed(*args)
+            reads.append(1)
+            return result
+
+        monkeypatch.setattr(changes, "read_feed", counting_read_feed)
+
+        async def scenario():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+
+                async def write_latency(writes=40):
+                    samples = []
+                    for i in range(writes):
+                        started = time.perf_counter()
+                        response = await http.post("/budgets/", json={"name": f"W{i}", "limit": 1.0}, headers=headers)
+                        samples.append(time.perf_counter() - started)
+                        assert response.status_code == 200
+                    return statistics.median(samples)
+
+                async def drain(stream):
+                    async for _ in stream:
+                        pass
+
+                baseline = await write_latency()
+                async with database.AsyncReadSessionLocal() as db:
+                    since = await changes.latest_seq(db)
+                tasks = [asyncio.ensure_future(drain(changes.stream(f"idle_{i}", since))) for i in range(10000)]
+                try:
+                    # Wait until every stream has done its initial read and is parked
+                    while len(reads) < len(tasks):
+                        await asyncio.sleep(0.05)
+                    assert changes.hub.subscribers == len(tasks)
+                    loaded = await write_latency()
+                    assert len(reads) == len(tasks)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                return baseline, loaded
+
+        baseline, loaded = client.portal.call(scenario)
+        assert changes.hub.subscribers == 0
+        assert loaded < baseline * 1.5 + 0.002
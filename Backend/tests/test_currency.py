@@ -0,0 +1,296 @@
+"""
+Multi-currency expenses, rate snapshots and conversion tests.
+"""
+
+import csv
+import io
+import time
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, delete, event, inspect, text
+
+from app import bootstrap, database, fx, models, rollups, search
+
+# EUR per USD rose from 0.5 to 0.8; GBP was first quoted on the 3rd
+RATES = [
+    (date(2024, 1, 1), "USD", 1.0), (date(2024, 1, 1), "EUR", 0.5),
+    (date(2024, 1, 3), "USD", 1.0), (date(2024, 1, 3), "EUR", 0.8), (date(2024, 1, 3), "GBP", 0.4),
+]
+
+
+@pytest.fixture
+def rates(client):
+    db = database.SessionLocal()
+    try:
+        db.execute(delete(models.ExchangeRate))
+        db.add_all(models.ExchangeRate(date=day, currency=code, rate=rate) for day, code, rate in RATES)
+        db.commit()
+    finally:
+        db.close()
+    return fx.RateTable.from_rows(RATES)
+
+
+class TestRateTable:
+    """fx.RateTable"""
+
+    def test_uses_latest_rate_on_or_before_each_day(self):
+        """Days between snapshots use the previous one, days before the first use the first"""
+        table = fx.RateTable.from_rows(RATES)
+        converted = table.convert(
+            [10.0, 10.0, 10.0, 10.0],
+            ["USD", "USD", "USD", "EUR"],
+            ["2023-12-25", "2024-01-02T18:00:00", "2024-01-09", "2024-01-03"],
+            "EUR",
+        )
+        assert converted.tolist() == pytest.approx([5.0, 5.0, 8.0, 10.0])
+
+    def test_missing_days_are_filled(self):
+        """A currency quoted later than others borrows its first rate for earlier days"""
+        table = fx.RateTable.from_rows(RATES)
+        assert table.convert([4.0], ["GBP"], ["2024-01-01"], "USD").tolist() == pytest.approx([10.0])
+
+    def test_unknown_currency_is_rejected(self):
+        """Converting to or from a currency without rates is a 422"""
+        table = fx.RateTable.from_rows(RATES)
+        with pytest.raises(HTTPException) as exc:
+            table.convert([1.0], ["USD"], ["2024-01-01"], "JPY")
+        assert exc.value.status_code == 422
+
+    def test_million_amounts_convert_quickly(self):
+        """A million amounts across a year of snapshots convert in well under a second"""
+        import numpy as np
+
+        codes = ["USD", "EUR", "GBP", "JPY", "CHF"]
+        days = np.arange("2023-01-01", "2024-01-01", dtype="datetime64[D]")
+        rows = [(day, code, 1.0 + i + d / 1000) for d, day in enumerate(days.tolist()) for i, code in enumerate(codes)]
+        table = fx.RateTable.from_rows(rows)
+
+        rng = np.random.default_rng(0)
+        size = 1_000_000
+        amounts = rng.random(size) * 100
+        currencies = np.array(codes)[rng.integers(0, len(codes), size)]
+        expense_days = days[rng.integers(0, len(days), size)]
+
+        started = time.perf_counter()
+        converted = table.convert(amounts, currencies, expense_days, "EUR")
+        elapsed = time.perf_counter() - started
+
+        assert converted.shape == (size,)
+        assert not np.isnan(converted).any()
+        assert elapsed < 1.0
+
+
+class TestCurrencyEndpoints:
+    """Currencies on budgets, expenses, summaries and exports"""
+
+    def make_budget(self, client, headers):
+        budget = client.post("/budgets/", json={"name": "Trip", "limit": 100.0, "currency": "eur"}, headers=headers).json()
+        assert budget["currency"] == "EUR"
+        body = (
+            '{"description": "Museum", "amount": 10.0, "category": "Fun", "date": "2024-01-02T10:00:00"}\n'
+            '{"description": "Lunch", "amount": 20.0, "category": "Food", "currency": "usd", "date": "2024-01-01T12:00:00"}\n'
+            '{"description": "Dinner", "amount": 4.0, "category": "Food", "currency": "GBP", "date": "2024-01-05T20:00:00"}\n'
+        )
+        client.post(
+            f"/budgets/{budget['id']}/expenses/import",
+            content=body.encode(),
+            headers={**headers, "Content-Type": "application/x-ndjson"},
+        )
+        return budget
+
+    def test_expense_defaults_to_budget_currency(self, client, auth_headers):
+        """An expense without a currency is in its budget's currency"""
+        headers = auth_headers()
+        budget = self.make_budget(client, headers)
+        listed = client.get(f"/budgets/{budget['id']}/expenses/", headers=headers).json()
+        assert [e["currency"] for e in listed] == ["USD", "EUR", "GBP"]
+        created = client.post(
+            f"/budgets/{budget['id']}/expenses/",
+            json={"description": "Taxi", "amount": 5.0, "category": "Travel"},
+            headers=headers,
+        ).json()
+        assert created["currency"] == "EUR"
+
+    def test_currency_must_be_three_letters(self, client, auth_headers):
+        """Codes other than three letters are rejected on create"""
+        headers = auth_headers()
+        budget = self.make_budget(client, headers)
+        for code in ("1$%", "EU", "EURO", "E R"):
+            expense = {"description": "Bad", "amount": 1.0, "category": "Misc", "currency": code}
+            assert client.post(f"/budgets/{budget['id']}/expenses/", json=expense, headers=headers).status_code == 422
+            assert client.post("/budgets/", json={"name": "Bad", "limit": 1.0, "currency": code}, headers=headers).status_code == 422
+
+    def test_update_keeps_the_currency(self, client, auth_headers):
+        """Updating an expense without a currency leaves it in the one it was stored in"""
+        headers = auth_headers()
+        budget = self.make_budget(client, headers)
+        lunch = client.get(f"/budgets/{budget['id']}/expenses/", headers=headers).json()[0]
+        assert lunch["currency"] == "USD"
+
+        edit = {"description": "Late lunch", "amount": 25.0, "category": "Food"}
+        updated = client.put(f"/budgets/{budget['id']}/expenses/{lunch['id']}", json=edit, headers=headers).json()
+        assert updated["currency"] == "USD"
+
+        operation = {"op": "update", "entity": "expense", "id": lunch["id"], "budget_id": budget["id"], "data": edit}
+        assert client.post("/batch", json={"operations": [operation]}, headers=headers).status_code == 200
+        assert client.get(f"/budgets/{budget['id']}/expenses/", headers=headers).json()[0]["currency"] == "USD"
+
+    def test_budget_update_keeps_the_currency(self, client, auth_headers):
+        """Updating a budget without a currency leaves it in the one it has"""
+        headers = auth_headers()
+        budget = self.make_budget(client, headers)
+
+        updated = client.put(f"/budgets/{budget['id']}", json={"name": "Trip", "limit": 150.0}, headers=headers).json()
+        assert (updated["currency"], updated["limit"]) == ("EUR", 150.0)
+
+        operation = {"op": "update", "entity": "budget", "id": budget["id"], "data": {"name": "Trip", "limit": 200.0}}
+        assert client.post("/batch", json={"operations": [operation]}, headers=headers).status_code == 200
+        (listed,) = client.get("/budgets/", params={"include": "none"}, headers=headers).json()
+        assert (listed["currency"], listed["limit"]) == ("EUR", 200.0)
+
+    def test_summary_converts_on_request(self, client, auth_headers, rates):
+        """?currency= converts each expense at its own day's rate and the limit at the latest"""
+        headers = auth_headers()
+        self.make_budget(client, headers)
+
+        raw = client.get("/budgets/summary", headers=headers).json()[0]
+        assert raw["currency"] == "EUR"
+        # Spend in other currencies is reported apart, unconverted
+        assert raw["categories"] == {"Fun": 10.0}
+        assert raw["spent"] == 10.0
+        assert raw["other_currencies"] == {"USD": 20.0, "GBP": 4.0}
+        assert raw["expense_count"] == 3
+
+        summary = client.get("/budgets/summary", params={"currency": "usd"}, headers=headers).json()[0]
+        assert summary["currency"] == "USD"
+        # 10 EUR at 0.5, 20 USD, 4 GBP at 0.4
+        assert summary["categories"] == pytest.approx({"Fun": 20.0, "Food": 30.0})
+        assert summary["spent"] == pytest.approx(50.0)
+        assert summary["limit"] == pytest.approx(125.0)
+        assert summary["remaining"] == pytest.approx(75.0)
+        assert summary["other_currencies"] == {}
+
+        response = client.get("/budgets/summary", params={"currency": "JPY"}, headers=headers)
+        assert response.status_code == 422
+
+    def test_summary_needs_no_rates_without_a_currency(self, client, auth_headers):
+        """Without ?currency= nothing is converted, so neither missing snapshots nor unknown codes fail it"""
+        headers = auth_headers()
+        with database.engine.begin() as conn:
+            conn.execute(delete(models.ExchangeRate))
+        budget = client.post("/budgets/", json={"name": "Home", "limit": 50.0, "currency": "GBP"}, headers=headers).json()
+        client.post(f"/budgets/{budget['id']}/expenses/", json={"description": "Tea", "amount": 5.0, "category": "Food"}, headers=headers)
+        client.post(f"/budgets/{budget['id']}/expenses/", json={"description": "Sushi", "amount": 900.0, "category": "Food", "currency": "JPY"}, headers=headers)
+
+        response = client.get("/budgets/summary", headers=headers)
+
+        assert response.status_code == 200
+        (summary,) = response.json()
+        assert (summary["currency"], summary["spent"], summary["other_currencies"]) == ("GBP", 5.0, {"JPY": 900.0})
+        assert client.get("/budgets/summary", params={"currency": "EUR"}, headers=headers).status_code == 503
+
+    def test_undated_spend_converts_at_the_latest_rate(self, client, auth_headers, rates):
+        """Spend without a day bucket is converted at the latest snapshot"""
+        headers = auth_headers()
+        budget = self.make_budget(client, headers)
+        with database.SessionLocal() as db:
+            db.execute(text("UPDATE expenses SET date = NULL WHERE budget_id = :id AND description = 'Lunch'"), {"id": budget["id"]})
+            rollups.rebuild(db)
+            db.commit()
+
+        summary = client.get("/budgets/summary", params={"currency": "EUR"}, headers=headers).json()[0]
+
+        # 20 USD at the latest 0.8 instead of the 1st's 0.5
+        assert summary["categories"] == pytest.approx({"Fun": 10.0, "Food": 24.0})
+
+    def test_export_adds_converted_amount(self, client, auth_headers, rates):
+        """The export carries the converted amount next to the original"""
+        headers = auth_headers()
+        self.make_budget(client, headers)
+
+        response = client.get("/export", params={"currency": "EUR"}, headers=headers)
+
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [(r["currency"], float(r["converted_amount"])) for r in rows] == [
+            ("USD", pytest.approx(10.0)), ("EUR", pytest.approx(10.0)), ("GBP", pytest.approx(8.0)),
+        ]
+        assert client.get("/export", params={"currency": "JPY"}, headers=headers).status_code == 422
+
+
+class TestSnapshot:
+    """python -m app.fx snapshot"""
+
+    def test_snapshot_replaces_the_day(self, client, monkeypatch):
+        """Taking a snapshot twice on one day keeps only the latest rates"""
+        responses = iter([{"eur": 0.9, "GBP": 0.7}, {"EUR": 0.95}])
+
+        async def get_exchange_rates(base):
+            return next(responses)
+
+        monkeypatch.setattr(fx.external_api, "get_exchange_rates", get_exchange_rates)
+
+        async def run():
+            async with database.AsyncSessionLocal() as db:
+                await fx.snapshot(db, date(2030, 1, 1))
+                count = await fx.snapshot(db, date(2030, 1, 1))
+                await db.commit()
+                table = await fx.load_rate_table(db)
+            return count, table
+
+        count, table = client.portal.call(run)
+        assert count == 2
+        assert table.convert([1.0], ["USD"], ["2030-01-01"], "EUR").tolist() == pytest.approx([0.95])
+
+
+class TestBootstrap:
+    """bootstrap.init_db on databases from earlier versions"""
+
+    def test_adds_currency_to_existing_tables(self, tmp_path):
+        """Databases created before currencies gain the columns, filled with the default"""
+        engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+        with engine.begin() as conn:
+            conn.execute(text('CREATE TABLE budgets (id INTEGER PRIMARY KEY, name VARCHAR, "limit" FLOAT, user_id VARCHAR)'))
+            conn.execute(text("INSERT INTO budgets (name, \"limit\", user_id) VALUES ('Old', 1.0, 'u')"))
+
+        bootstrap.init_db(engine)
+
+        assert "currency" in {c["name"] for c in inspect(engine).get_columns("budgets")}
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT currency FROM budgets")).scalar() == "USD"
+        engine.dispose()
+
+    def test_rebuilds_totals_without_currency(self, tmp_path):
+        """Running totals keyed without a currency are recreated per currency from the expenses"""
+        engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+        # The search index triggers call it when the expenses go in
+        event.listen(engine, "connect", lambda dbapi_connection, record: search.register(dbapi_connection))
+        bootstrap.init_db(engine)
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE budget_category_totals"))
+            conn.execute(text("DROP TABLE spend_buckets"))
+            conn.execute(text(
+                "CREATE TABLE budget_category_totals (budget_id INTEGER, category VARCHAR, total FLOAT, count INTEGER, "
+                "PRIMARY KEY (budget_id, category))"
+            ))
+            conn.execute(text(
+                "CREATE TABLE spend_buckets (budget_id INTEGER, grain VARCHAR, start DATE, category VARCHAR, total FLOAT, "
+                "count INTEGER, PRIMARY KEY (budget_id, grain, start, category))"
+            ))
+            conn.execute(text("INSERT INTO budgets (id, name, \"limit\", currency, user_id) VALUES (1, 'Old', 1.0, 'USD', 'u')"))
+            for amount, currency in ((10.0, "USD"), (100.0, "JPY")):
+                conn.execute(text(
+                    "INSERT INTO expenses (description, amount, currency, category, date, budget_id) "
+                    "VALUES ('Old', :amount, :currency, 'Food', '2024-01-01 00:00:00', 1)"
+                ), {"amount": amount, "currency": currency})
+            conn.execute(text("INSERT INTO budget_category_totals VALUES (1, 'Food', 110.0, 2)"))
+
+        bootstrap.init_db(engine)
+
+        with engine.connect() as conn:
+            totals = conn.execute(text("SELECT currency, total, count FROM budget_category_totals ORDER BY currency")).all()
+            buckets = conn.execute(text("SELECT count(*) FROM spend_buckets WHERE grain = 'day'")).scalar()
+        assert [tuple(row) for row in totals] == [("JPY", 100.0, 1), ("USD", 10.0, 1)]
+        assert buckets == 2
+        engine.dispose()
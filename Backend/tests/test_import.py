@@ -0,0 +1,140 @@
+"""
+Bulk expense import tests.
+"""
+
+import httpx
+from sqlalchemy import func, select
+
+from app import config, database, models, purge
+
+
+def create_budget(client, headers):
+    return client.post("/budgets/", json={"name": "Imported", "limit": 5000.0}, headers=headers).json()
+
+
+class TestBulkImport:
+    """POST /budgets/{id}/expenses/import"""
+
+    def test_csv_import_reports_bad_rows(self, client, auth_headers):
+        """Valid CSV rows are stored in chunks and invalid ones are reported by row"""
+        headers = auth_headers()
+        budget = create_budget(client, headers)
+        body = (
+            "Description,Amount,Category,Date\n"
+            "Coffee,3.5,Food,2023-01-02T08:00:00\n"
+            '"Rent, January",1200,Utilities,\n'
+            "Broken,not-a-number,Food,\n"
+            '"Multi\nline",10,General,2023-01-03T00:00:00\n'
+            "Bus,2.75,Transport,2023-01-04T09:30:00\n"
+        )
+
+        response = client.post(
+            f"/budgets/{budget['id']}/expenses/import",
+            params={"chunk_size": 2},
+            content=body.encode(),
+            headers={**headers, "Content-Type": "text/csv"},
+        )
+
+        assert response.status_code == 200
+        report = response.json()
+        assert report["imported"] == 4
+        assert report["failed"] == 1
+        assert report["errors"][0]["row"] == 3
+        expenses = client.get(f"/budgets/{budget['id']}/expenses/", headers=headers).json()
+        assert {e["description"] for e in expenses} == {"Coffee", "Rent, January", "Multi\nline", "Bus"}
+        (summary,) = client.get("/budgets/summary", headers=headers).json()
+        assert summary["spent"] == 1216.25
+        assert summary["expense_count"] == 4
+
+    def test_malformed_csv_rows_are_reported(self, client, auth_headers, monkeypatch):
+        """Stray quotes, bare carriage returns and overlong records fail their own row only"""
+        monkeypatch.setattr(config, "IMPORT_MAX_RECORD_LENGTH", 100)
+        headers = auth_headers()
+        budget = create_budget(client, headers)
+        body = (
+            "description,amount,category\n"
+            'Cable 5" long,3,Electronics\n'
+            "Carriage\rreturn,1,Misc\n"
+            f"{'x' * 200},1,Misc\n"
+            f'"Quoted and long{chr(10) * 3}{"y" * 150}",1,Misc\n'
+            "Bus,2.75,Transport\n"
+        )
+
+        response = client.post(
+            f"/budgets/{budget['id']}/expenses/import",
+            content=body.encode(),
+            headers={**headers, "Content-Type": "text/csv"},
+        )
+
+        assert response.status_code == 200
+        report = response.json()
+        assert report["imported"] == 2
+        assert [error["row"] for error in report["errors"]] == [2, 3, 4]
+        assert report["errors"][0]["errors"][0].startswith("Invalid CSV")
+        expenses = client.get(f"/budgets/{budget['id']}/expenses/", headers=headers).json()
+        assert {e["description"] for e in expenses} == {'Cable 5" long', "Bus"}
+
+    def test_ndjson_import(self, client, auth_headers):
+        """NDJSON uploads are detected from the content type"""
+        headers = auth_headers()
+        budget = create_budget(client, headers)
+        body = (
+            '{"description": "Lunch", "amount": 12, "category": "Food"}\n'
+            "{not json}\n"
+            "\n"
+            '{"description": "Taxi", "amount": 30, "category": "Transport"}'
+        )
+
+        response = client.post(
+            f"/budgets/{budget['id']}/expenses/import",
+            content=body.encode(),
+            headers={**headers, "Content-Type": "application/x-ndjson"},
+        )
+
+        report = response.json()
+        assert report["imported"] == 2
+        assert [error["row"] for error in report["errors"]] == [2]
+
+    def test_import_into_foreign_budget(self, client, auth_headers):
+        """Importing into another user's budget is a 404"""
+        budget = create_budget(client, auth_headers())
+        response = client.post(
+            f"/budgets/{budget['id']}/expenses/import",
+            content=b"description,amount,category\nx,1,Food\n",
+            headers={**auth_headers(), "Content-Type": "text/csv"},
+        )
+        assert response.status_code == 404
+
+    def test_budget_deleted_during_import(self, client, auth_headers, monkeypatch):
+        """Chunks that arrive after the budget is deleted are reported, not stored"""
+        from app.main import app
+
+        monkeypatch.setattr(purge.worker, "wake", lambda: None)
+        headers = auth_headers()
+        budget = create_budget(client, headers)
+
+        async def scenario():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+
+                async def body():
+                    yield b"description,amount,category\nFirst,1,Food\n"
+                    assert (await http.delete(f"/budgets/{budget['id']}", headers=headers)).status_code == 200
+                    yield b"Second,2,Food\nThird,3,Food\n"
+
+                return await http.post(
+                    f"/budgets/{budget['id']}/expenses/import",
+                    params={"chunk_size": 1},
+                    content=body(),
+                    headers={**headers, "Content-Type": "text/csv"},
+                )
+
+        response = client.portal.call(scenario)
+
+        report = response.json()
+        assert report["imported"] == 1
+        assert [(error["row"], error["errors"]) for error in report["errors"]] == [(2, ["Budget not found"]), (3, ["Budget not found"])]
+        with database.SessionLocal() as db:
+            assert db.execute(select(func.count()).select_from(models.Expense).where(models.Expense.budget_id == budget["id"])).scalar() == 1
+        monkeypatch.undo()
+        client.portal.call(purge.worker.wake)
+        client.portal.call(purge.worker.join)
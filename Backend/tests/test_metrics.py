@@ -0,0 +1,105 @@
+"""
+Request, SQL and upstream instrumentation tests.
+"""
+
+import asyncio
+import logging
+import re
+
+import pytest
+
+from app import config, metrics
+from app.external_api import RateCache
+
+
+@pytest.fixture
+def scrape(client):
+    metrics.reset()
+
+    def read():
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        return response.text
+
+    return read
+
+
+def sample(text, name, **labels):
+    """Value of the first sample of ``name`` carrying all of ``labels``"""
+    for line in text.splitlines():
+        match = re.match(r"([a-z_]+)(\{.*\})? (\S+)$", line)
+        if not match or match.group(1) != name:
+            continue
+        found = dict(re.findall(r'(\w+)="([^"]*)"', match.group(2) or ""))
+        if all(found.get(key) == value for key, value in labels.items()):
+            return float(match.group(3))
+    return None
+
+
+class TestMetrics:
+    """GET /metrics"""
+
+    def test_requests_are_labelled_by_route_template(self, client, auth_headers, scrape):
+        """Ids in the path collapse into one series per route"""
+        headers = auth_headers()
+        for name in ("A", "B"):
+            budget = client.post("/budgets/", json={"name": name, "limit": 10.0}, headers=headers).json()
+            client.get(f"/budgets/{budget['id']}/expenses/", headers=headers)
+        client.get("/budgets/", headers={"Authorization": "Basic x"})
+        client.get("/no-such-route")
+
+        text = scrape()
+        route = "/budgets/{budget_id}/expenses/"
+        assert sample(text, "http_requests_total", method="GET", route=route, status="200") == 2
+        assert sample(text, "http_request_duration_seconds_count", method="GET", route=route) == 2
+        assert sample(text, "http_request_duration_seconds_bucket", method="GET", route=route, le="+Inf") == 2
+        assert sample(text, "http_requests_total", method="GET", route="/budgets/", status="401") == 1
+        assert sample(text, "http_requests_total", route="unmatched", status="404") == 1
+        # Only the scrape itself is still in flight
+        assert sample(text, "http_requests_in_flight") == 1
+
+    def test_queries_are_counted_per_request(self, client, auth_headers, count_queries, scrape):
+        """Per-request query counts match the statements actually run"""
+        headers = auth_headers()
+        client.post("/budgets/", json={"name": "Counted", "limit": 10.0}, headers=headers)
+        with count_queries() as statements:
+            client.get("/budgets/", headers=headers)
+
+        text = scrape()
+        labels = {"method": "GET", "route": "/budgets/"}
+        assert sample(text, "http_request_db_queries_sum", **labels) == len(statements)
+        assert sample(text, "http_request_db_seconds_count", **labels) == 1
+        assert sample(text, "db_query_duration_seconds_count") >= len(statements) + 1
+
+    def test_upstream_calls_are_timed(self, scrape):
+        """Rate provider calls are recorded with their outcome"""
+
+        async def scenario():
+            cache = RateCache(url="http://127.0.0.1:1/latest/{base}", timeout=(0.5, 0.5))
+            try:
+                return await cache.get("USD")
+            finally:
+                await cache.aclose()
+
+        metrics.reset()
+        assert asyncio.run(scenario()) == {}
+        assert sample(scrape(), "upstream_request_duration_seconds_count", upstream="rates", outcome="error") == 1
+
+    def test_slow_requests_are_logged_with_their_sql(self, client, auth_headers, monkeypatch, caplog):
+        """Requests over the threshold log the statements they ran"""
+        headers = auth_headers()
+        monkeypatch.setattr(config, "SLOW_REQUEST_SECONDS", 1e-9)
+        with caplog.at_level(logging.WARNING, logger="app.metrics"):
+            client.get("/budgets/", headers=headers)
+
+        (record,) = [r for r in caplog.records if r.name == "app.metrics"]
+        message = record.getMessage()
+        assert message.startswith("Slow request GET /budgets/ -> 200")
+        assert "SELECT" in message and "FROM budgets" in message
+
+    def test_slow_request_log_is_off_by_default(self, client, auth_headers, caplog):
+        """Nothing is logged without a threshold"""
+        with caplog.at_level(logging.WARNING, logger="app.metrics"):
+            client.get("/budgets/", headers=auth_headers())
+        assert not [r for r in caplog.records if r.name == "app.metrics"]
@@ -0,0 +1,142 @@
+"""
+Deferred budget deletion tests.
+"""
+
+from sqlalchemy import event, func, select, text
+
+from app import config, database, metrics, models, purge
+
+
+def seed(client, headers, expenses=5):
+    budget = client.post("/budgets/", json={"name": "Doomed", "limit": 100.0}, headers=headers).json()
+    for n in range(expenses):
+        client.post(f"/budgets/{budget['id']}/expenses/", json={"description": f"Coffee {n}", "amount": 2.0, "category": "Food"}, headers=headers)
+    return budget
+
+
+def expenses_of(budget_id):
+    with database.SessionLocal() as db:
+        return db.execute(select(func.count()).select_from(models.Expense).where(models.Expense.budget_id == budget_id)).scalar()
+
+
+def metric(client, name):
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[1])
+
+
+class TestDeferredDeletion:
+    """DELETE /budgets/{id} and the purge worker"""
+
+    def test_deleted_budget_is_hidden_at_once(self, client, auth_headers, monkeypatch):
+        """Before any expense is removed, the budget and its expenses are gone from every read"""
+        monkeypatch.setattr(purge.worker, "wake", lambda: None)
+        headers = auth_headers()
+        kept = seed(client, headers, expenses=1)
+        doomed = seed(client, headers)
+
+        assert client.delete(f"/budgets/{doomed['id']}", headers=headers).status_code == 200
+
+        assert expenses_of(doomed["id"]) == 5
+        assert [budget["id"] for budget in client.get("/budgets/", headers=headers).json()] == [kept["id"]]
+        assert client.get(f"/budgets/{doomed['id']}/expenses/", headers=headers).status_code == 404
+        assert [summary["id"] for summary in client.get("/budgets/summary", headers=headers).json()] == [kept["id"]]
+        assert len(client.get("/expenses/search", params={"q": "coffee"}, headers=headers).json()) == 1
+        assert client.delete(f"/budgets/{doomed['id']}", headers=headers).status_code == 404
+        monkeypatch.undo()
+        client.portal.call(purge.worker.wake)
+        client.portal.call(purge.worker.join)
+
+    def test_worker_purges_in_batches(self, client, auth_headers, monkeypatch):
+        """Expenses go a batch per transaction, then the budget row and its queue entry"""
+        monkeypatch.setattr(config, "PURGE_BATCH_SIZE", 2)
+        monkeypatch.setattr(config, "PURGE_PAUSE_MS", 0)
+        headers = auth_headers()
+        doomed = seed(client, headers)
+        commits = []
+        record_commit = lambda conn: commits.append(1)
+        event.listen(database.async_engine.sync_engine, "commit", record_commit)
+        try:
+            client.delete(f"/budgets/{doomed['id']}", headers=headers)
+            client.portal.call(purge.worker.join)
+        finally:
+            event.remove(database.async_engine.sync_engine, "commit", record_commit)
+
+        # The delete itself, three batches of at most 2 and the final one
+        assert len(commits) == 5
+        assert expenses_of(doomed["id"]) == 0
+        with database.SessionLocal() as db:
+            assert db.get(models.Budget, doomed["id"]) is None
+            assert db.get(models.BudgetPurge, doomed["id"]) is None
+
+    def test_purge_is_not_counted_against_the_request(self, client, auth_headers, monkeypatch):
+        """The pass a delete starts runs outside the SQL statistics of the request that woke it"""
+        monkeypatch.setattr(purge.worker, "wake", lambda: None)
+        headers = auth_headers()
+        doomed = seed(client, headers)
+        client.delete(f"/budgets/{doomed['id']}", headers=headers)
+        monkeypatch.undo()
+        stats = metrics.RequestStats()
+
+        async def wake_in_request():
+            token = metrics._current.set(stats)
+            try:
+                purge.worker.wake()
+            finally:
+                metrics._current.reset(token)
+            await purge.worker.join()
+
+        client.portal.call(wake_in_request)
+
+        assert expenses_of(doomed["id"]) == 0
+        assert stats.queries == 0
+
+    def test_backlog_metric(self, client, auth_headers, monkeypatch):
+        """The gauges count queued budgets and their expenses until the worker has run"""
+        monkeypatch.setattr(purge.worker, "wake", lambda: None)
+        headers = auth_headers()
+        doomed = seed(client, headers, expenses=3)
+        client.delete(f"/budgets/{doomed['id']}", headers=headers)
+
+        client.portal.call(purge.refresh_backlog)
+        assert metric(client, "budget_purge_backlog_budgets") == 1
+        assert metric(client, "budget_purge_backlog_expenses") == 3
+
+        monkeypatch.undo()
+        client.portal.call(purge.worker.wake)
+        client.portal.call(purge.worker.join)
+        assert metric(client, "budget_purge_backlog_budgets") == 0
+        assert metric(client, "budget_purge_backlog_expenses") == 0
+
+    def test_batch_deletes_are_purged(self, client, auth_headers):
+        """Budgets deleted through POST /batch are queued the same way"""
+        headers = auth_headers()
+        doomed = seed(client, headers, expenses=2)
+
+        response = client.post("/batch", json={"operations": [{"op": "delete", "entity": "budget", "id": doomed["id"]}]}, headers=headers)
+        client.portal.call(purge.worker.join)
+
+        assert response.status_code == 200
+        assert expenses_of(doomed["id"]) == 0
+
+    def test_orphan_job(self, client, auth_headers, capsys):
+        """The one-off job removes expenses whose budget is missing and leaves the rest"""
+        headers = auth_headers()
+        kept = seed(client, headers, expenses=2)
+        with database.engine.begin() as conn:
+            for budget_id in ("NULL", "987654"):
+                conn.execute(text(
+                    "INSERT INTO expenses (description, amount, currency, category, date, budget_id) "
+                    f"VALUES ('Orphan', 1.0, 'USD', 'Food', '2024-01-01 00:00:00', {budget_id})"
+                ))
+            conn.execute(text("INSERT INTO budget_category_totals (budget_id, category, currency, total, count) VALUES (987654, 'Food', 'USD', 1.0, 1)"))
+
+        assert purge.main(["--dry-run"]) == 0
+        assert "found 2 orphaned expenses" in capsys.readouterr().out
+        assert purge.main(["--batch-size", "1"]) == 0
+        assert "removed 2 orphaned expenses" in capsys.readouterr().out
+
+        with database.SessionLocal() as db:
+            assert db.execute(select(func.count()).select_from(models.Expense).where(purge.orphaned())).scalar() == 0
+            assert db.get(models.BudgetCategoryTotal, (987654, "Food", "USD")) is None
+        assert expenses_of(kept["id"]) == 2
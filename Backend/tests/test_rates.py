@@ -0,0 +1,162 @@
+"""
+Rate cache tests against a local stub of the exchange-rate provider.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.external_api import RateCache
+
+
+class StubProvider(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.hits = 0
+        self.status = 200
+        self.delay = 0.0
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients that time out close the connection before the response is written
+        pass
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/latest/{{base}}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.hits += 1
+        time.sleep(self.server.delay)
+        body = json.dumps({"base": self.path.rsplit("/", 1)[-1], "rates": {"EUR": 0.9, "GBP": 0.8}}).encode()
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def provider():
+    server = StubProvider()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestRateCache:
+    """Exchange-rate cache behaviour"""
+
+    def test_concurrent_misses_share_one_fetch(self, provider):
+        """500 concurrent requests for USD cause exactly one upstream fetch"""
+        provider.delay = 0.2
+
+        async def scenario():
+            cache = RateCache(url=provider.url, pool_size=4)
+            try:
+                return cache, await asyncio.gather(*(cache.get("USD") for _ in range(500)))
+            finally:
+                await cache.aclose()
+
+        cache, results = asyncio.run(scenario())
+
+        assert provider.hits == 1
+        assert len(results) == 500
+        assert all(rates == {"EUR": 0.9, "GBP": 0.8} for rates in results)
+        stats = cache.stats()
+        assert stats["fetches"] == 1
+        assert stats["misses"] == 500
+
+    def test_fresh_entries_are_served_from_cache(self, provider):
+        """Requests within the TTL do not reach the provider"""
+        clock = FakeClock()
+
+        async def scenario():
+            cache = RateCache(url=provider.url, ttl=60, clock=clock)
+            await cache.get("USD")
+            clock.now = 59
+            await cache.get("usd")
+            await cache.aclose()
+            return cache
+
+        cache = asyncio.run(scenario())
+        assert provider.hits == 1
+        assert cache.stats()["hits"] == 1
+
+    def test_stale_entries_are_revalidated_in_background(self, provider):
+        """Stale entries are returned immediately while one refresh runs"""
+        clock = FakeClock()
+
+        async def scenario():
+            cache = RateCache(url=provider.url, ttl=60, stale=60, clock=clock)
+            await cache.get("USD")
+            clock.now = 90
+            stale = await cache.get("USD")
+            deadline = time.time() + 5
+            while cache.stats()["fetches"] < 2 and time.time() < deadline:
+                await asyncio.sleep(0.01)
+            await cache.aclose()
+            return cache, stale
+
+        cache, stale = asyncio.run(scenario())
+        assert stale == {"EUR": 0.9, "GBP": 0.8}
+        assert provider.hits == 2
+        assert cache.stats()["stale_hits"] == 1
+
+    def test_falls_back_to_last_known_good(self, provider):
+        """Provider failures return the last good rates instead of nothing"""
+        clock = FakeClock()
+
+        async def scenario():
+            cache = RateCache(url=provider.url, ttl=60, stale=60, clock=clock)
+            await cache.get("USD")
+            provider.status = 500
+            clock.now = 1000
+            results = await cache.get("USD"), await cache.get("EUR")
+            await cache.aclose()
+            return cache, results
+
+        cache, (usd, eur) = asyncio.run(scenario())
+        assert usd == {"EUR": 0.9, "GBP": 0.8}
+        assert eur == {}
+        stats = cache.stats()
+        assert stats["errors"] == 2
+        assert stats["fallbacks"] == 1
+
+    def test_timeout_is_enforced(self, provider):
+        """A slow provider is abandoned after the read timeout"""
+        provider.delay = 1.0
+
+        async def scenario():
+            cache = RateCache(url=provider.url, timeout=(1, 0.1))
+            try:
+                return await cache.get("USD")
+            finally:
+                await cache.aclose()
+
+        started = time.monotonic()
+        assert asyncio.run(scenario()) == {}
+        assert time.monotonic() - started < 0.9
@@ -0,0 +1,175 @@
+"""
+Expense full-text search tests.
+"""
+
+from jose import jwt
+from sqlalchemy import text
+
+from app import bootstrap, database
+
+
+def seed(client, headers, name="Search"):
+    budget = client.post("/budgets/", json={"name": name, "limit": 1000.0}, headers=headers).json()
+    body = (
+        '{"description": "Coffee at the station", "amount": 3.0, "category": "Food", "date": "2024-01-01T08:00:00"}\n'
+        '{"description": "Coffee beans, coffee filters", "amount": 18.0, "category": "Groceries", "date": "2024-01-05T12:00:00"}\n'
+        '{"description": "Train to the coast", "amount": 20.0, "category": "Transport", "date": "2024-01-03T09:00:00"}\n'
+        '{"description": "Café crème", "amount": 4.0, "category": "Food", "date": "2024-02-01T10:00:00"}\n'
+    )
+    client.post(
+        f"/budgets/{budget['id']}/expenses/import",
+        content=body.encode(),
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+    return budget
+
+
+def search(client, headers, **params):
+    response = client.get("/expenses/search", params=params, headers=headers)
+    assert response.status_code == 200
+    return response
+
+
+def descriptions(response):
+    return [expense["description"] for expense in response.json()]
+
+
+def owner(headers):
+    """The owner prefix of the words indexed for the user of ``headers``"""
+    user_id = jwt.get_unverified_claims(headers["Authorization"].split()[1])["sub"]
+    return user_id.encode().hex().upper()
+
+
+class TestExpenseSearch:
+    """GET /expenses/search"""
+
+    def test_words_match_as_prefixes_ranked(self, client, auth_headers):
+        """Every word must match the start of a word; the better match comes first"""
+        headers = auth_headers()
+        seed(client, headers)
+
+        assert descriptions(search(client, headers, q="coff")) == ["Coffee beans, coffee filters", "Coffee at the station"]
+        assert descriptions(search(client, headers, q="coffee stat")) == ["Coffee at the station"]
+        assert descriptions(search(client, headers, q="transp")) == ["Train to the coast"]
+        assert descriptions(search(client, headers, q="cafe")) == ["Café crème"]
+        assert search(client, headers, q="offee").json() == []
+
+    def test_results_are_scoped_to_the_caller(self, client, auth_headers):
+        """Other users' expenses never match, even with the same words"""
+        headers, other = auth_headers(), auth_headers()
+        seed(client, headers)
+        seed(client, other)
+
+        results = search(client, headers, q="coffee").json()
+
+        budgets = {budget["id"] for budget in client.get("/budgets/", headers=headers).json()}
+        assert len(results) == 2 and {expense["budget_id"] for expense in results} <= budgets
+
+    def test_filters(self, client, auth_headers):
+        """Category, date range and budget narrow the matches"""
+        headers = auth_headers()
+        first = seed(client, headers, "First")
+        second = seed(client, headers, "Second")
+
+        assert descriptions(search(client, headers, q="coffee", category="Food")) == ["Coffee at the station"] * 2
+        assert descriptions(search(client, headers, q="c", start="2024-01-04", end="2024-02-01")) == ["Coffee beans, coffee filters"] * 2
+        results = search(client, headers, q="coffee", budget_id=second["id"]).json()
+        assert len(results) == 2 and {expense["budget_id"] for expense in results} == {second["id"]}
+        assert search(client, headers, q="coffee", budget_id=first["id"] + second["id"] + 1000).json() == []
+
+    def test_cursor_pagination(self, client, auth_headers):
+        """Pages follow X-Next-Cursor in rank order without gaps or repeats"""
+        headers = auth_headers()
+        for name in ("One", "Two", "Three"):
+            seed(client, headers, name)
+        everything = search(client, headers, q="c", limit=500).json()
+
+        seen, cursor = [], None
+        while True:
+            params = {"q": "c", "limit": 5, **({"cursor": cursor} if cursor else {})}
+            response = search(client, headers, **params)
+            seen += response.json()
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+
+        assert len(everything) == 12 and seen == everything
+        assert client.get("/expenses/search", params={"q": "c", "cursor": "garbage"}, headers=headers).status_code == 400
+
+    def test_index_follows_writes(self, client, auth_headers):
+        """Updated and deleted expenses are searched by their current state"""
+        headers = auth_headers()
+        budget = client.post("/budgets/", json={"name": "Writes", "limit": 100.0}, headers=headers).json()
+        expense = client.post(f"/budgets/{budget['id']}/expenses/", json={"description": "Museum ticket", "amount": 12.0, "category": "Fun"}, headers=headers).json()
+        assert descriptions(search(client, headers, q="museum")) == ["Museum ticket"]
+
+        client.put(f"/budgets/{budget['id']}/expenses/{expense['id']}", json={"description": "Concert ticket", "amount": 12.0, "category": "Fun"}, headers=headers)
+        assert search(client, headers, q="museum").json() == []
+        assert descriptions(search(client, headers, q="concert")) == ["Concert ticket"]
+
+        client.delete(f"/budgets/{budget['id']}", headers=headers)
+        assert search(client, headers, q="concert").json() == []
+
+    def test_bootstrap_indexes_existing_expenses(self, client, auth_headers):
+        """Expenses stored before the index existed are found once bootstrap has run"""
+        headers = auth_headers()
+        seed(client, headers)
+        with database.engine.begin() as conn:
+            conn.execute(text("DROP TABLE expense_search"))
+
+        bootstrap.init_db()
+
+        assert len(search(client, headers, q="coffee").json()) == 2
+
+    def test_words_after_any_punctuation_are_found(self, client, auth_headers):
+        """Every character that separates words keeps the words after it searchable"""
+        headers = auth_headers()
+        budget = client.post("/budgets/", json={"name": "Punctuation", "limit": 100.0}, headers=headers).json()
+        for description in ("Dinner@Mario", "Tickets[concert]", "Taxi—airport", "fee $parking", "coffee|bagel"):
+            client.post(f"/budgets/{budget['id']}/expenses/", json={"description": description, "amount": 1.0, "category": "Misc"}, headers=headers)
+
+        for q, found in (("mario", "Dinner@Mario"), ("concert", "Tickets[concert]"), ("airport", "Taxi—airport"),
+                         ("parking", "fee $parking"), ("bagel", "coffee|bagel"), ("dinner mario", "Dinner@Mario")):
+            assert descriptions(search(client, headers, q=q)) == [found]
+
+    def test_bootstrap_rebuilds_an_outdated_index(self, client, auth_headers):
+        """An index filled by the earlier replace() triggers is rebuilt with the current ones"""
+        headers = auth_headers()
+        budget = client.post("/budgets/", json={"name": "Outdated", "limit": 100.0}, headers=headers).json()
+        client.post(f"/budgets/{budget['id']}/expenses/", json={"description": "Dinner@Mario", "amount": 1.0, "category": "Misc"}, headers=headers)
+        with database.engine.begin() as conn:
+            conn.execute(text("DROP TRIGGER expense_search_insert"))
+            conn.execute(text("CREATE TRIGGER expense_search_insert AFTER INSERT ON expenses BEGIN SELECT 1; END"))
+            conn.execute(text("DELETE FROM expense_search"))
+
+        bootstrap.init_db()
+
+        assert descriptions(search(client, headers, q="mario")) == ["Dinner@Mario"]
+        client.post(f"/budgets/{budget['id']}/expenses/", json={"description": "Lunch=Luigi", "amount": 1.0, "category": "Misc"}, headers=headers)
+        assert descriptions(search(client, headers, q="luigi")) == ["Lunch=Luigi"]
+
+    def test_query_needs_a_word(self, client, auth_headers):
+        """Queries made only of punctuation are rejected"""
+        assert client.get("/expenses/search", params={"q": "*()"}, headers=auth_headers()).status_code == 422
+
+    def test_letters_the_tokenizer_splits_on_keep_words_apart(self, client, auth_headers):
+        """A letter that Python's tables know but the tokenizer separates on cannot smuggle in another user's word"""
+        bob, mallory = auth_headers(), auth_headers()
+        budget = client.post("/budgets/", json={"name": "Bait", "limit": 100.0}, headers=mallory).json()
+        # U+19B0 is a letter to Python but a separator to SQLite's unicode61 tables
+        description = f"ab\u19b0{owner(bob)}xpayroll"
+        client.post(f"/budgets/{budget['id']}/expenses/", json={"description": description, "amount": 1.0, "category": "Misc"}, headers=mallory)
+
+        assert search(client, bob, q="payroll").json() == []
+        assert descriptions(search(client, mallory, q="ab")) == [description]
+
+    def test_results_belong_to_the_caller(self, client, auth_headers):
+        """An index entry under the caller's prefix still never returns another user's expense"""
+        bob, mallory = auth_headers(), auth_headers()
+        budget = client.post("/budgets/", json={"name": "Planted", "limit": 100.0}, headers=mallory).json()
+        expense = client.post(f"/budgets/{budget['id']}/expenses/", json={"description": "Salary", "amount": 1.0, "category": "Misc"}, headers=mallory).json()
+        with database.engine.begin() as conn:
+            conn.execute(text("UPDATE expense_search SET description = :words WHERE rowid = :id"),
+                         {"words": f"{owner(bob)}xpayroll", "id": expense["id"]})
+
+        assert search(client, bob, q="payroll").json() == []
@@ -0,0 +1,115 @@
+"""
+Response fast path contract tests.
+
+Every endpoint on the fast path must send the bytes the ``response_model``
+path sends for the same data. The reference here is that path: the ORM
+objects validated into the schemas, then encoded by FastAPI.
+"""
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.orm import noload, selectinload
+
+from app import database, models, schemas, serialize
+from app.main import app
+
+# Escapes, non-ASCII, long and exponent floats; dates with and without microseconds
+EXPENSES = [
+    {"description": 'Quote " backslash \\ tab\t newline\n bell\x07', "amount": 0.1, "category": "Misc"},
+    {"description": "Café crème, 寿司 and 😀", "amount": 12345678.9, "category": "Food"},
+    {"description": "Refund", "amount": -5.5, "category": "Food"},
+    {"description": "Rounding", "amount": 1e20, "category": "Fun"},
+    {"description": "Whole", "amount": 3.0, "category": "Health"},
+]
+IMPORTED = '{"description": "Midnight", "amount": 7.25, "category": "Fun", "date": "2024-01-05T00:00:00"}\n'
+
+
+def through_response_model(method, path, content):
+    """The body FastAPI sends for ``content`` returned by the endpoint at ``path`` through its ``response_model``"""
+    route = next(route for route in app.routes if getattr(route, "path", None) == path and method in route.methods)
+    value, errors = route.response_field.validate(content, {}, loc=("response",))
+    assert not errors
+    return JSONResponse(jsonable_encoder(value)).body
+
+
+def stored_budgets(user_id, expenses=True):
+    load = selectinload(models.Budget.expenses) if expenses else noload(models.Budget.expenses)
+    with database.SessionLocal() as db:
+        budgets = db.execute(
+            select(models.Budget).options(load).where(models.Budget.user_id == user_id).order_by(models.Budget.id)
+        ).scalars().all()
+        for budget in budgets:
+            budget.expenses.sort(key=lambda expense: (expense.date, expense.id))
+        return budgets
+
+
+def stored_expense(expense_id):
+    with database.SessionLocal() as db:
+        return db.get(models.Expense, expense_id)
+
+
+def seed(client, headers):
+    budget = client.post("/budgets/", json={"name": "Ünïcode \"budget\"", "limit": 1500.75, "currency": "EUR"}, headers=headers)
+    budget_id = budget.json()["id"]
+    created = [client.post(f"/budgets/{budget_id}/expenses/", json=expense, headers=headers) for expense in EXPENSES]
+    client.post(
+        f"/budgets/{budget_id}/expenses/import",
+        content=IMPORTED.encode(),
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+    return budget, created
+
+
+class TestFastPathContract:
+    """Fast path responses are byte for byte the response_model ones"""
+
+    def test_budget_pages(self, client, auth_headers):
+        """GET /budgets/, with and without expenses, over several pages"""
+        headers = auth_headers()
+        seed(client, headers)
+        seed(client, headers)
+        user_id = client.get("/budgets/", headers=headers).json()[0]["user_id"]
+        budgets = stored_budgets(user_id)
+
+        full = client.get("/budgets/", headers=headers)
+        first = client.get("/budgets/", params={"limit": 1}, headers=headers)
+        bare = client.get("/budgets/", params={"include": "none"}, headers=headers)
+
+        assert full.content == through_response_model("GET", "/budgets/", budgets)
+        assert first.content == through_response_model("GET", "/budgets/", budgets[:1])
+        assert bare.content == through_response_model("GET", "/budgets/", stored_budgets(user_id, expenses=False))
+        assert full.headers["content-type"] == "application/json"
+
+    def test_expense_pages(self, client, auth_headers):
+        """GET /budgets/{id}/expenses/"""
+        headers = auth_headers()
+        budget, _ = seed(client, headers)
+        stored = stored_budgets(budget.json()["user_id"])[0].expenses
+
+        page = client.get(f"/budgets/{budget.json()['id']}/expenses/", params={"limit": 4}, headers=headers)
+
+        assert page.content == through_response_model("GET", "/budgets/{budget_id}/expenses/", stored[:4])
+        assert page.headers["X-Next-Cursor"]
+
+    def test_writes(self, client, auth_headers):
+        """POST and PUT of budgets and expenses"""
+        headers = auth_headers()
+        budget, created = seed(client, headers)
+        budget_id = budget.json()["id"]
+
+        assert budget.content == through_response_model("POST", "/budgets/", stored_budgets(budget.json()["user_id"], expenses=False)[0])
+        for response in created:
+            assert response.content == through_response_model("POST", "/budgets/{budget_id}/expenses/", stored_expense(response.json()["id"]))
+
+        expense_id = created[0].json()["id"]
+        updated = client.put(f"/budgets/{budget_id}/expenses/{expense_id}", json={"description": "Tab\there", "amount": 2.5, "category": "Misc"}, headers=headers)
+        assert updated.content == through_response_model("PUT", "/budgets/{budget_id}/expenses/{expense_id}", stored_expense(expense_id))
+
+        renamed = client.put(f"/budgets/{budget_id}", json={"name": "Renamed ☃", "limit": 99.99, "currency": "GBP"}, headers=headers)
+        assert renamed.content == through_response_model("PUT", "/budgets/{budget_id}", stored_budgets(budget.json()["user_id"])[0])
+
+    def test_field_order_follows_the_schemas(self):
+        """The fast path's fields are the schemas' fields, in the same order"""
+        assert serialize.EXPENSE_FIELDS == tuple(schemas.Expense.__fields__)
+        assert serialize.BUDGET_FIELDS + ("expenses",) == tuple(schemas.Budget.__fields__)
@@ -0,0 +1,176 @@
+"""
+Shard routing, admin fan-out and rebalancing tests.
+"""
+
+import uuid
+
+import pytest
+from jose import jwt
+from sqlalchemy import func, select
+
+from app import bootstrap, config, models, shards, writes
+from app.auth import ALGORITHM, SECRET_KEY
+
+
+def headers_for(user_id):
+    return {"Authorization": f"Bearer {jwt.encode({'sub': user_id}, SECRET_KEY, algorithm=ALGORITHM)}"}
+
+
+def users_for(router, shard, count):
+    """Fresh user ids that the router places on ``shard``"""
+    users = []
+    while len(users) < count:
+        user_id = f"user_{uuid.uuid4().hex[:12]}"
+        if router.for_user(user_id) is shard:
+            users.append(user_id)
+    return users
+
+
+def count(shard, model, **filters):
+    with shard.SessionLocal() as db:
+        return db.execute(select(func.count()).select_from(model).filter_by(**filters)).scalar()
+
+
+@pytest.fixture
+def use_shards(client, monkeypatch, tmp_path):
+    """Factory switching the app to fresh SQLite shards; returns the router"""
+    routers = []
+
+    def make(names):
+        router = shards.ShardRouter({name: f"sqlite:///{tmp_path}/{name}.db" for name in names})
+        for shard in router.shards:
+            bootstrap.init_db(shard.engine)
+        monkeypatch.setattr(shards, "router", router)
+        monkeypatch.setattr(writes, "queues", {})
+        routers.append(router)
+        return router
+
+    yield make
+    for router in routers:
+        client.portal.call(router.dispose)
+
+
+def seed(client, user_id, amounts):
+    headers = headers_for(user_id)
+    budget = client.post("/budgets/", json={"name": f"Budget of {user_id}", "limit": 1000.0}, headers=headers).json()
+    for amount in amounts:
+        client.post(f"/budgets/{budget['id']}/expenses/", json={"description": "Expense", "amount": amount, "category": "Food"}, headers=headers)
+    return budget
+
+
+class TestHashRing:
+    """HashRing"""
+
+    def test_keys_spread_over_nodes(self):
+        """Every node gets a fair share of the keys"""
+        ring = shards.HashRing(["a", "b", "c"])
+        placed = [ring.lookup(f"user_{n}") for n in range(3000)]
+        assert all(placed.count(node) > 600 for node in "abc")
+
+    def test_adding_a_node_moves_keys_only_to_it(self):
+        """Going from three to four nodes moves about a quarter of the keys, all onto the new node"""
+        before, after = shards.HashRing(["a", "b", "c"]), shards.HashRing(["a", "b", "c", "d"])
+        moved = [key for key in (f"user_{n}" for n in range(3000)) if before.lookup(key) != after.lookup(key)]
+        assert all(after.lookup(key) == "d" for key in moved)
+        assert 300 < len(moved) < 1200
+
+
+class TestShardRouting:
+    """SHARDS"""
+
+    def test_changing_only_a_url_keeps_every_user(self, client, tmp_path, monkeypatch):
+        """Users stay on the shard of the same name when its URL is spelled differently or gets a password"""
+        monkeypatch.chdir(tmp_path)
+        before = shards.ShardRouter({"one": "sqlite:///./one.db", "two": "sqlite:///./two.db"})
+        after = shards.ShardRouter(shards.parse_shards(f"one=sqlite:///{tmp_path}/one.db, two=sqlite:///./two.db?timeout=30"))
+
+        users = [f"user_{n}" for n in range(500)]
+
+        assert [after.for_user(user_id).name for user_id in users] == [before.for_user(user_id).name for user_id in users]
+        for router in (before, after):
+            client.portal.call(router.dispose)
+
+    def test_shards_need_names(self):
+        """Bare URLs and repeated names are rejected"""
+        with pytest.raises(ValueError, match="name=url"):
+            shards.parse_shards("sqlite:///./one.db")
+        with pytest.raises(ValueError, match="listed twice"):
+            shards.parse_shards("one=sqlite:///./one.db,one=sqlite:///./two.db")
+
+    def test_data_lands_on_the_users_shard(self, client, use_shards):
+        """Each user's writes and reads go to the shard the router picks for them"""
+        router = use_shards(["one", "two"])
+        first, second = router.shards
+        (alice,), (bob,) = users_for(router, first, 1), users_for(router, second, 1)
+
+        seed(client, alice, [1.0, 2.0])
+        seed(client, bob, [5.0])
+
+        assert count(first, models.Budget, user_id=alice) == 1 and count(first, models.Expense) == 2
+        assert count(second, models.Budget, user_id=bob) == 1 and count(second, models.Expense) == 1
+        assert count(first, models.Budget, user_id=bob) == 0 and count(second, models.Budget, user_id=alice) == 0
+        (summary,) = client.get("/budgets/summary", headers=headers_for(bob)).json()
+        assert summary["spent"] == 5.0 and summary["expense_count"] == 1
+        assert client.get("/changes", params={"since": 0}, headers=headers_for(bob)).json()["changes"]
+
+    def test_admin_overview_aggregates_shards(self, client, use_shards, monkeypatch):
+        """GET /admin/shards reports every shard and the totals across them"""
+        router = use_shards(["one", "two"])
+        first, second = router.shards
+        for user_id in users_for(router, first, 2):
+            seed(client, user_id, [1.0, 2.0])
+        for user_id in users_for(router, second, 1):
+            seed(client, user_id, [10.0])
+        monkeypatch.setattr(config, "ADMIN_USERS", {"ops"})
+
+        response = client.get("/admin/shards", headers=headers_for("ops"))
+
+        assert response.status_code == 200
+        overview = response.json()
+        assert [(s["users"], s["budgets"], s["expenses"], s["spent"]) for s in overview["shards"]] == [(2, 2, 4, 6.0), (1, 1, 1, 10.0)]
+        assert (overview["users"], overview["budgets"], overview["expenses"], overview["spent"]) == (3, 3, 5, 16.0)
+        assert overview["categories"] == {"Food": 16.0}
+
+    def test_admin_overview_requires_an_admin(self, client, auth_headers):
+        """Other users get 403"""
+        assert client.get("/admin/shards", headers=auth_headers()).status_code == 403
+
+
+class TestRebalance:
+    """python -m app.shards rebalance"""
+
+    def test_moved_users_keep_their_data_and_sync(self, client, use_shards):
+        """Users whose shard changes are copied under new ids and their feed reports the move"""
+        old = use_shards(["one"])
+        users = [f"user_{uuid.uuid4().hex[:12]}" for _ in range(12)]
+        budgets = {user_id: seed(client, user_id, [1.0, 2.5]) for user_id in users}
+        seqs = {user_id: client.get("/changes", headers=headers_for(user_id)).json()["seq"] for user_id in users}
+        new_shards = {"one": old.shards[0].url, "two": old.shards[0].url.replace("one.db", "two.db")}
+
+        moved = shards.rebalance(old, new_shards, log=lambda line: None)
+
+        new = use_shards(["one", "two"])
+        movers = [user_id for user_id in users if new.for_user(user_id) is new.shards[1]]
+        assert moved == len(movers) > 0
+        assert count(new.shards[0], models.Budget) == len(users) - moved
+        for user_id in users:
+            headers = headers_for(user_id)
+            (summary,) = client.get("/budgets/summary", headers=headers).json()
+            assert summary["spent"] == 3.5 and summary["expense_count"] == 2
+            (budget,) = client.get("/budgets/", headers=headers).json()
+            assert budget["name"] == budgets[user_id]["name"] and len(budget["expenses"]) == 2
+            feed = client.get("/changes", params={"since": seqs[user_id]}, headers=headers).json()
+            if user_id in movers:
+                assert {(c["entity"], c["op"]) for c in feed["changes"]} >= {("budget", "insert"), ("expense", "insert")}
+                assert {c["id"] for c in feed["changes"] if c["entity"] == "budget" and c["op"] == "insert"} == {budget["id"]}
+            else:
+                assert feed["changes"] == []
+
+    def test_only_sqlite_shards_are_rebalanced(self, use_shards):
+        """Other databases are refused before any shard is touched"""
+        old = use_shards(["one"])
+
+        with pytest.raises(ValueError, match="only supports SQLite"):
+            shards.rebalance(old, {"one": old.shards[0].url, "two": "postgresql://db/two"}, log=lambda line: None)
+
+        assert count(old.shards[0], models.Budget) == 0
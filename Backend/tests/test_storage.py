@@ -0,0 +1,89 @@
+"""
+Storage profile tests against a temporary SQLite database.
+"""
+
+import asyncio
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import database, models
+
+
+@pytest.fixture
+def db_url():
+    path = os.path.join(tempfile.mkdtemp(), "storage.db")
+    url = f"sqlite:///{path}"
+    models.Base.metadata.create_all(bind=create_engine(url))
+    return url
+
+
+class TestStorageProfile:
+    """SQLite PRAGMAs and reader/writer routing"""
+
+    def test_pragmas_are_applied(self, db_url):
+        """Writer and reader connections get the configured profile"""
+        async def scenario():
+            writer = database.make_async_engine(db_url, pool_size=1)
+            reader = database.make_async_engine(db_url, pool_size=2, query_only=True)
+            try:
+                async with writer.connect() as conn:
+                    writer_pragmas = [(await conn.execute(text(f"PRAGMA {name}"))).scalar() for name in ("journal_mode", "synchronous", "busy_timeout", "query_only")]
+                async with reader.connect() as conn:
+                    reader_query_only = (await conn.execute(text("PRAGMA query_only"))).scalar()
+                    with pytest.raises(OperationalError):
+                        await conn.execute(text("DELETE FROM budgets"))
+                return writer_pragmas, reader_query_only
+            finally:
+                await writer.dispose()
+                await reader.dispose()
+
+        writer_pragmas, reader_query_only = asyncio.run(scenario())
+        assert writer_pragmas == ["wal", 1, 5000, 0]
+        assert reader_query_only == 1
+
+    def test_parallel_readers_and_writers(self, db_url):
+        """Many concurrent readers and writers complete without lock errors"""
+        writers, writes_each, readers = 10, 20, 40
+
+        async def scenario():
+            writer = database.make_async_engine(db_url, pool_size=1)
+            reader = database.make_async_engine(db_url, pool_size=8, query_only=True)
+            Writer = async_sessionmaker(writer, expire_on_commit=False)
+            Reader = async_sessionmaker(reader, expire_on_commit=False)
+            done = asyncio.Event()
+            reads = 0
+
+            async def write(n):
+                for i in range(writes_each):
+                    async with Writer() as db:
+                        db.add(models.Budget(name=f"{n}-{i}", limit=1.0, user_id=f"writer{n}"))
+                        await db.commit()
+
+            async def read():
+                nonlocal reads
+                while not done.is_set():
+                    async with Reader() as db:
+                        await db.execute(select(func.count()).select_from(models.Budget))
+                    reads += 1
+                    await asyncio.sleep(0)
+
+            try:
+                reader_tasks = [asyncio.ensure_future(read()) for _ in range(readers)]
+                await asyncio.gather(*(write(n) for n in range(writers)))
+                done.set()
+                await asyncio.gather(*reader_tasks)
+                async with Reader() as db:
+                    total = (await db.execute(select(func.count()).select_from(models.Budget))).scalar()
+                return total, reads
+            finally:
+                await writer.dispose()
+                await reader.dispose()
+
+        total, reads = asyncio.run(scenario())
+        assert total == writers * writes_each
+        assert reads >= readers
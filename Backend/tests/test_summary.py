@@ -0,0 +1,74 @@
+"""
+Budget summary and running total tests.
+"""
+
+from app import database, models, rollups
+
+
+def add_expense(client, headers, budget_id, amount, category):
+    return client.post(
+        f"/budgets/{budget_id}/expenses/",
+        json={"description": "Expense", "amount": amount, "category": category},
+        headers=headers,
+    ).json()
+
+
+class TestBudgetSummary:
+    """GET /budgets/summary"""
+
+    def test_summary_tracks_expense_writes(self, client, auth_headers):
+        """Totals follow creates, updates and deletes"""
+        headers = auth_headers()
+        budget = client.post("/budgets/", json={"name": "Monthly", "limit": 500.0}, headers=headers).json()
+        food = add_expense(client, headers, budget["id"], 40.0, "Food")
+        add_expense(client, headers, budget["id"], 60.0, "Food")
+        transport = add_expense(client, headers, budget["id"], 25.0, "Transport")
+
+        client.put(
+            f"/budgets/{budget['id']}/expenses/{food['id']}",
+            json={"description": "Expense", "amount": 15.0, "category": "Utilities"},
+            headers=headers,
+        )
+        client.delete(f"/budgets/{budget['id']}/expenses/{transport['id']}", headers=headers)
+
+        (summary,) = client.get("/budgets/summary", headers=headers).json()
+        assert summary["spent"] == 75.0
+        assert summary["remaining"] == 425.0
+        assert summary["expense_count"] == 2
+        assert summary["categories"] == {"Food": 60.0, "Utilities": 15.0}
+
+    def test_summary_includes_empty_budgets(self, client, auth_headers):
+        """Budgets without expenses report zero spend"""
+        headers = auth_headers()
+        client.post("/budgets/", json={"name": "Empty", "limit": 100.0}, headers=headers)
+        (summary,) = client.get("/budgets/summary", headers=headers).json()
+        assert summary["spent"] == 0
+        assert summary["remaining"] == 100.0
+        assert summary["categories"] == {}
+
+
+class TestReconcile:
+    """Rollup check and rebuild"""
+
+    def test_rebuild_repairs_drift(self, client, auth_headers):
+        """Tampered totals are reported and fixed by a rebuild"""
+        headers = auth_headers()
+        budget = client.post("/budgets/", json={"name": "Drift", "limit": 100.0}, headers=headers).json()
+        add_expense(client, headers, budget["id"], 30.0, "Food")
+
+        db = database.SessionLocal()
+        try:
+            assert rollups.check(db) == []
+            row = db.get(models.BudgetCategoryTotal, (budget["id"], "Food", "USD"))
+            row.total = 999.0
+            db.commit()
+
+            drift = rollups.check(db)
+            assert [(d[0], d[1]) for d in drift] == [(budget["id"], "Food")]
+
+            rollups.rebuild(db)
+            db.commit()
+            assert rollups.check(db) == []
+            assert db.get(models.BudgetCategoryTotal, (budget["id"], "Food", "USD")).total == 30.0
+        finally:
+            db.close()
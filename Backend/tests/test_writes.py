@@ -0,0 +1,103 @@
+"""
+Group commit write queue tests.
+"""
+
+import asyncio
+
+import httpx
+import pytest
+from sqlalchemy import event
+
+from app import config, writes
+from app.database import async_engine
+
+
+@pytest.fixture
+def group_commit(monkeypatch):
+    """Routes writes through fresh queues; yields the list of commits made meanwhile"""
+    monkeypatch.setattr(config, "WRITE_QUEUE_ENABLED", True)
+    monkeypatch.setattr(config, "WRITE_QUEUE_WINDOW_MS", 50)
+    monkeypatch.setattr(writes, "queues", {})
+    commits = []
+    record_commit = lambda conn: commits.append(1)
+    event.listen(async_engine.sync_engine, "commit", record_commit)
+    try:
+        yield commits
+    finally:
+        event.remove(async_engine.sync_engine, "commit", record_commit)
+
+
+def concurrently(client, requests):
+    """Send ``(method, path, headers, json)`` requests at once from the app's loop"""
+    from app.main import app
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            return await asyncio.gather(*(
+                http.request(method, path, headers=headers, json=body) for method, path, headers, body in requests
+            ))
+
+    return client.portal.call(scenario)
+
+
+def expense(amount):
+    return {"description": "Expense", "amount": amount, "category": "Food"}
+
+
+class TestGroupCommit:
+    """WRITE_QUEUE_ENABLED"""
+
+    def test_concurrent_writes_share_a_commit(self, client, auth_headers, group_commit):
+        """Writes arriving together are committed once and each caller gets its own row"""
+        headers = auth_headers()
+        budget = client.post("/budgets/", json={"name": "Grouped", "limit": 1000.0}, headers=headers).json()
+        group_commit.clear()
+
+        responses = concurrently(client, [
+            ("POST", f"/budgets/{budget['id']}/expenses/", headers, expense(float(i))) for i in range(1, 21)
+        ])
+
+        assert [r.status_code for r in responses] == [200] * 20
+        assert sorted(r.json()["amount"] for r in responses) == [float(i) for i in range(1, 21)]
+        assert len({r.json()["id"] for r in responses}) == 20
+        assert len(group_commit) == 1
+        (summary,) = client.get("/budgets/summary", headers=headers).json()
+        assert summary["spent"] == 210.0 and summary["expense_count"] == 20
+
+    def test_failed_write_is_rolled_back_alone(self, client, auth_headers, group_commit):
+        """A write that fails inside a group returns its own error and leaves the others committed"""
+        headers, other = auth_headers(), auth_headers()
+        budget = client.post("/budgets/", json={"name": "Mine", "limit": 100.0}, headers=headers).json()
+        foreign = client.post("/budgets/", json={"name": "Theirs", "limit": 100.0}, headers=other).json()
+        kept = client.post(f"/budgets/{budget['id']}/expenses/", json=expense(1.0), headers=headers).json()
+        group_commit.clear()
+
+        responses = concurrently(client, [
+            ("POST", f"/budgets/{budget['id']}/expenses/", headers, expense(5.0)),
+            ("POST", f"/budgets/{foreign['id']}/expenses/", headers, expense(7.0)),
+            ("POST", "/batch", headers, {"operations": [
+                {"op": "create", "entity": "expense", "budget_id": budget["id"], "data": expense(9.0)},
+                {"op": "delete", "entity": "expense", "budget_id": budget["id"], "id": 10 ** 9},
+            ]}),
+            ("PUT", f"/budgets/{budget['id']}/expenses/{kept['id']}", headers, expense(2.0)),
+        ])
+
+        assert [r.status_code for r in responses] == [200, 404, 404, 200]
+        assert len(group_commit) == 1
+        (summary,) = client.get("/budgets/summary", headers=headers).json()
+        assert summary["spent"] == 7.0 and summary["expense_count"] == 2
+
+    def test_groups_are_bounded(self, client, auth_headers, group_commit, monkeypatch):
+        """No group holds more than max_batch writes"""
+        monkeypatch.setattr(config, "WRITE_QUEUE_MAX_BATCH", 4)
+        headers = auth_headers()
+        budget = client.post("/budgets/", json={"name": "Bounded", "limit": 100.0}, headers=headers).json()
+        group_commit.clear()
+
+        responses = concurrently(client, [
+            ("POST", f"/budgets/{budget['id']}/expenses/", headers, expense(1.0)) for _ in range(10)
+        ])
+
+        assert [r.status_code for r in responses] == [200] * 10
+        assert len(group_commit) == 3
+        assert writes.stats()["writes"] == 11  # the budget, then 4 + 4 + 2 expenses
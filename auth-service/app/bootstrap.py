@@ -0,0 +1,44 @@
+"""
+One-off setup for the Auth Service.
+
+Run once per deployment, before the workers start:
+
+    python -m app.bootstrap
+
+It creates missing tables and the default ``admin`` user. Both steps are
+idempotent; an existing admin password is never overwritten.
+"""
+
+from . import database, models, security
+
+DEFAULT_USERNAME = "admin"
+DEFAULT_PASSWORD = "admin"
+
+
+def init_db(bind=None):
+    models.Base.metadata.create_all(bind=bind or database.engine)
+
+
+def ensure_default_user():
+    """Create the default user if it does not exist; return True when it was created."""
+    db = database.SessionLocal()
+    try:
+        if db.query(models.User).filter(models.User.username == DEFAULT_USERNAME).first():
+            return False
+        # Only hash when there is something to store
+        db.add(models.User(username=DEFAULT_USERNAME, hashed_password=security.get_password_hash(DEFAULT_PASSWORD)))
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def main():
+    init_db()
+    created = ensure_default_user()
+    print("Created default user" if created else "Default user already exists")
+    print("Auth Service database is ready")
+
+
+if __name__ == "__main__":
+    main()
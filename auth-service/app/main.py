@@ -1,16 +1,37 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from datetime import timedelta
-from jose import jwt, JWTError
 
-from . import models, schemas, security, database
+from . import admission, config, models, schemas, security, database, metrics
 
-models.Base.metadata.create_all(bind=database.engine)
+# The schema and the default user are created by `python -m app.bootstrap`,
+# once per deployment
 
 app = FastAPI(title="Auth Service")
 
+# Route classes for admission control; everything else is a cheap read
+ROUTE_CLASSES = {
+    "POST /token": "credentials",
+    "POST /register": "credentials",
+    "*": "read",
+}
+
+def build_admission():
+    classes = [
+        admission.parse_class("read", config.ADMISSION_READ),
+        admission.parse_class("credentials", config.ADMISSION_CREDENTIALS),
+    ]
+    return admission.Admission(classes, ROUTE_CLASSES)
+
+if config.ADMISSION_ENABLED:
+    app.state.admission = build_admission()
+
+# Inside CORS, so rejected requests still carry its headers
+app.add_middleware(admission.AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -18,46 +39,68 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
-@app.on_event("startup")
-def create_default_user():
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-    db = database.SessionLocal()
-    try:
-        user = db.query(models.User).filter(models.User.username == "admin").first()
-        hashed_password = security.get_password_hash("admin")
-        if not user:
+@app.on_event("shutdown")
+def stop_hasher():
+    security.hasher.shutdown()
 
-            db_user = models.User(username="admin", hashed_password=hashed_password)
-            db.add(db_user)
-        else:
+hashing_busy = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Too many authentication requests, try again shortly",
+    headers={"Retry-After": "1"},
+)
+
+def _find_user(db: Session, username: str):
+    try:
+        return db.query(models.User).filter(models.User.username == username).first()
+    finally:
+        # Don't hold a pooled connection while bcrypt runs
+        db.close()
 
-            user.hashed_password = hashed_password
+def _create_user(db: Session, username: str, hashed_password: str):
+    if db.query(models.User).filter(models.User.username == username).first():
+        return None
+    db_user = models.User(username=username, hashed_password=hashed_password)
+    db.add(db_user)
+    try:
         db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    db.refresh(db_user)
+    return db_user
 
-    except Exception as e:
-        pass
+def _store_password_hash(user_id: int, hashed_password: str):
+    db = database.SessionLocal()
+    try:
+        db.query(models.User).filter(models.User.id == user_id).update({"hashed_password": hashed_password})
+        db.commit()
     finally:
         db.close()
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-
 @app.post("/register", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
-    if db_user:
+async def register(request: Request, user: schemas.UserCreate, db: Session = Depends(database.get_db)):
+    admission.limit_user(request, user.username)
+    # Hash before touching the database so the writer connection is only held
+    # for the insert itself
+    try:
+        hashed_password = await security.hasher.hash(user.password)
+    except security.HashingBusy:
+        raise hashing_busy
+    db_user = await run_in_threadpool(_create_user, db, user.username, hashed_password)
+    if db_user is None:
         raise HTTPException(status_code=400, detail="Username already registered")
-    hashed_password = security.get_password_hash(user.password)
-    db_user = models.User(username=user.username, hashed_password=hashed_password)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
     return db_user
 
 @app.post("/token", response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_read_db)):
+    # Throttles guessing at one account from many addresses
+    admission.limit_user(request, form_data.username)
 
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
+    user = await run_in_threadpool(_find_user, db, form_data.username)
     if not user:
 
         raise HTTPException(
@@ -67,13 +110,20 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
         )
     
 
-    if not security.verify_password(form_data.password, user.hashed_password):
+    try:
+        valid, new_hash = await security.hasher.verify_and_update(form_data.password, user.hashed_password)
+    except security.HashingBusy:
+        raise hashing_busy
+    if not valid:
 
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # Stored with an outdated bcrypt cost: upgrade it now that we know the password
+        await run_in_threadpool(_store_password_hash, user.id, new_hash)
     
 
     access_token_expires = timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -83,21 +133,32 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/users/me", response_model=schemas.User)
-def read_users_me(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+def read_users_me(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_read_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    from jose import jwt, JWTError
+
     try:
         payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = schemas.TokenData(username=username)
-    except security.JWTError:
+    except JWTError:
         raise credentials_exception
     user = db.query(models.User).filter(models.User.username == token_data.username).first()
     if user is None:
         raise credentials_exception
     return user
+
+@app.get("/admission/stats")
+async def get_admission_stats():
+    limits = getattr(app.state, "admission", None)
+    return limits.stats() if limits is not None else {}
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,246 @@
+"""
+Request, database and upstream instrumentation, rendered as Prometheus text.
+
+``MetricsMiddleware`` records latency, status counts and the number of
+requests in flight per route template. ``instrument_engine`` hooks the
+SQLAlchemy cursor events, so each request also records how many queries it
+ran and how long they took. ``time_upstream`` times calls to external
+services. Everything lives in process memory until ``render()`` is called
+for ``/metrics``.
+
+With ``SLOW_REQUEST_SECONDS`` set, requests slower than that are logged
+together with the SQL statements they ran.
+
+The Auth Service keeps an identical copy of this module.
+"""
+
+import contextvars
+import logging
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+# Statements kept per request for the slow-request log
+MAX_LOGGED_STATEMENTS = 50
+
+_lock = threading.Lock()
+_registry = []
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # label values -> value
+        _registry.append(self)
+
+    def inc(self, labels=(), amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, key, value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, value, labels=()):
+        with _lock:
+            self.values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels + ("le",)
+        self.buckets = buckets
+        self.values = {}  # label values -> per-bucket counts, +Inf count, sum
+        _registry.append(self)
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    def samples(self):
+        for key, entry in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), entry):
+                cumulative += count
+                yield f"{self.name}_bucket", key + (bound,), cumulative
+            # _sum and _count carry no le label
+            yield f"{self.name}_sum", key, entry[-1]
+            yield f"{self.name}_count", key, cumulative
+
+
+requests_total = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+request_seconds = Histogram("http_request_duration_seconds", "HTTP request latency.", ("method", "route"))
+requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests being served.")
+request_queries = Histogram(
+    "http_request_db_queries", "SQL statements run per HTTP request.", ("method", "route"), QUERY_COUNT_BUCKETS
+)
+request_db_seconds = Histogram("http_request_db_seconds", "Time spent in SQL per HTTP request.", ("method", "route"))
+query_seconds = Histogram("db_query_duration_seconds", "SQL statement latency.", buckets=QUERY_BUCKETS)
+upstream_seconds = Histogram("upstream_request_duration_seconds", "Calls to external services.", ("upstream", "outcome"))
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "statements")
+
+    def __init__(self, keep_statements=False):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = [] if keep_statements else None
+
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+
+def instrument_engine(engine):
+    """Record every statement run on ``engine``; pass ``sync_engine`` for async engines."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop("query_started", time.perf_counter())
+    query_seconds.observe(elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+        if stats.statements is not None and len(stats.statements) < MAX_LOGGED_STATEMENTS:
+            stats.statements.append((elapsed, statement))
+
+
+@contextmanager
+def time_upstream(upstream):
+    outcome = "error"
+    started = time.perf_counter()
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        upstream_seconds.observe(time.perf_counter() - started, (upstream, outcome))
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streaming responses are timed until their last chunk."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500  # reported when the app fails before sending a response
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats(keep_statements=config.SLOW_REQUEST_SECONDS > 0)
+        token = _current.set(stats)
+        requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_flight.dec()
+            _current.reset(token)
+            # The router stores the matched route in the scope; label by its
+            # template so ids in the path don't create new series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            labels = (scope["method"], route)
+            requests_total.inc(labels + (str(status),))
+            request_seconds.observe(elapsed, labels)
+            request_queries.observe(stats.queries, labels)
+            request_db_seconds.observe(stats.db_seconds, labels)
+            if stats.statements is not None and elapsed >= config.SLOW_REQUEST_SECONDS:
+                _log_slow_request(scope, status, elapsed, stats)
+
+
+def _log_slow_request(scope, status, elapsed, stats):
+    statements = "".join(f"\n  {seconds * 1000:8.2f} ms  {' '.join(sql.split())}" for seconds, sql in stats.statements)
+    if stats.queries > len(stats.statements):
+        statements += f"\n  ... {stats.queries - len(stats.statements)} more"
+    logger.warning(
+        "Slow request %s %s -> %s in %.1f ms, %d queries in %.1f ms%s",
+        scope["method"], scope["path"], status, elapsed * 1000, stats.queries, stats.db_seconds * 1000, statements,
+    )
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        if not isinstance(value, str):
+            value = _format_value(value)
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def render():
+    """Return all metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for metric in _registry:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_format_labels(metric.labels[:len(key)], key)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Clear counters and histograms; gauges track live state and are kept."""
+    with _lock:
+        for metric in _registry:
+            if metric.kind != "gauge":
+                metric.values.clear()
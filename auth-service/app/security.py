@@ -1,22 +1,81 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Union
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 
-# SECRET_KEY should be in env vars for production
-SECRET_KEY = "supersecretkey"
+from . import config
+
+SECRET_KEY = config.SECRET_KEY
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    # Built on first use: importing passlib and bcrypt is a large part of startup
+    from passlib.context import CryptContext
+
+    # Pinning min and max rounds to the configured cost makes passlib flag any
+    # hash with another cost as needing an update
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=config.BCRYPT_ROUNDS,
+        bcrypt__min_rounds=config.BCRYPT_ROUNDS,
+        bcrypt__max_rounds=config.BCRYPT_ROUNDS,
+    )
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated, bounded pool of threads.
+
+    bcrypt releases the GIL, so a sized thread pool spreads hashing over the
+    cores while the event loop and the request threadpool stay free for cheap
+    endpoints. At most ``workers + queue_size`` jobs are accepted at a time;
+    beyond that callers get ``HashingBusy`` immediately instead of queueing.
+    """
+
+    def __init__(self, workers=config.HASH_WORKERS, queue_size=config.HASH_QUEUE_SIZE):
+        self.capacity = workers + queue_size
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.capacity:
+            raise HashingBusy()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password):
+        return await self._run(get_password_hash, password)
+
+    async def verify_and_update(self, plain_password, hashed_password):
+        """Return ``(valid, new_hash)``; ``new_hash`` is set when the stored cost is outdated."""
+        return await self._run(get_pwd_context().verify_and_update, plain_password, hashed_password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+hasher = PasswordHasher()
+
 
 def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None):
+    from jose import jwt
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
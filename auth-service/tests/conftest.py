@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/auth.db")
+# The lowest cost bcrypt accepts keeps the tests fast
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app import bootstrap
+    from app.main import app
+
+    bootstrap.init_db()
+
+    with TestClient(app) as test_client:
+        yield test_client
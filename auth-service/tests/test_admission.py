@@ -0,0 +1,107 @@
+"""
+Admission control tests for the credential endpoints.
+"""
+
+import asyncio
+import uuid
+
+import httpx
+import pytest
+
+from app import admission, database, models, security
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Installs route classes built from the given settings; returns the ``Admission``"""
+    from app.main import ROUTE_CLASSES, app
+
+    def install(**specs):
+        classes = [admission.parse_class(name, specs.get(name, "")) for name in ("read", "credentials")]
+        installed = admission.Admission(classes, ROUTE_CLASSES)
+        monkeypatch.setattr(app.state, "admission", installed, raising=False)
+        return installed
+
+    return install
+
+
+def create_user(password="secret123"):
+    username = f"user_{uuid.uuid4().hex[:12]}"
+    db = database.SessionLocal()
+    try:
+        db.add(models.User(username=username, hashed_password=security.get_password_hash(password)))
+        db.commit()
+    finally:
+        db.close()
+    return username
+
+
+def login(client, username, password="secret123"):
+    return client.post("/token", data={"username": username, "password": password})
+
+
+class TestTokenAdmission:
+    """POST /token under admission limits"""
+
+    def test_per_ip_rate_limit(self, client, limits):
+        """An address over its rate gets 429 with the seconds until its next token"""
+        limits(credentials="ip_rate=0.1,ip_burst=2")
+        username = create_user()
+
+        responses = [login(client, username) for _ in range(3)]
+
+        assert [response.status_code for response in responses] == [200, 200, 429]
+        assert responses[-1].headers["Retry-After"] == "10"
+        assert client.get("/admission/stats").json()["credentials"]["throttled_ip"] == 1
+
+    def test_per_user_rate_limit(self, client, limits):
+        """Guesses at one account are throttled; other accounts from the same address are not"""
+        limits(credentials="user_rate=0.1,user_burst=2")
+        target, other = create_user(), create_user()
+
+        assert [login(client, target, "guess").status_code for _ in range(3)] == [401, 401, 429]
+        assert login(client, other).status_code == 200
+
+    def test_full_queue_is_shed(self, client, limits, monkeypatch):
+        """Logins beyond the running and queued ones get 503 at once"""
+        from app.main import app
+
+        limits(credentials="concurrency=1,queue=1,queue_timeout=5")
+        username = create_user()
+
+        async def slow_verify(plain_password, hashed_password):
+            await asyncio.sleep(0.2)
+            return True, None
+
+        monkeypatch.setattr(security.hasher, "verify_and_update", slow_verify)
+
+        async def scenario():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+                return await asyncio.gather(*(
+                    http.post("/token", data={"username": username, "password": "secret123"}) for _ in range(4)
+                ))
+
+        responses = client.portal.call(scenario)
+
+        assert sorted(response.status_code for response in responses) == [200, 200, 503, 503]
+        assert all(response.headers["Retry-After"] == "5" for response in responses if response.status_code == 503)
+        stats = client.get("/admission/stats").json()["credentials"]
+        assert stats["admitted"] == 2 and stats["shed"] == 2 and stats["active"] == 0
+
+    def test_busy_hasher_answers_503(self, client, monkeypatch):
+        """With admission off, a full hashing pool still turns logins away with 503"""
+        from app.main import app
+
+        monkeypatch.setattr(app.state, "admission", None, raising=False)
+        username = create_user()
+        busy = security.PasswordHasher(workers=1, queue_size=0)
+        busy.pending = busy.capacity
+        monkeypatch.setattr(security, "hasher", busy)
+
+        try:
+            response = login(client, username)
+        finally:
+            busy.shutdown()
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,49 @@
+"""
+Auth Service bootstrap tests.
+"""
+
+from sqlalchemy import inspect
+
+from app import bootstrap, database, models
+
+
+def users():
+    db = database.SessionLocal()
+    try:
+        return [(user.id, user.username, user.hashed_password) for user in db.query(models.User).order_by(models.User.id)]
+    finally:
+        db.close()
+
+
+class TestBootstrap:
+    """python -m app.bootstrap"""
+
+    def test_running_twice_changes_nothing(self, capsys):
+        """A second run finds the tables and the admin in place and leaves them as they are"""
+        bootstrap.init_db()
+        db = database.SessionLocal()
+        db.query(models.User).filter(models.User.username == bootstrap.DEFAULT_USERNAME).delete()
+        db.commit()
+        db.close()
+
+        bootstrap.main()
+        tables, first = inspect(database.engine).get_table_names(), users()
+        bootstrap.main()
+
+        assert inspect(database.engine).get_table_names() == tables
+        assert users() == first
+        assert [username for _, username, _ in first].count(bootstrap.DEFAULT_USERNAME) == 1
+        output = capsys.readouterr().out
+        assert "Created default user" in output and "Default user already exists" in output
+
+    def test_admin_password_is_kept(self):
+        """An admin whose password was changed keeps it"""
+        bootstrap.init_db()
+        bootstrap.ensure_default_user()
+        db = database.SessionLocal()
+        db.query(models.User).filter(models.User.username == bootstrap.DEFAULT_USERNAME).update({"hashed_password": "changed"})
+        db.commit()
+        db.close()
+
+        assert bootstrap.ensure_default_user() is False
+        assert (bootstrap.DEFAULT_USERNAME, "changed") in [(username, hashed) for _, username, hashed in users()]
@@ -0,0 +1,44 @@
+"""
+Request and SQL instrumentation tests.
+"""
+
+import re
+
+from app import metrics
+
+
+def sample(text, name, **labels):
+    """Value of the first sample of ``name`` carrying all of ``labels``"""
+    for line in text.splitlines():
+        match = re.match(r"([a-z_]+)(\{.*\})? (\S+)$", line)
+        if not match or match.group(1) != name:
+            continue
+        found = dict(re.findall(r'(\w+)="([^"]*)"', match.group(2) or ""))
+        if all(found.get(key) == value for key, value in labels.items()):
+            return float(match.group(3))
+    return None
+
+
+class TestMetrics:
+    """GET /metrics"""
+
+    def test_logins_are_counted_with_their_queries(self, client, monkeypatch):
+        """/token requests show up by status, with the SQL they ran"""
+        from app.main import app
+
+        monkeypatch.setattr(app.state, "admission", None, raising=False)
+        metrics.reset()
+        client.post("/register", json={"username": "metrics_user", "password": "secret123"})
+        client.post("/token", data={"username": "metrics_user", "password": "secret123"})
+        client.post("/token", data={"username": "metrics_user", "password": "wrong"})
+
+        response = client.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        text = response.text
+        assert sample(text, "http_requests_total", method="POST", route="/token", status="200") == 1
+        assert sample(text, "http_requests_total", method="POST", route="/token", status="401") == 1
+        assert sample(text, "http_request_db_queries_count", method="POST", route="/token") == 2
+        assert sample(text, "http_request_db_queries_bucket", method="POST", route="/token", le="0") == 0
+        assert sample(text, "db_query_duration_seconds_count") >= 3
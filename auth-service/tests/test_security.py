@@ -0,0 +1,61 @@
+"""
+Password hashing tests.
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from app import security
+
+
+class TestPasswordHasher:
+    """Bounded bcrypt pool"""
+
+    def test_jobs_beyond_capacity_are_turned_away(self, monkeypatch):
+        """With every worker busy and the queue full, a new job fails at once instead of waiting"""
+        release = threading.Event()
+
+        def slow_hash(password):
+            release.wait(5)
+            return f"hashed {password}"
+
+        monkeypatch.setattr(security, "get_password_hash", slow_hash)
+        hasher = security.PasswordHasher(workers=1, queue_size=1)
+
+        async def scenario():
+            running = [asyncio.ensure_future(hasher.hash(f"password {n}")) for n in range(2)]
+            await asyncio.sleep(0.05)
+            with pytest.raises(security.HashingBusy):
+                await hasher.hash("one too many")
+            release.set()
+            results = await asyncio.gather(*running)
+            # Finished jobs free their places
+            return results, await hasher.hash("after"), hasher.pending
+
+        try:
+            results, after, pending = asyncio.run(scenario())
+        finally:
+            release.set()
+            hasher.shutdown()
+
+        assert results == ["hashed password 0", "hashed password 1"]
+        assert after == "hashed after" and pending == 0
+
+    def test_verify_and_update_flags_an_outdated_cost(self):
+        """A hash made with another bcrypt cost verifies and comes back rehashed"""
+        from passlib.hash import bcrypt
+
+        hasher = security.PasswordHasher(workers=1, queue_size=0)
+        stored = bcrypt.using(rounds=5).hash("secret")
+        try:
+            wrong = asyncio.run(hasher.verify_and_update("wrong", stored))
+            valid, new_hash = asyncio.run(hasher.verify_and_update("secret", stored))
+            again = asyncio.run(hasher.verify_and_update("secret", new_hash))
+        finally:
+            hasher.shutdown()
+
+        assert wrong == (False, None)
+        assert valid and security.verify_password("secret", new_hash)
+        assert again == (True, None)
@@ -0,0 +1,121 @@
+"""
+Spend analytics benchmark.
+
+Fills a temporary database with synthetic expenses, backfills the spend
+buckets with ``app.rollups``, and compares the daily, weekly and monthly
+series of one user served from the buckets with the same series computed
+by a GROUP BY over the expenses table.
+
+    python benchmarks/analytics_rollups.py --expenses 5000000
+
+Expenses are spread evenly over --users users with --budgets budgets each,
+five categories and --days days ending on 2024-12-31.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAST_DAY = date(2024, 12, 31)
+RANGES = {"day": 90, "week": 365, "month": 365}
+
+
+def fill(engine, users, budgets, expenses, days):
+    from sqlalchemy import text
+
+    first = LAST_DAY - timedelta(days=days - 1)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < :count - 1) "
+            "INSERT INTO budgets (id, name, \"limit\", currency, user_id) "
+            "SELECT i + 1, 'Budget ' || i, 1000.0, 'USD', 'user_' || (i % :users) FROM n"
+        ), {"count": users * budgets, "users": users})
+        conn.execute(text(
+            "WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < :count - 1) "
+            "INSERT INTO expenses (description, amount, currency, category, date, budget_id) "
+            "SELECT 'Expense', (abs(random()) % 10000) / 100.0, 'USD', "
+            "CASE abs(random()) % 5 WHEN 0 THEN 'Food' WHEN 1 THEN 'Transport' WHEN 2 THEN 'Housing' WHEN 3 THEN 'Fun' ELSE 'Health' END, "
+            "datetime(:first, '+' || (abs(random()) % (:days * 86400)) || ' seconds'), "
+            "i % :budgets + 1 FROM n"
+        ), {"count": expenses, "first": first.isoformat(), "days": days, "budgets": users * budgets})
+
+
+def raw_query(user_id, grain, start, end):
+    """The series as a scan: group the user's expenses in the range by bucket."""
+    from sqlalchemy import func, select
+    from app import models, rollups
+
+    e, b = models.Expense, models.Budget
+    bucket = rollups._bucket_start(grain)
+    return (
+        select(e.budget_id, bucket, func.sum(e.amount), func.count())
+        .join(b, b.id == e.budget_id)
+        .where(b.user_id == user_id, e.date >= start, e.date < end)
+        .group_by(e.budget_id, bucket)
+    )
+
+
+async def measure(user_id, runs):
+    from app import analytics, database, schemas
+
+    results = {}
+    async with database.AsyncReadSessionLocal() as db:
+        for grain, days in RANGES.items():
+            end = LAST_DAY + timedelta(days=1)
+            start = end - timedelta(days=days)
+            raw, rollup = [], []
+            for _ in range(runs):
+                started = time.perf_counter()
+                (await db.execute(raw_query(user_id, grain, start, end))).all()
+                raw.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                await analytics.spend_series(db, user_id, schemas.Granularity(grain), start, end)
+                rollup.append(time.perf_counter() - started)
+            results[grain] = (statistics.median(raw), statistics.median(rollup))
+    await database.async_read_engine.dispose()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare spend series from rollups with GROUP BY scans.")
+    parser.add_argument("--expenses", type=int, default=5_000_000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--budgets", type=int, default=5, help="budgets per user")
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/analytics.db"
+    sys.path.insert(0, os.path.join(ROOT, "Backend"))
+    from app import bootstrap, database, rollups
+
+    bootstrap.init_db()
+    started = time.perf_counter()
+    fill(database.engine, args.users, args.budgets, args.expenses, args.days)
+    print(f"Inserted {args.expenses} expenses in {time.perf_counter() - started:.1f} s")
+
+    db = database.SessionLocal()
+    try:
+        started = time.perf_counter()
+        rollups.rebuild(db)
+        db.commit()
+        print(f"Backfilled spend buckets in {time.perf_counter() - started:.1f} s")
+    finally:
+        db.close()
+
+    per_user = args.expenses // args.users
+    print(f"\nOne user's series ({args.budgets} budgets, ~{per_user} expenses), median of {args.runs} runs:")
+    print(f"{'granularity':<12}{'range':>8}{'GROUP BY scan':>16}{'rollups':>12}{'speedup':>10}")
+    for grain, (raw, rollup) in asyncio.run(measure("user_0", args.runs)).items():
+        print(f"{grain:<12}{RANGES[grain]:>7}d{raw * 1000:>13.1f} ms{rollup * 1000:>9.1f} ms{raw / rollup:>9.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
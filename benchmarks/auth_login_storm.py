@@ -0,0 +1,147 @@
+"""
+Auth Service login storm benchmark.
+
+Starts the Auth Service under uvicorn against a temporary database, then runs
+a burst of concurrent logins while probing /users/me at a steady rate.
+Reports login throughput and the latency of the cheap endpoint under load.
+
+    python benchmarks/auth_login_storm.py --concurrency 50 --duration 20
+
+Logins are over the credentials class's admission limits on purpose: the
+statuses show how many were shed (503) or throttled (429) while /users/me
+stayed responsive. Pass --admission to run with other ADMISSION_CREDENTIALS
+settings; --admission "" turns its limits off.
+
+Use --auth-dir to benchmark another checkout of the service, e.g. a
+``git worktree`` of an older commit, to get before/after numbers.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "benchpass123"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+async def wait_until_up(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(f"{base_url}/docs")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("Auth Service did not start")
+
+
+async def post_patiently(client, path, **kwargs):
+    """POST, waiting out 429 and 503 responses as Retry-After says"""
+    while True:
+        response = await client.post(path, **kwargs)
+        if response.status_code not in (429, 503):
+            return response
+        await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+
+
+async def storm(base_url, users, concurrency, duration, probe_interval):
+    login_latencies, probe_latencies = [], []
+    statuses = {}
+    stop = time.monotonic() + duration
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        token = (await post_patiently(client, "/token", data={"username": users[0], "password": PASSWORD})).json()["access_token"]
+        probe_headers = {"Authorization": f"Bearer {token}"}
+
+        async def login(n):
+            i = n
+            while time.monotonic() < stop:
+                started = time.perf_counter()
+                response = await client.post("/token", data={"username": users[i % len(users)], "password": PASSWORD})
+                login_latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                i += concurrency
+
+        async def probe():
+            while time.monotonic() < stop:
+                started = time.perf_counter()
+                await client.get("/users/me", headers=probe_headers)
+                probe_latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(probe_interval)
+
+        started = time.perf_counter()
+        await asyncio.gather(probe(), *(login(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "logins_per_sec": round(statuses.get(200, 0) / elapsed, 1),
+        "login_statuses": statuses,
+        "login_p50_ms": round(percentile(login_latencies, 50) * 1000, 1),
+        "login_p99_ms": round(percentile(login_latencies, 99) * 1000, 1),
+        "users_me_requests": len(probe_latencies),
+        "users_me_p50_ms": round(percentile(probe_latencies, 50) * 1000, 1),
+        "users_me_p99_ms": round(percentile(probe_latencies, 99) * 1000, 1),
+    }
+
+
+async def run(args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{workdir}/auth.db")
+    if args.admission is not None:
+        env["ADMISSION_CREDENTIALS"] = args.admission
+    if os.path.exists(os.path.join(args.auth_dir, "app", "bootstrap.py")):
+        subprocess.run([sys.executable, "-m", "app.bootstrap"], cwd=args.auth_dir, env=env, check=True, capture_output=True)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=args.auth_dir,
+        env=env,
+    )
+    try:
+        await wait_until_up(base_url)
+        users = [f"storm_{n}" for n in range(args.users)]
+        async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+            for username in users:
+                await post_patiently(client, "/register", json={"username": username, "password": PASSWORD})
+        results = await storm(base_url, users, args.concurrency, args.duration, args.probe_interval)
+    finally:
+        server.terminate()
+        server.wait()
+    print(json.dumps(results, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--auth-dir", default=os.path.join(ROOT, "auth-service"))
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--admission", help="ADMISSION_CREDENTIALS for the service; the service's default if not given")
+    parser.add_argument("--probe-interval", type=float, default=0.05, help="seconds between /users/me probes")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Budget Service concurrency benchmark.
+
+Starts the service under uvicorn against a seeded temporary database and a
+local exchange-rate stub with artificial latency, then drives it with many
+concurrent keep-alive connections and reports requests/sec and latency
+percentiles per endpoint.
+
+    python benchmarks/budget_concurrency.py --concurrency 1000 --requests 20000
+
+Use --backend-dir to benchmark another checkout of the service, e.g. a
+``git worktree`` of an older commit, to get before/after numbers.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from jose import jwt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_KEY = "supersecretkey"
+
+
+class SlowRates(BaseHTTPRequestHandler):
+    delay = 0.05
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = json.dumps({"rates": {"EUR": 0.9, "GBP": 0.8}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+async def wait_until_up(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(f"{base_url}/docs")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("Budget Service did not start")
+
+
+async def seed(client, headers, budgets, expenses):
+    for b in range(budgets):
+        budget = (await client.post("/budgets/", json={"name": f"Budget {b}", "limit": 1000.0}, headers=headers)).json()
+        for e in range(expenses):
+            await client.post(
+                f"/budgets/{budget['id']}/expenses/",
+                json={"description": f"Expense {e}", "amount": 1.0, "category": "Food"},
+                headers=headers,
+            )
+
+
+async def drive(base_url, paths, concurrency, total, headers):
+    latencies = {path: [] for path in paths}
+    errors = 0
+    issued = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal issued, errors
+            while issued < total:
+                path = paths[issued % len(paths)]
+                issued += 1
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path, headers=headers)
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies[path].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+async def run(args):
+    rates = ThreadingHTTPServer(("127.0.0.1", 0), SlowRates)
+    rates.daemon_threads = True
+    SlowRates.delay = args.upstream_delay
+    threading.Thread(target=rates.serve_forever, daemon=True).start()
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    workdir = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{workdir}/budget.db",
+        RATES_API_URL=f"http://127.0.0.1:{rates.server_port}/latest/{{base}}",
+        RATES_TTL_SECONDS=str(args.rates_ttl),
+        RATES_STALE_SECONDS="0",
+    )
+    if os.path.exists(os.path.join(args.backend_dir, "app", "bootstrap.py")):
+        subprocess.run([sys.executable, "-m", "app.bootstrap"], cwd=args.backend_dir, env=env, check=True, capture_output=True)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning", "--backlog", "4096"],
+        cwd=args.backend_dir,
+        env=env,
+    )
+    try:
+        await wait_until_up(base_url)
+        token = jwt.encode({"sub": "bench"}, SECRET_KEY, algorithm="HS256")
+        headers = {"Authorization": f"Bearer {token}"}
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            await seed(client, headers, args.budgets, args.expenses)
+
+        latencies, errors, elapsed = await drive(base_url, args.paths, args.concurrency, args.requests, headers)
+    finally:
+        server.terminate()
+        server.wait()
+        rates.shutdown()
+
+    results = {
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "errors": errors,
+        "requests_per_sec": round(args.requests / elapsed, 1),
+        "endpoints": {
+            path: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+            }
+            for path, values in latencies.items()
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend-dir", default=os.path.join(ROOT, "Backend"))
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--budgets", type=int, default=10)
+    parser.add_argument("--expenses", type=int, default=10, help="expenses per budget")
+    parser.add_argument("--upstream-delay", type=float, default=0.05, help="seconds the rates stub takes to answer")
+    parser.add_argument("--rates-ttl", type=float, default=0.0, help="0 sends every rates request upstream")
+    parser.add_argument("--paths", nargs="+", default=["/budgets/", "/rates/USD"])
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Budget response serialization microbenchmark.
+
+Fills a temporary database with one user's budgets and expenses, then times
+building the ``GET /budgets/`` body both ways, without HTTP in between:
+
+- response_model: ORM objects with their expenses loaded by selectinload,
+  validated into ``schemas.Budget`` and encoded by FastAPI, as before the
+  fast path;
+- fast path: the row tuples ``app.serialize`` selects, encoded by orjson.
+
+Each is timed as a whole (query and encoding) and for the encoding alone.
+
+    python benchmarks/budget_serialization.py --expenses 5000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USER_ID = "bench_user"
+
+
+def fill(engine, budgets, expenses):
+    from sqlalchemy import text
+
+    with engine.begin() as conn:
+        conn.execute(text(
+            "WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < :count - 1) "
+            "INSERT INTO budgets (id, name, \"limit\", currency, user_id) "
+            "SELECT i + 1, 'Budget ' || i, 1000.0, 'USD', :user_id FROM n"
+        ), {"count": budgets, "user_id": USER_ID})
+        conn.execute(text(
+            "WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < :count - 1) "
+            "INSERT INTO expenses (description, amount, currency, category, date, budget_id) "
+            "SELECT 'Expense number ' || i, (abs(random()) % 10000) / 100.0, 'USD', 'Food', "
+            "datetime('2023-01-01', '+' || (abs(random()) % (730 * 86400)) || ' seconds'), i % :budgets + 1 FROM n"
+        ), {"count": expenses, "budgets": budgets})
+
+
+def timed(runs, fn):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times), result
+
+
+async def measure(runs):
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from sqlalchemy import select
+    from sqlalchemy.orm import selectinload
+
+    from app import database, models, serialize
+    from app.main import app
+
+    field = next(route for route in app.routes if getattr(route, "path", None) == "/budgets/" and "GET" in route.methods).response_field
+
+    def encode_models(budgets):
+        value, _ = field.validate(budgets, {}, loc=("response",))
+        return JSONResponse(jsonable_encoder(value)).body
+
+    async def load_models(db):
+        query = select(models.Budget).where(models.Budget.user_id == USER_ID).order_by(models.Budget.id)
+        return (await db.execute(query.options(selectinload(models.Budget.expenses)))).scalars().all()
+
+    async def load_rows(db):
+        rows = (await db.execute(
+            select(*serialize.BUDGET_COLUMNS).where(models.Budget.user_id == USER_ID).order_by(models.Budget.id)
+        )).all()
+        expenses = await serialize.expenses_by_budget(db, [row.id for row in rows])
+        return [serialize.budget(row, expenses[row.id]) for row in rows]
+
+    results = {}
+    async with database.AsyncReadSessionLocal() as db:
+        for name, load, encode in (("response_model", load_models, encode_models), ("fast path", load_rows, serialize.dumps)):
+            totals = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                content = await load(db)
+                body = encode(content)
+                totals.append(time.perf_counter() - started)
+                db.expunge_all()
+            encoding, body = timed(runs, lambda: encode(content))
+            results[name] = (statistics.median(totals), encoding, body)
+    await database.async_read_engine.dispose()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time GET /budgets/ serialization through response_model and the fast path.")
+    parser.add_argument("--budgets", type=int, default=10)
+    parser.add_argument("--expenses", type=int, default=5000, help="expenses of the user, spread over the budgets")
+    parser.add_argument("--runs", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/serialization.db"
+    sys.path.insert(0, os.path.join(ROOT, "Backend"))
+    from app import bootstrap, database
+
+    bootstrap.init_db()
+    fill(database.engine, args.budgets, args.expenses)
+
+    print(f"One page of {args.budgets} budgets with {args.expenses} expenses, median of {args.runs} runs:")
+    print(f"{'':<16}{'query + encode':>16}{'encode only':>14}{'body':>12}")
+    results = asyncio.run(measure(args.runs))
+    for name, (total, encoding, body) in results.items():
+        print(f"{name:<16}{total * 1000:>13.1f} ms{encoding * 1000:>11.1f} ms{len(body) / 1024:>9.0f} KiB")
+    (old_total, old_encoding, old_body), (new_total, new_encoding, new_body) = results.values()
+    print(f"{'speedup':<16}{old_total / new_total:>15.1f}x{old_encoding / new_encoding:>13.1f}x")
+    print(f"Bodies identical: {'yes' if old_body == new_body else 'NO'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
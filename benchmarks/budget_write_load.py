@@ -0,0 +1,145 @@
+"""
+Budget Service sustained write benchmark, with and without group commit.
+
+Starts the service under uvicorn twice against fresh temporary databases,
+once with each writes mode, and keeps --concurrency clients creating
+expenses for --duration seconds. Reports writes/sec, commits and latency
+percentiles for both runs.
+
+    python benchmarks/budget_write_load.py --concurrency 200 --duration 20
+
+--synchronous FULL makes every commit fsync the WAL, which is where sharing
+commits pays off most; the service default is NORMAL.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from jose import jwt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_KEY = "supersecretkey"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+async def wait_until_up(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(f"{base_url}/docs")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("Budget Service did not start")
+
+
+async def drive(base_url, concurrency, duration, users):
+    headers = [{"Authorization": f"Bearer {jwt.encode({'sub': f'writer_{u}'}, SECRET_KEY, algorithm='HS256')}"} for u in range(users)]
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        budgets = []
+        for user_headers in headers:
+            budget = (await client.post("/budgets/", json={"name": "Load", "limit": 1e9}, headers=user_headers)).json()
+            budgets.append((budget["id"], user_headers))
+
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(n):
+        nonlocal errors
+        budget_id, user_headers = budgets[n % len(budgets)]
+        body = {"description": "Load", "amount": 1.0, "category": "Food"}
+        # One single-connection client per worker: a shared pool rescans all of
+        # its connections on every response and becomes the bottleneck
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(f"/budgets/{budget_id}/expenses/", json=body, headers=user_headers)
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        stats = (await client.get("/writes/stats")).json()
+    return latencies, errors, elapsed, stats
+
+
+async def run_mode(args, group_commit):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    workdir = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{workdir}/budget.db",
+        SQLITE_SYNCHRONOUS=args.synchronous,
+        WRITE_QUEUE_ENABLED="true" if group_commit else "false",
+        WRITE_QUEUE_WINDOW_MS=str(args.window_ms),
+        WRITE_QUEUE_MAX_BATCH=str(args.max_batch),
+    )
+    subprocess.run([sys.executable, "-m", "app.bootstrap"], cwd=args.backend_dir, env=env, check=True, capture_output=True)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning", "--backlog", "4096"],
+        cwd=args.backend_dir,
+        env=env,
+    )
+    try:
+        await wait_until_up(base_url)
+        latencies, errors, elapsed, stats = await drive(base_url, args.concurrency, args.duration, args.users)
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        "group_commit": group_commit,
+        "writes": len(latencies),
+        "errors": errors,
+        "writes_per_sec": round(len(latencies) / elapsed, 1),
+        "commits": stats["commits"] if group_commit else len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend-dir", default=os.path.join(ROOT, "Backend"))
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per run")
+    parser.add_argument("--users", type=int, default=50, help="writers are spread over this many users, one budget each")
+    parser.add_argument("--synchronous", default="NORMAL", choices=["OFF", "NORMAL", "FULL"])
+    parser.add_argument("--window-ms", type=float, default=2.0)
+    parser.add_argument("--max-batch", type=int, default=100)
+    args = parser.parse_args()
+
+    results = [asyncio.run(run_mode(args, group_commit)) for group_commit in (False, True)]
+    print(json.dumps({"concurrency": args.concurrency, "synchronous": args.synchronous, "runs": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
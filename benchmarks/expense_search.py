@@ -0,0 +1,109 @@
+"""
+Expense search benchmark.
+
+Fills a temporary database with synthetic expenses, which the search index
+triggers index as they are inserted, then compares ``GET /expenses/search``'s
+query with a ``LIKE '%term%'`` scan of the same user's expenses.
+
+    python benchmarks/expense_search.py --expenses 1000000
+
+Expenses are spread evenly over --users users with --budgets budgets each.
+Descriptions are three words drawn from a 500-word vocabulary, so one whole
+word matches about 0.6% of a user's expenses.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = [f"{stem}{n}" for n in range(100) for stem in ("coffee", "ticket", "rent", "grocery", "taxi")]
+# A whole word, a prefix of 11 words, two words, a prefix and a word, and a
+# prefix of a fifth of the vocabulary, which matches half of the expenses
+QUERIES = ["coffee42", "coffee7", "grocery99 coffee1", "rent42 taxi", "tick"]
+
+
+def fill(engine, users, budgets, expenses):
+    from sqlalchemy import text
+
+    with engine.begin() as conn:
+        conn.execute(text(
+            "WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < :count - 1) "
+            "INSERT INTO budgets (id, name, \"limit\", currency, user_id) "
+            "SELECT i + 1, 'Budget ' || i, 1000.0, 'USD', 'user_' || (i % :users) FROM n"
+        ), {"count": users * budgets, "users": users})
+        word = f"json_extract(:words, '$[' || (abs(random()) % {len(WORDS)}) || ']')"
+        conn.execute(text(
+            "WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < :count - 1) "
+            "INSERT INTO expenses (description, amount, currency, category, date, budget_id) "
+            f"SELECT {word} || ' ' || {word} || ' ' || {word}, (abs(random()) % 10000) / 100.0, 'USD', "
+            "CASE abs(random()) % 5 WHEN 0 THEN 'Food' WHEN 1 THEN 'Transport' WHEN 2 THEN 'Housing' WHEN 3 THEN 'Fun' ELSE 'Health' END, "
+            "datetime('2023-01-01', '+' || (abs(random()) % (730 * 86400)) || ' seconds'), "
+            "i % :budgets + 1 FROM n"
+        ), {"count": expenses, "words": json.dumps(WORDS), "budgets": users * budgets})
+
+
+def like_query(user_id, q, limit):
+    """The same search as a scan: every word anywhere in the description or category."""
+    from sqlalchemy import or_, select
+    from app import models
+
+    e, b = models.Expense, models.Budget
+    query = select(e.id, e.description, e.amount, e.category, e.date, e.budget_id).join(b, b.id == e.budget_id).where(b.user_id == user_id)
+    for word in q.split():
+        query = query.where(or_(e.description.like(f"%{word}%"), e.category.like(f"%{word}%")))
+    return query.order_by(e.date.desc(), e.id).limit(limit)
+
+
+async def measure(user_id, runs, limit):
+    from app import database, search
+
+    results = {}
+    async with database.AsyncReadSessionLocal() as db:
+        for q in QUERIES:
+            like, fts = [], []
+            for _ in range(runs):
+                started = time.perf_counter()
+                (await db.execute(like_query(user_id, q, limit))).all()
+                like.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                await search.search(db, user_id, q, limit=limit)
+                fts.append(time.perf_counter() - started)
+            results[q] = (statistics.median(like), statistics.median(fts))
+    await database.async_read_engine.dispose()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare expense search through the FTS5 index with LIKE scans.")
+    parser.add_argument("--expenses", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--budgets", type=int, default=5, help="budgets per user")
+    parser.add_argument("--limit", type=int, default=50, help="results per page")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/search.db"
+    sys.path.insert(0, os.path.join(ROOT, "Backend"))
+    from app import bootstrap, database
+
+    bootstrap.init_db()
+    started = time.perf_counter()
+    fill(database.engine, args.users, args.budgets, args.expenses)
+    print(f"Inserted and indexed {args.expenses} expenses in {time.perf_counter() - started:.1f} s")
+
+    per_user = args.expenses // args.users
+    print(f"\nFirst page ({args.limit} results) of one user's search (~{per_user} expenses), median of {args.runs} runs:")
+    print(f"{'query':<20}{'LIKE scan':>12}{'FTS5':>10}{'speedup':>10}")
+    for q, (like, fts) in asyncio.run(measure("user_0", args.runs, args.limit)).items():
+        print(f"{q:<20}{like * 1000:>9.1f} ms{fts * 1000:>7.1f} ms{like / fts:>9.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
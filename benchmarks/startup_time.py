@@ -0,0 +1,94 @@
+"""
+Service cold-start benchmark.
+
+Starts each service under uvicorn several times against a prepared database
+and reports the time from process start to the first answered request.
+
+    python benchmarks/startup_time.py --runs 5
+
+Use --backend-dir / --auth-dir to benchmark another checkout, e.g. a
+``git worktree`` of an older commit, to get before/after numbers.
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def bootstrap(service_dir, env):
+    """Prepare the schema once, as a deployment would, if the checkout has a bootstrap step."""
+    if os.path.exists(os.path.join(service_dir, "app", "bootstrap.py")):
+        subprocess.run([sys.executable, "-m", "app.bootstrap"], cwd=service_dir, env=env, check=True, capture_output=True)
+
+
+def time_to_first_request(service_dir, env, path, timeout=60):
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=service_dir,
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1).read()
+                return time.perf_counter() - started
+            except urllib.error.HTTPError:
+                return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.005)
+        raise RuntimeError(f"{service_dir} did not start")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def measure(name, service_dir, path, runs):
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{workdir}/{name}.db")
+    bootstrap(service_dir, env)
+    # The first start creates the database; only restarts are measured
+    time_to_first_request(service_dir, env, path)
+    samples = [time_to_first_request(service_dir, env, path) for _ in range(runs)]
+    return {
+        "runs": runs,
+        "median_ms": round(statistics.median(samples) * 1000, 1),
+        "min_ms": round(min(samples) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend-dir", default=os.path.join(ROOT, "Backend"))
+    parser.add_argument("--auth-dir", default=os.path.join(ROOT, "auth-service"))
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = {
+        "auth-service": measure("auth", args.auth_dir, "/docs", args.runs),
+        "budget-service": measure("budget", args.backend_dir, "/docs", args.runs),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+"""
+Load and latency benchmark suite for the Auth and Budget services.
+
+Seeds a synthetic dataset, starts both services under uvicorn, and keeps
+--concurrency virtual users replaying a weighted mix of operations for
+--duration seconds after a --warmup. Reports requests/sec and p50/p95/p99
+latency per operation, plus the SQL statements per request measured by each
+service's /metrics.
+
+    python benchmarks/suite.py --expenses 100000 --concurrency 50 --duration 30 \\
+        --output results.json --baseline benchmarks/baseline.json
+
+With --baseline, each operation is compared with the stored run and the
+exit status is 1 when any of them regressed by more than --tolerance.
+Use --save-baseline to store the current run there instead. Baselines are
+only comparable on the same machine and with the same settings, so none is
+committed: record one from the commit to compare against first. Results
+name the commit of the benchmarked Budget Service checkout.
+
+The services are spawned rather than imported: both are packages named
+``app``, so they cannot share one interpreter. Use --backend-dir /
+--auth-dir to benchmark another checkout, e.g. a ``git worktree`` of an
+older commit.
+
+The dataset has --expenses expenses spread over --users users with --budgets
+budgets each, written straight into the Budget Service database. The rollups
+are rebuilt afterwards with ``python -m app.rollups``. Only the first
+--login-users users are registered with the Auth Service, because every
+registration pays for a bcrypt hash. The others get tokens signed with the
+shared key.
+
+Admission control is switched off in both services unless --admission is
+given: its per-IP and per-user rate limits would turn most of the replayed
+logins and writes, all sent from one address, into 429s.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from jose import jwt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_KEY = "supersecretkey"
+PASSWORD = "benchpass123"
+
+# Operation -> (service, method, route template as labelled in /metrics)
+OPERATIONS = {
+    "login": ("auth", "POST", "/token"),
+    "list_budgets": ("budget", "GET", "/budgets/"),
+    "budget_summary": ("budget", "GET", "/budgets/summary"),
+    "list_expenses": ("budget", "GET", "/budgets/{budget_id}/expenses/"),
+    "add_expense": ("budget", "POST", "/budgets/{budget_id}/expenses/"),
+    "edit_expense": ("budget", "PUT", "/budgets/{budget_id}/expenses/{expense_id}"),
+    "delete_expense": ("budget", "DELETE", "/budgets/{budget_id}/expenses/{expense_id}"),
+    "rates": ("budget", "GET", "/rates/{currency}"),
+}
+DEFAULT_MIX = "login=2,list_budgets=25,budget_summary=10,list_expenses=20,add_expense=15,edit_expense=10,delete_expense=8,rates=10"
+CATEGORIES = ("Food", "Transport", "Housing", "Fun", "Health")
+
+
+class Rates(BaseHTTPRequestHandler):
+    delay = 0.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = json.dumps({"rates": {"EUR": 0.9, "GBP": 0.8, "JPY": 150.0}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name.strip()!r}; choose from {', '.join(OPERATIONS)}")
+        mix[name.strip()] = float(weight)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def user_name(n):
+    return f"bench_user_{n}"
+
+
+def index_words(value, owner):
+    """What the Budget Service's search index triggers call; ``index_words`` in Backend/app/search.py splits the same way on the ASCII text seeded here."""
+    if not value:
+        return ""
+    return " ".join(f"{owner}x{word}" for word in re.findall(r"[^\W_]+", value))
+
+
+def fill(path, users, budgets, expenses):
+    """Write the synthetic budgets and expenses; budget ``b`` belongs to user ``(b - 1) % users``."""
+    conn = sqlite3.connect(path)
+    conn.create_function("index_words", 2, index_words, deterministic=True)
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(expenses)")}
+        currency = ("currency, ", "'USD', ") if "currency" in columns else ("", "")
+        with conn:
+            conn.execute(
+                "WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < :count - 1) "
+                f"INSERT INTO budgets (id, name, \"limit\", {currency[0]}user_id) "
+                f"SELECT i + 1, 'Budget ' || i, 1000000.0, {currency[1]}'bench_user_' || (i % :users) FROM n",
+                {"count": users * budgets, "users": users},
+            )
+            conn.execute(
+                "WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < :count - 1) "
+                f"INSERT INTO expenses (description, amount, {currency[0]}category, date, budget_id) "
+                f"SELECT 'Expense ' || i, (abs(random()) % 10000) / 100.0, {currency[1]}"
+                "CASE abs(random()) % 5 WHEN 0 THEN 'Food' WHEN 1 THEN 'Transport' WHEN 2 THEN 'Housing' WHEN 3 THEN 'Fun' ELSE 'Health' END, "
+                "datetime('now', '-' || (abs(random()) % (730 * 86400)) || ' seconds'), i % :budgets + 1 FROM n",
+                {"count": expenses, "budgets": users * budgets},
+            )
+    finally:
+        conn.close()
+
+
+def scrape_sql(text):
+    """``{(method, route): (statements, requests)}`` from a /metrics page."""
+    totals = {}
+    for line in text.splitlines():
+        match = re.match(r'http_request_db_queries_(sum|count)\{method="([^"]+)",route="([^"]+)"\} (\S+)', line)
+        if match:
+            kind, method, route, value = match.groups()
+            sums = totals.setdefault((method, route), [0.0, 0.0])
+            sums[0 if kind == "sum" else 1] = float(value)
+    return totals
+
+
+async def wait_until_up(base_url, name, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(f"{base_url}/docs")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{name} did not start")
+
+
+class VirtualUser:
+    """Replays the mix as one user, over its own connection to each service."""
+
+    def __init__(self, n, args, urls, mix):
+        self.rng = random.Random(args.seed * 100003 + n)
+        self.user = n % args.users
+        self.login_user = n % args.login_users
+        self.budgets = [self.user + 1 + k * args.users for k in range(args.budgets)]
+        # fill() gives budget b the expenses b, b + stride, b + 2 * stride, ...
+        self.stride = args.users * args.budgets
+        self.seeded = args.expenses // self.stride
+        self.created = []  # (budget id, expense id) of expenses this user added
+        self.headers = {"Authorization": f"Bearer {jwt.encode({'sub': user_name(self.user)}, SECRET_KEY, algorithm='HS256')}"}
+        self.clients = {name: httpx.AsyncClient(base_url=url, timeout=120) for name, url in urls.items()}
+        self.names, self.weights = list(mix), list(mix.values())
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.aclose()
+
+    def expense_body(self):
+        return {"description": "Bench expense", "amount": round(self.rng.uniform(1, 100), 2), "category": self.rng.choice(CATEGORIES)}
+
+    async def step(self):
+        name = self.rng.choices(self.names, self.weights)[0]
+        if name == "delete_expense" and not self.created or name == "edit_expense" and not (self.created or self.seeded):
+            name = "add_expense"  # nothing to delete or edit yet
+        budget_id = self.rng.choice(self.budgets)
+        auth, budget = self.clients["auth"], self.clients["budget"]
+        started = time.perf_counter()
+        if name == "login":
+            response = await auth.post("/token", data={"username": user_name(self.login_user), "password": PASSWORD})
+        elif name == "list_budgets":
+            response = await budget.get("/budgets/", params={"include": "none"}, headers=self.headers)
+        elif name == "budget_summary":
+            response = await budget.get("/budgets/summary", headers=self.headers)
+        elif name == "list_expenses":
+            response = await budget.get(f"/budgets/{budget_id}/expenses/", params={"limit": 100}, headers=self.headers)
+        elif name == "add_expense":
+            response = await budget.post(f"/budgets/{budget_id}/expenses/", json=self.expense_body(), headers=self.headers)
+            if response.status_code == 200:
+                self.created.append((budget_id, response.json()["id"]))
+        elif name == "edit_expense":
+            if self.seeded and (not self.created or self.rng.random() < 0.5):
+                expense_id = budget_id + self.stride * self.rng.randrange(self.seeded)
+            else:
+                budget_id, expense_id = self.rng.choice(self.created)
+            response = await budget.put(f"/budgets/{budget_id}/expenses/{expense_id}", json=self.expense_body(), headers=self.headers)
+        elif name == "delete_expense":
+            budget_id, expense_id = self.created.pop(self.rng.randrange(len(self.created)))
+            response = await budget.delete(f"/budgets/{budget_id}/expenses/{expense_id}", headers=self.headers)
+        else:
+            response = await budget.get(f"/rates/{self.rng.choice(('USD', 'EUR', 'GBP'))}")
+        return name, time.perf_counter() - started, response.status_code < 400
+
+
+async def drive(args, urls, mix, duration):
+    latencies = {name: [] for name in mix}
+    errors = {name: 0 for name in mix}
+    users = [VirtualUser(n, args, urls, mix) for n in range(args.concurrency)]
+    deadline = time.perf_counter() + duration
+
+    async def loop(user):
+        while time.perf_counter() < deadline:
+            try:
+                name, elapsed, ok = await user.step()
+            except (httpx.HTTPError, ValueError, LookupError):
+                continue
+            latencies[name].append(elapsed)
+            if not ok:
+                errors[name] += 1
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(loop(user) for user in users))
+    finally:
+        for user in users:
+            await user.close()
+    return latencies, errors, time.perf_counter() - started
+
+
+async def scrape_all(urls):
+    async with httpx.AsyncClient(timeout=60) as client:
+        return {name: scrape_sql((await client.get(f"{url}/metrics")).text) for name, url in urls.items()}
+
+
+async def post_patiently(client, path, **kwargs):
+    """POST, waiting out 429 and 503 responses as Retry-After says"""
+    while True:
+        response = await client.post(path, **kwargs)
+        if response.status_code not in (429, 503):
+            return response
+        await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+
+
+async def measure(args, urls, mix):
+    async with httpx.AsyncClient(base_url=urls["auth"], timeout=120) as client:
+        for n in range(args.login_users):
+            response = await post_patiently(client, "/register", json={"username": user_name(n), "password": PASSWORD})
+            if response.status_code != 200:
+                raise RuntimeError(f"Registering {user_name(n)} failed with {response.status_code}: {response.text}")
+    if args.warmup:
+        await drive(args, urls, mix, args.warmup)
+    before = await scrape_all(urls)
+    latencies, errors, elapsed = await drive(args, urls, mix, args.duration)
+    after = await scrape_all(urls)
+
+    operations = {}
+    for name, values in latencies.items():
+        service, method, route = OPERATIONS[name]
+        statements, requests = (
+            a - b for a, b in zip(after[service].get((method, route), (0, 0)), before[service].get((method, route), (0, 0)))
+        )
+        operations[name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "requests_per_sec": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "sql_per_request": round(statements / requests, 2) if requests else None,
+        }
+    total = sum(len(values) for values in latencies.values())
+    everything = [value for values in latencies.values() for value in values]
+    return {
+        "requests": total,
+        "errors": sum(errors.values()),
+        "requests_per_sec": round(total / elapsed, 1),
+        "p50_ms": round(percentile(everything, 50) * 1000, 2),
+        "p95_ms": round(percentile(everything, 95) * 1000, 2),
+        "p99_ms": round(percentile(everything, 99) * 1000, 2),
+        "operations": operations,
+    }
+
+
+def start(app_dir, port, env):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning", "--backlog", "4096"],
+        cwd=app_dir,
+        env=env,
+    )
+
+
+async def run(args, mix):
+    rates = ThreadingHTTPServer(("127.0.0.1", 0), Rates)
+    rates.daemon_threads = True
+    Rates.delay = args.upstream_delay
+    threading.Thread(target=rates.serve_forever, daemon=True).start()
+
+    workdir = tempfile.mkdtemp()
+    ports = {"auth": free_port(), "budget": free_port()}
+    urls = {name: f"http://127.0.0.1:{port}" for name, port in ports.items()}
+    admission = "true" if args.admission else "false"
+    envs = {
+        "auth": dict(os.environ, DATABASE_URL=f"sqlite:///{workdir}/auth.db", ADMISSION_ENABLED=admission),
+        "budget": dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{workdir}/budget.db",
+            ADMISSION_ENABLED=admission,
+            RATES_API_URL=f"http://127.0.0.1:{rates.server_port}/latest/{{base}}",
+        ),
+    }
+    dirs = {"auth": args.auth_dir, "budget": args.backend_dir}
+    for name in dirs:
+        subprocess.run([sys.executable, "-m", "app.bootstrap"], cwd=dirs[name], env=envs[name], check=True, capture_output=True)
+
+    started = time.perf_counter()
+    fill(os.path.join(workdir, "budget.db"), args.users, args.budgets, args.expenses)
+    subprocess.run([sys.executable, "-m", "app.rollups"], cwd=args.backend_dir, env=envs["budget"], check=True, capture_output=True)
+    print(f"Seeded {args.expenses} expenses in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+    servers = [start(dirs[name], ports[name], envs[name]) for name in dirs]
+    try:
+        for name, url in urls.items():
+            await wait_until_up(url, name)
+        return await measure(args, urls, mix)
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+        rates.shutdown()
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against ``baseline``; return the operations that regressed."""
+    regressions = []
+    print(f"{'operation':<16}{'p95 ms':>18}{'req/s':>20}{'SQL/req':>14}", file=sys.stderr)
+    rows = dict(results["operations"], overall=results)
+    for name, current in rows.items():
+        previous = baseline["operations"].get(name) if name != "overall" else baseline
+        if not previous or not previous.get("count", previous.get("requests")):
+            continue
+        slower = current["p95_ms"] > previous["p95_ms"] * (1 + tolerance)
+        fewer = current["requests_per_sec"] < previous["requests_per_sec"] * (1 - tolerance)
+        sql = f"{previous.get('sql_per_request')} -> {current.get('sql_per_request')}" if name != "overall" else ""
+        flag = "  REGRESSED" if slower or fewer else ""
+        print(
+            f"{name:<16}{previous['p95_ms']:>8.1f} -> {current['p95_ms']:<7.1f}"
+            f"{previous['requests_per_sec']:>9.1f} -> {current['requests_per_sec']:<8.1f}{sql:>14}{flag}",
+            file=sys.stderr,
+        )
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def checkout_commit(path):
+    """The commit checked out at ``path``, marked ``-dirty`` with uncommitted changes; None outside git."""
+    try:
+        commit = subprocess.run(["git", "-C", path, "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "-C", path, "status", "--porcelain", "--", "."], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty.strip() else "")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend-dir", default=os.path.join(ROOT, "Backend"))
+    parser.add_argument("--auth-dir", default=os.path.join(ROOT, "auth-service"))
+    parser.add_argument("--expenses", type=int, default=100_000, help="seeded expenses, e.g. 1000 to 1000000")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--budgets", type=int, default=5, help="budgets per user")
+    parser.add_argument("--login-users", type=int, default=10, help="users registered with the Auth Service")
+    parser.add_argument("--concurrency", type=int, default=50, help="virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds first")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--admission", action="store_true", help="keep admission control and rate limiting on in the services")
+    parser.add_argument("--upstream-delay", type=float, default=0.0, help="seconds the rates stub takes to answer")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results here as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as --baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 and req/s change before it counts as a regression")
+    args = parser.parse_args(argv)
+    mix = args.mix if isinstance(args.mix, dict) else parse_mix(args.mix)
+    args.login_users = max(1, min(args.login_users, args.users))
+
+    results = asyncio.run(run(args, mix))
+    results["commit"] = checkout_commit(args.backend_dir)
+    results["settings"] = {
+        key: getattr(args, key)
+        for key in ("expenses", "users", "budgets", "concurrency", "duration", "warmup", "upstream_delay", "seed")
+    }
+    results["settings"]["mix"] = mix
+    body = json.dumps(results, indent=2)
+    print(body)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(body + "\n")
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(body + "\n")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"Baseline recorded at commit {baseline.get('commit') or 'unknown'}", file=sys.stderr)
+        if baseline.get("settings") != results["settings"]:
+            print("Warning: the baseline was run with different settings", file=sys.stderr)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())